@@ -0,0 +1,687 @@
+# Benchmarks del sistema médico (entrega_final.py)
+# Se generan datos sintéticos en una carpeta temporal con el mismo formato "campo|campo|..." de los TXT,
+# así nunca se tocan los archivos reales de la clínica.
+#
+# Uso:
+#   python benchmarks.py backends --tamanos 10000,100000,1000000
+#   python benchmarks.py importacion --filas 1000000 --procesos 1,2,4,8
+#   python benchmarks.py memoria --pacientes 1000000
+#   python benchmarks.py concurrencia --procesos 8 --pacientes 300
+#   python benchmarks.py diario
+#   python benchmarks.py servidor --pacientes 100000 --clientes 4 --consultas 5000
+#   python benchmarks.py suite --tamanos 10000,100000,1000000 --salida base.json
+#   python benchmarks.py suite --tamanos 10000,100000 --salida nuevo.json --comparar base.json
+#   python benchmarks.py arranque --presupuesto-ms 40
+import argparse
+import gc
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+CARPETA_PROYECTO = os.path.dirname(os.path.abspath(__file__))
+
+NOMBRES = ["ana", "juan", "maria", "carlos", "luisa", "pedro", "sofia", "andres", "valentina", "jorge",
+           "camila", "diego", "laura", "felipe", "daniela", "santiago", "paula", "mateo", "isabella", "geovanny"]
+APELLIDOS = ["gomez", "rodriguez", "lopez", "martinez", "garcia", "perez", "sanchez", "ramirez", "torres", "flores",
+             "rivera", "vargas", "castro", "ortiz", "moreno", "arismendy", "sabogal", "velexz", "lozano", "vanegas"]
+GENEROS = ["MASCULINO", "FEMENINO", "NO BINARIO", "PREFIERO NO DECIRLO"]
+SINTOMAS = [("fiebre", "tos", "dificultad para respirar"), ("nauseas", "vomitos", "dolor abdominal"),
+            ("dolor de garganta", "tos", "congestion nasal"), ("fiebre", "escalofrios", "dolor muscular"),
+            ("fie", "asds", "sd")]
+
+
+# Generar un paciente sintético con el mismo formato que guarda agregar_paciente
+def paciente_sintetico(i, rnd):
+    nombre = f"{rnd.choice(NOMBRES)} {rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)} {rnd.choice(APELLIDOS)}"
+    anio = rnd.randint(1940, 2020)
+    fecha_nac = f"{anio}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}"
+    documento = str(10000000 + i * 7)
+    celular = f"3{rnd.randint(0, 999999999):09d}"
+    fecha_reg = f"{rnd.randint(2015, 2025)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d} {rnd.randint(0, 23):02d}:{rnd.randint(0, 59):02d}:{rnd.randint(0, 59):02d}"
+    return [nombre, fecha_nac, rnd.choice(GENEROS), documento, celular, f"p{i}@correo.com", str(2025 - anio), fecha_reg]
+
+
+# Escribir pacientes.txt y los tres historiales en "carpeta". Devuelve la lista de documentos generados
+def generar_datos(carpeta, n_pacientes, historial_por_paciente=1, semilla=1234):
+    rnd = random.Random(semilla)
+    documentos = []
+    with open(os.path.join(carpeta, "pacientes.txt"), "w", encoding="utf-8") as fp, \
+            open(os.path.join(carpeta, "enfermedades.txt"), "w", encoding="utf-8") as fe, \
+            open(os.path.join(carpeta, "tratamientos.txt"), "w", encoding="utf-8") as ft, \
+            open(os.path.join(carpeta, "alergias.txt"), "w", encoding="utf-8") as fa:
+        for i in range(n_pacientes):
+            reg = paciente_sintetico(i, rnd)
+            documentos.append(reg[3])
+            fp.write("|".join(reg) + "\n")
+            for _ in range(historial_por_paciente):
+                fecha = reg[7]
+                fe.write(f"{reg[3]}|{','.join(rnd.choice(SINTOMAS))}|No determinada|{fecha}\n")
+                ft.write(f"{reg[3]}|acetaminofen, ibuprofeno|1 cada 8 horas, 1 cada dia|{fecha}\n")
+                fa.write(f"{reg[3]}|polen|estornudos, picazon|{fecha}\n")
+    return documentos
+
+
+# Archivo CSV como el que mandaría otra clínica; una de cada 100 filas tiene un correo inválido
+# y una de cada 333 repite un documento
+def generar_csv_importacion(ruta, n_filas, semilla=4321):
+    rnd = random.Random(semilla)
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write("nombre,fecha_nac,genero,documento,celular,correo\n")
+        for i in range(n_filas):
+            reg = paciente_sintetico(i, rnd)
+            if i % 100 == 0:
+                reg[5] = "sin-arroba"
+            if i % 333 == 0:
+                reg[3] = "10000000"
+            f.write(",".join([reg[0].title(), reg[1], reg[2].capitalize(), reg[3], reg[4], reg[5]]) + "\n")
+
+
+# Importar entrega_final con la carpeta de datos sintéticos como directorio de trabajo
+def importar_sistema(carpeta):
+    os.chdir(carpeta)
+    if CARPETA_PROYECTO not in sys.path:
+        sys.path.insert(0, CARPETA_PROYECTO)
+    import entrega_final
+    entrega_final.asegurar_archivos()
+    return entrega_final
+
+
+def cronometrar(funcion, *args):
+    inicio = time.perf_counter()
+    resultado = funcion(*args)
+    return time.perf_counter() - inicio, resultado
+
+
+# Mismas operaciones sobre el backend TXT y el backend SQLite
+def medir_backend(ef, backend, documentos, rnd, n_consultas=10000, n_agregados=1000, n_ediciones=100):
+    ef.BACKEND = backend
+    ef.reiniciar_indices()
+    res = {}
+    res["leer_registros_s"], _ = cronometrar(ef.leer_registros, ef.ARCH_PACIENTES)
+    res["carga_indice_s"], _ = cronometrar(ef.indice_pacientes)
+
+    muestra = [rnd.choice(documentos) for _ in range(n_consultas)]
+    t, _ = cronometrar(lambda: [ef.existe_documento(d) for d in muestra])
+    res["consultas_doc_por_s"] = n_consultas / t
+
+    t, _ = cronometrar(lambda: [ef.historial_de(ef.ARCH_ENFERMEDADES, d) for d in muestra])
+    res["historial_cold_mas_consultas_s"] = t
+
+    # Documentos nuevos que no chocan con los generados ni con los del otro backend
+    base = 900000000000 if backend == "txt" else 950000000000
+    nuevos = [paciente_sintetico(0, rnd) for _ in range(n_agregados)]
+    for i, reg in enumerate(nuevos):
+        reg[3] = str(base + i)
+    t, _ = cronometrar(lambda: [ef.agregar_registro(ef.ARCH_PACIENTES, reg) for reg in nuevos])
+    res["agregados_por_s"] = n_agregados / t
+
+    a_editar = [rnd.choice(documentos) for _ in range(n_ediciones)]
+    def editar():
+        for d in a_editar:
+            reg = ef.obtener_paciente(d)
+            reg[4] = "3000000000"
+            ef.actualizar_paciente(d, reg)
+    t, _ = cronometrar(editar)
+    res["ediciones_por_s"] = n_ediciones / t
+    return res
+
+
+def bench_backends(tamanos):
+    rnd = random.Random(99)
+    for n in tamanos:
+        with tempfile.TemporaryDirectory() as carpeta:
+            documentos = generar_datos(carpeta, n)
+            ef = importar_sistema(carpeta)
+            ef.ARCH_SQLITE = os.path.join(carpeta, "clinica.db")
+            t_migracion, _ = cronometrar(ef.migrar_a_sqlite, ef.ARCH_SQLITE)
+            print(f"\n=== {n} pacientes (migración a SQLite: {t_migracion:.2f} s) ===")
+            resultados = {backend: medir_backend(ef, backend, documentos, rnd) for backend in ("txt", "sqlite")}
+            print(f"{'Métrica':<34} {'txt':>14} {'sqlite':>14}")
+            for metrica in resultados["txt"]:
+                print(f"{metrica:<34} {resultados['txt'][metrica]:>14.4f} {resultados['sqlite'][metrica]:>14.4f}")
+            ef.cerrar_sqlite()
+            os.chdir(CARPETA_PROYECTO)
+
+
+# Misma importación con 1..N procesos validando en paralelo
+def bench_importacion(n_filas, lista_procesos):
+    with tempfile.TemporaryDirectory() as carpeta:
+        entrada = os.path.join(carpeta, "entrada.csv")
+        generar_csv_importacion(entrada, n_filas)
+        base = None
+        print(f"\n=== Importación de {n_filas} filas ({os.cpu_count()} núcleos disponibles) ===")
+        print(f"{'Procesos':>8} {'Segundos':>10} {'Filas/s':>12} {'Aceleración':>12}")
+        for procesos in lista_procesos:
+            datos = os.path.join(carpeta, f"datos_{procesos}")
+            os.mkdir(datos)
+            ef = importar_sistema(datos)
+            ef.reiniciar_indices()
+            t, (importados, rechazados) = cronometrar(ef.importar_pacientes, entrada, os.path.join(datos, "rechazos.txt"), procesos)
+            base = base or t
+            print(f"{procesos:>8} {t:>10.2f} {n_filas / t:>12.0f} {base / t:>11.2f}x")
+        os.chdir(CARPETA_PROYECTO)
+
+
+# Memoria del índice de pacientes en memoria con la lista de listas (por defecto) y con la tabla compacta
+# (CLINICA_INDICE_COMPACTO=1). Los dos índices tienen que devolver los mismos registros
+def bench_memoria(n_pacientes):
+    with tempfile.TemporaryDirectory() as carpeta:
+        generar_datos(carpeta, n_pacientes, historial_por_paciente=0)
+        ef = importar_sistema(carpeta)
+        resultados = {}
+        registros = {}
+        for nombre, compacto in (("lista de listas", False), ("tabla compacta", True)):
+            ef.INDICE_COMPACTO = compacto
+            ef.reiniciar_indices()
+            gc.collect()
+            tracemalloc.start()
+            inicio = time.perf_counter()
+            ef.indice_pacientes()
+            segundos = time.perf_counter() - inicio
+            actual, pico = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            resultados[nombre] = (actual, pico, segundos)
+            registros[nombre] = [list(reg) for reg in ef.pagina_pacientes("documento", 0, 1000)]
+        ef.INDICE_COMPACTO = False
+        ef.reiniciar_indices()
+        os.chdir(CARPETA_PROYECTO)
+    print(f"\n=== Memoria del índice de pacientes con {n_pacientes} pacientes ===")
+    print(f"{'Estructura':<18} {'En uso (MB)':>12} {'Pico (MB)':>12} {'Bytes/paciente':>15} {'Carga (s)':>10}")
+    for nombre, (actual, pico, segundos) in resultados.items():
+        print(f"{nombre:<18} {actual / 2**20:>12.1f} {pico / 2**20:>12.1f} {actual / n_pacientes:>15.0f} {segundos:>10.2f}")
+    if registros["lista de listas"] != registros["tabla compacta"]:
+        print(">>> ERROR: la tabla compacta no devuelve los mismos registros que la lista de listas")
+        return False
+    return True
+
+
+# Un proceso de la prueba de concurrencia: registra sus propios pacientes, intenta registrar los documentos
+# compartidos (que todos los procesos se pelean), edita la mitad de los suyos y les agrega una enfermedad
+def _trabajo_concurrencia(carpeta, proceso, n_pacientes, compartidos, limite_diario):
+    ef = importar_sistema(carpeta)
+    ef.LIMITE_DIARIO_BYTES = limite_diario  # Diario pequeño para que también haya compactaciones en medio
+    rnd = random.Random(proceso)
+    ganados = []
+    for i in range(n_pacientes):
+        reg = paciente_sintetico(i, rnd)
+        reg[3] = str(500000000 + proceso * 100000 + i)
+        if not ef.registrar_paciente(reg):
+            raise RuntimeError(f"El documento {reg[3]} aparece como repetido sin haberse registrado antes")
+        if i < compartidos:
+            otro = paciente_sintetico(i, rnd)
+            otro[3] = str(400000000 + i)
+            if ef.registrar_paciente(otro):
+                ganados.append(otro[3])
+        if i % 2 == 0:
+            reg[4] = f"3{proceso:03d}{i:06d}"
+            ef.guardar_edicion_paciente(reg[3], reg)
+        ef.agregar_registro(ef.ARCH_ENFERMEDADES, [reg[3], "fiebre,tos,dificultad para respirar", "No determinada", reg[7]])
+    return ganados
+
+
+# Varios procesos escribiendo a la vez en la misma carpeta; al final se revisa que no se perdió ni se repitió nada
+def bench_concurrencia(n_procesos, n_pacientes, compartidos, limite_diario=16 * 1024):
+    with tempfile.TemporaryDirectory() as carpeta:
+        importar_sistema(carpeta)
+        inicio = time.perf_counter()
+        # "spawn": cada proceso arranca limpio, como otro equipo de la recepción
+        with ProcessPoolExecutor(n_procesos, mp_context=multiprocessing.get_context("spawn")) as ejecutor:
+            futuros = [ejecutor.submit(_trabajo_concurrencia, carpeta, p, n_pacientes, compartidos, limite_diario)
+                       for p in range(n_procesos)]
+            ganados = Counter(doc for futuro in futuros for doc in futuro.result())
+        segundos = time.perf_counter() - inicio
+
+        ef = importar_sistema(carpeta)
+        ef.reiniciar_indices()
+        registros = ef.leer_registros(ef.ARCH_PACIENTES)
+        documentos = Counter(reg[3] for reg in registros)
+        celulares = {reg[3]: reg[4] for reg in registros}
+        errores = []
+        esperados = n_procesos * n_pacientes + compartidos
+        if len(documentos) != esperados:
+            errores.append(f"{len(documentos)} documentos distintos, se esperaban {esperados}")
+        repetidos = [doc for doc, n in documentos.items() if n > 1]
+        if repetidos:
+            errores.append(f"{len(repetidos)} documentos repetidos en pacientes.txt (por ejemplo {repetidos[0]})")
+        if sorted(ganados) != [str(400000000 + i) for i in range(compartidos)] or max(ganados.values(), default=1) != 1:
+            errores.append("Cada documento compartido debía quedar registrado por un solo proceso")
+        mal_formados = sum(1 for reg in registros if len(reg) != 8)
+        if mal_formados:
+            errores.append(f"{mal_formados} líneas de pacientes.txt con campos de más o de menos")
+        perdidas = sum(1 for p in range(n_procesos) for i in range(0, n_pacientes, 2)
+                       if celulares.get(str(500000000 + p * 100000 + i)) != f"3{p:03d}{i:06d}")
+        if perdidas:
+            errores.append(f"{perdidas} ediciones perdidas")
+        enfermedades = ef.leer_registros(ef.ARCH_ENFERMEDADES)
+        if len(enfermedades) != n_procesos * n_pacientes or any(len(reg) != 4 for reg in enfermedades):
+            errores.append(f"{len(enfermedades)} enfermedades, se esperaban {n_procesos * n_pacientes} completas")
+        ef.reiniciar_indices()
+        os.chdir(CARPETA_PROYECTO)
+
+    operaciones = n_procesos * (n_pacientes * 2.5 + compartidos)
+    print(f"\n=== {n_procesos} procesos x {n_pacientes} pacientes ({compartidos} documentos compartidos) ===")
+    print(f"{operaciones:.0f} escrituras en {segundos:.2f} s ({operaciones / segundos:.0f} por segundo)")
+    if errores:
+        for error in errores:
+            print(f">>> ERROR: {error}")
+        return False
+    print(">>> Sin registros perdidos ni repetidos.")
+    return True
+
+
+# Anota un error si lo obtenido no es lo esperado
+def _revisar(errores, que, obtenido, esperado):
+    if obtenido != esperado:
+        errores.append(f"{que}: se obtuvo {obtenido!r}, se esperaba {esperado!r}")
+
+
+# Un paciente cambia de documento, otro se registra con el documento que quedó libre y los dos se vuelven a editar.
+# Al recargar desde pacientes.txt + pacientes.log cada edición tiene que caer en su paciente, antes y después de compactar,
+# y las consultas sin el índice en memoria (pacientes.idx + diario) tienen que ver lo mismo
+def bench_diario():
+    errores = []
+    with tempfile.TemporaryDirectory() as carpeta:
+        ef = importar_sistema(carpeta)
+        ef.reiniciar_indices()
+        rnd = random.Random(11111)
+        a = paciente_sintetico(0, rnd)
+        b = paciente_sintetico(1, rnd)
+        a[3], a[4] = "11111", "3000000001"
+        b[3], b[4] = "11111", "3000000002"
+        ef.registrar_paciente(a)
+        a[3] = "22222"
+        ef.guardar_edicion_paciente("11111", list(a))
+        _revisar(errores, "Registrar el documento que quedó libre", ef.registrar_paciente(b), True)
+        b[4] = "3000000003"
+        ef.guardar_edicion_paciente("11111", list(b))
+        a[3], a[4] = "33333", "3000000004"
+        ef.guardar_edicion_paciente("22222", list(a))
+        esperado = {"33333": a[4], "11111": b[4]}
+        tercero = paciente_sintetico(2, rnd)
+        tercero[3] = "11111"
+
+        for momento in ("con el diario", "después de compactar"):
+            ef.reiniciar_indices()  # Sin índice en memoria: las consultas por documento van a pacientes.idx
+            for doc in ("11111", "22222", "33333"):
+                reg = ef.leer_paciente(doc)
+                _revisar(errores, f"leer_paciente({doc}) {momento}", reg and reg[4], esperado.get(doc))
+            _revisar(errores, f"existe_documento(11111) {momento}", ef.existe_documento("11111"), True)
+            _revisar(errores, f"documentos_pacientes() {momento}", ef.documentos_pacientes(), set(esperado))
+            _revisar(errores, f"Registrar otra vez 11111 {momento}", ef.registrar_paciente(tercero), False)
+            ef.reiniciar_indices()
+            registros = ef.leer_registros(ef.ARCH_PACIENTES)
+            _revisar(errores, f"Documento -> celular {momento}", {reg[3]: reg[4] for reg in registros}, esperado)
+            _revisar(errores, f"Pacientes {momento}", len(registros), 2)
+            ef.compactar_pacientes()
+        ef.reiniciar_indices()
+        os.chdir(CARPETA_PROYECTO)
+
+    print("\n=== Diario: cambio de documento, documento reutilizado y nuevas ediciones ===")
+    for error in errores:
+        print(f">>> ERROR: {error}")
+    if not errores:
+        print(">>> Cada edición quedó en su paciente.")
+    return not errores
+
+
+def _percentil(ordenados, p):
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+# Un cliente de la prueba de carga: una conexión persistente y "n" peticiones a documentos al azar.
+# Devuelve (hora de inicio, hora de fin, latencia de cada petición en segundos)
+def _cliente_carga(puerto, documentos, n, metodo, ruta, cuerpo, semilla):
+    import http.client
+    rnd = random.Random(semilla)
+    conexion = http.client.HTTPConnection("127.0.0.1", puerto)
+    datos = json.dumps(cuerpo).encode("utf-8") if cuerpo is not None else None
+    encabezados = {"Content-Type": "application/json"} if datos is not None else {}
+    latencias = []
+    inicio = time.time()
+    for _ in range(n):
+        antes = time.perf_counter()
+        conexion.request(metodo, ruta.format(rnd.choice(documentos)), body=datos, headers=encabezados)
+        respuesta = conexion.getresponse()
+        respuesta.read()
+        latencias.append(time.perf_counter() - antes)
+        if respuesta.status not in (200, 201):
+            raise RuntimeError(f"{metodo} {ruta} respondió {respuesta.status}")
+    fin = time.time()
+    conexion.close()
+    return inicio, fin, latencias
+
+
+# Levanta "entrega_final.py servidor" sobre datos sintéticos y lo carga con varios clientes en procesos aparte
+def bench_servidor(n_pacientes, n_clientes, n_consultas):
+    pruebas = (
+        ("consulta por documento", "GET", "/pacientes/{}", None, n_consultas),
+        ("historial completo", "GET", "/pacientes/{}/historial", None, n_consultas),
+        ("búsqueda por nombre", "GET", "/pacientes?nombre=mar&limite=20&documento={}", None, n_consultas // 5),
+        ("agregar alergia", "POST", "/pacientes/{}/alergias", {"alergeno": "polen", "sintomas": "estornudos"}, n_consultas // 10),
+    )
+    with tempfile.TemporaryDirectory() as carpeta:
+        documentos = generar_datos(carpeta, n_pacientes)
+        inicio = time.perf_counter()
+        servidor = subprocess.Popen([sys.executable, os.path.join(CARPETA_PROYECTO, "entrega_final.py"), "servidor", "--puerto", "0"],
+                                    cwd=carpeta, stdout=subprocess.PIPE, text=True)
+        try:
+            linea = servidor.stdout.readline()  # El servidor avisa cuando ya cargó los índices y abrió el puerto
+            encontrado = re.search(r":(\d+) ", linea)
+            if encontrado is None:
+                raise RuntimeError(f"El servidor no arrancó: {linea!r}")
+            puerto = int(encontrado.group(1))
+            print(f"\n=== Servidor con {n_pacientes} pacientes, {n_clientes} clientes ({os.cpu_count()} núcleos) ===")
+            print(f"Arranque con índices cargados: {time.perf_counter() - inicio:.2f} s")
+            print(f"{'Prueba':<24} {'Peticiones':>10} {'Por segundo':>12} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+            with ProcessPoolExecutor(n_clientes, mp_context=multiprocessing.get_context("spawn")) as ejecutor:
+                for nombre, metodo, ruta, cuerpo, n in pruebas:
+                    por_cliente = max(1, n // n_clientes)
+                    futuros = [ejecutor.submit(_cliente_carga, puerto, documentos, por_cliente, metodo, ruta, cuerpo, c)
+                               for c in range(n_clientes)]
+                    resultados = [futuro.result() for futuro in futuros]
+                    segundos = max(r[1] for r in resultados) - min(r[0] for r in resultados)
+                    latencias = sorted(x for r in resultados for x in r[2])
+                    print(f"{nombre:<24} {len(latencias):>10} {len(latencias) / segundos:>12.0f} "
+                          f"{_percentil(latencias, 50) * 1000:>9.2f} {_percentil(latencias, 99) * 1000:>9.2f}")
+        finally:
+            servidor.terminate()
+            servidor.wait()
+
+
+# ---------------------------
+#  Suite de rutas críticas (almacenamiento, búsqueda, historial, listado, diagnóstico)
+# ---------------------------
+
+# Las funciones de consola piden datos con input() e imprimen con print(). Para medirlas tal cual se les
+# cambian esas dos funciones dentro del módulo (las globales del módulo se buscan antes que las integradas)
+class ConsolaGuionada:
+    def __init__(self, ef, respuestas):
+        self.ef = ef
+        self.respuestas = iter(respuestas)
+
+    def __enter__(self):
+        self.ef.input = lambda mensaje="": next(self.respuestas)
+        self.ef.print = lambda *args, **kwargs: None
+        return self
+
+    def __exit__(self, *error):
+        del self.ef.input
+        del self.ef.print
+
+
+# Latencias en segundos -> operaciones, operaciones por segundo, p50 y p99 en milisegundos
+def _resumen(latencias, pico_mb=None):
+    ordenadas = sorted(latencias)
+    total = sum(ordenadas)
+    return {
+        "operaciones": len(ordenadas),
+        "por_segundo": len(ordenadas) / total if total else None,
+        "p50_ms": _percentil(ordenadas, 50) * 1000,
+        "p99_ms": _percentil(ordenadas, 99) * 1000,
+        "total_s": total,
+        "pico_mb": pico_mb,
+    }
+
+
+# Llama operacion(arg) por cada argumento y devuelve la latencia de cada llamada
+def _latencias(operacion, argumentos, preparar=None):
+    latencias = []
+    gc.collect()  # Que la basura de la prueba anterior no se cobre en esta
+    for arg in argumentos:
+        if preparar is not None:
+            preparar()
+        antes = time.perf_counter()
+        operacion(arg)
+        latencias.append(time.perf_counter() - antes)
+    return latencias
+
+
+# Memoria máxima (MB) que pide una sola ejecución de "funcion". Se mide aparte porque tracemalloc frena los tiempos
+def _pico_memoria(funcion, preparar=None):
+    if preparar is not None:
+        preparar()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        funcion()
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+
+def _medir_rutas(ef, documentos, rnd, repeticiones):
+    muestra = [rnd.choice(documentos) for _ in range(repeticiones)]
+    res = {}
+
+    def olvidar_pacientes():
+        ef.reiniciar_indices()
+
+    def leer():
+        ef.leer_registros(ef.ARCH_PACIENTES)
+    res["leer_registros"] = _resumen(_latencias(lambda _: leer(), range(3)), _pico_memoria(leer))
+
+    # Primera consulta después de arrancar: arma el índice en memoria (o lee pacientes.idx)
+    res["indice_pacientes_carga"] = _resumen(_latencias(lambda _: ef.indice_pacientes(), range(3), olvidar_pacientes),
+                                             _pico_memoria(ef.indice_pacientes, olvidar_pacientes))
+    ef.indice_pacientes()
+    res["existe_documento"] = _resumen(_latencias(ef.existe_documento, muestra))
+    res["existe_documento_ausente"] = _resumen(_latencias(ef.existe_documento, [str(i) for i in range(repeticiones)]))
+
+    with ConsolaGuionada(ef, itertools.repeat("")):
+        res["buscar_por_documento"] = _resumen(_latencias(ef.buscar_paciente_por_doc_o_nombre, muestra))
+    # Por nombre completo; si hay varios pacientes con ese nombre, la consola pide elegir y se responde con el documento
+    registros = [ef.obtener_paciente(doc) for doc in muestra[:max(1, repeticiones // 10)]]
+    with ConsolaGuionada(ef, itertools.cycle(reg[3] for reg in registros)):
+        res["buscar_por_nombre"] = _resumen(_latencias(lambda reg: ef.buscar_paciente_por_doc_o_nombre(reg[0]), registros))
+    palabras = [ef.obtener_paciente(doc)[0].split()[-1][:4] for doc in muestra[:max(1, repeticiones // 10)]]
+    res["buscar_nombre_contiene"] = _resumen(_latencias(ef.buscar_nombre_contiene, palabras))
+
+    with ConsolaGuionada(ef, itertools.repeat("")):
+        res["mostrar_historial_frio"] = _resumen(_latencias(ef.mostrar_historial, muestra[:1]), _pico_memoria(
+            lambda: ef.mostrar_historial(muestra[0]), lambda: [ef._indices_historial[r].update(firma=None) for r in ef.ARCHIVOS_HISTORIAL]))
+        res["mostrar_historial"] = _resumen(_latencias(ef.mostrar_historial, muestra))
+
+    # editar_paciente con las respuestas de la consola: documento, Enter x4, celular nuevo, Enter
+    a_editar = muestra[:max(1, repeticiones // 10)]
+    respuestas = itertools.chain.from_iterable([doc, "", "", "", "", f"31{i:08d}", ""] for i, doc in enumerate(a_editar))
+    with ConsolaGuionada(ef, respuestas):
+        res["editar_paciente"] = _resumen(_latencias(lambda _: ef.editar_paciente(), a_editar))
+    # La ruta de reescritura: las ediciones del diario pasan a pacientes.txt con archivo temporal + os.replace
+    res["compactar_pacientes"] = _resumen(_latencias(lambda _: ef.compactar_pacientes(), range(1)),
+                                          _pico_memoria(ef.compactar_pacientes, lambda: ef.actualizar_paciente(a_editar[0], ef.obtener_paciente(a_editar[0]))))
+
+    def sin_ordenes():
+        ef._ordenes_listado["ordenes"] = {}
+    for orden, opcion in (("registro", "1"), ("documento", "2"), ("edad", "3"), ("nombre", "4")):
+        with ConsolaGuionada(ef, itertools.cycle([opcion, "0"])):  # Elige el orden y se sale después de la primera página
+            res[f"listar_{orden}_frio"] = _resumen(_latencias(lambda _: ef.listar_pacientes(), range(3), sin_ordenes),
+                                                   _pico_memoria(ef.listar_pacientes, sin_ordenes))
+            res[f"listar_{orden}"] = _resumen(_latencias(lambda _: ef.listar_pacientes(), range(min(repeticiones, 200))))
+
+    recetas = list(ef.recetas)
+    sintomas = [rnd.choice(recetas) if i % 2 else tuple(rnd.choice(SINTOMAS)) for i in range(repeticiones)]
+    res["diagnosticar"] = _resumen(_latencias(lambda s: ef.diagnosticar(*s), sintomas))
+    res["diagnosticar_lote"] = _resumen(_latencias(ef.diagnosticar_lote, [[list(s) for s in sintomas]]))
+    return res
+
+
+def bench_suite(tamanos, historial_por_paciente, repeticiones, ruta_salida, ruta_comparar=None, tolerancia=0.20):
+    resultados = {
+        "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "nucleos": os.cpu_count(),
+        "historial_por_paciente": historial_por_paciente,
+        "tamanos": {},
+    }
+    rnd = random.Random(2024)
+    for n in tamanos:
+        with tempfile.TemporaryDirectory() as carpeta:
+            documentos = generar_datos(carpeta, n, historial_por_paciente)
+            ef = importar_sistema(carpeta)
+            ef.reiniciar_indices()
+            inicio = time.perf_counter()
+            resultados["tamanos"][str(n)] = _medir_rutas(ef, documentos, rnd, repeticiones)
+            print(f"\n=== {n} pacientes, {n * historial_por_paciente} filas por historial ({time.perf_counter() - inicio:.1f} s) ===")
+            _imprimir_suite(resultados["tamanos"][str(n)])
+            ef.reiniciar_indices()
+            os.chdir(CARPETA_PROYECTO)
+    with open(ruta_salida, "w", encoding="utf-8") as f:
+        json.dump(resultados, f, indent=2, ensure_ascii=False)
+    print(f"\n>>> Resultados guardados en {ruta_salida}")
+    if ruta_comparar:
+        with open(ruta_comparar, "r", encoding="utf-8") as f:
+            return _comparar_suite(json.load(f), resultados, tolerancia)
+    return True
+
+
+def _imprimir_suite(res):
+    print(f"{'Ruta':<28} {'Ops':>6} {'Ops/s':>12} {'p50 (ms)':>10} {'p99 (ms)':>10} {'Pico (MB)':>10}")
+    for nombre, r in res.items():
+        pico = f"{r['pico_mb']:.1f}" if r["pico_mb"] is not None else "-"
+        print(f"{nombre:<28} {r['operaciones']:>6} {r['por_segundo'] or 0:>12.1f} {r['p50_ms']:>10.3f} {r['p99_ms']:>10.3f} {pico:>10}")
+
+
+# Compara la mediana de cada ruta contra una corrida anterior; más lenta que la tolerancia cuenta como regresión
+def _comparar_suite(anterior, actual, tolerancia=0.20):
+    regresiones = 0
+    for n, rutas in actual["tamanos"].items():
+        previas = anterior["tamanos"].get(n)
+        if previas is None:
+            continue
+        print(f"\n=== Comparación con {anterior['fecha']}: {n} pacientes ===")
+        print(f"{'Ruta':<28} {'p50 antes':>10} {'p50 ahora':>10} {'Cambio':>8}")
+        for nombre, r in rutas.items():
+            if nombre not in previas or not previas[nombre]["p50_ms"]:
+                continue
+            cambio = r["p50_ms"] / previas[nombre]["p50_ms"] - 1
+            marca = "  << regresión" if cambio > tolerancia else ""
+            regresiones += cambio > tolerancia
+            print(f"{nombre:<28} {previas[nombre]['p50_ms']:>10.3f} {r['p50_ms']:>10.3f} {cambio:>+8.0%}{marca}")
+    print(f"\n>>> {regresiones} rutas más de {tolerancia:.0%} más lentas que antes.")
+    return regresiones == 0
+
+
+# Módulos que solo deben cargarse al abrir la interfaz o al usar la función que los necesita
+IMPORTACIONES_PEREZOSAS = ("tkinter", "PIL", "numpy", "sqlite3", "csv")
+
+
+# Lee la salida de "python -X importtime": {módulo: (propio_us, acumulado_us)}
+def _tiempos_importacion(salida):
+    tiempos = {}
+    for linea in salida.splitlines():
+        m = re.match(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)", linea)
+        if m:
+            tiempos[m.group(4)] = (int(m.group(1)), int(m.group(2)))
+    return tiempos
+
+
+# Tiempo de "import entrega_final" medido con -X importtime en un proceso nuevo. Falla si pasa el presupuesto,
+# si se importa algo de IMPORTACIONES_PEREZOSAS o si al importar se crean archivos en la carpeta de trabajo
+def bench_arranque(presupuesto_ms, repeticiones):
+    entorno = dict(os.environ, PYTHONPATH=CARPETA_PROYECTO)
+    entorno.pop("PYTHONDONTWRITEBYTECODE", None)  # Se mide con el .pyc ya compilado, como en un arranque normal
+    entorno.pop("CLINICA_INSTRUMENTAR", None)
+    entorno.pop("CLINICA_PERFIL", None)
+    errores = []
+    with tempfile.TemporaryDirectory() as carpeta:
+        corridas = []
+        for _ in range(repeticiones + 1):  # La primera solo compila el .pyc
+            proceso = subprocess.run([sys.executable, "-X", "importtime", "-c", "import entrega_final"],
+                                     cwd=carpeta, env=entorno, capture_output=True, text=True)
+            if proceso.returncode != 0:
+                print(proceso.stderr)
+                return False
+            corridas.append(_tiempos_importacion(proceso.stderr))
+        creados = os.listdir(carpeta)
+    corridas = corridas[1:]
+    acumulados = sorted(c["entrega_final"][1] / 1000 for c in corridas)
+    mediana = _percentil(acumulados, 50)
+
+    print(f"\n=== import entrega_final ({repeticiones} procesos nuevos) ===")
+    print(f"Mediana {mediana:.1f} ms, mínimo {acumulados[0]:.1f} ms, máximo {acumulados[-1]:.1f} ms (presupuesto {presupuesto_ms:.0f} ms)")
+    ultima = corridas[len(corridas) // 2]
+    print(f"\n{'Módulo':<32} {'Propio (ms)':>12} {'Acumulado (ms)':>15}")
+    for modulo, (propio, acumulado) in sorted(ultima.items(), key=lambda t: -t[1][1])[1:11]:
+        print(f"{modulo:<32} {propio / 1000:>12.2f} {acumulado / 1000:>15.2f}")
+
+    if mediana > presupuesto_ms:
+        errores.append(f"El import tarda {mediana:.1f} ms, más que el presupuesto de {presupuesto_ms:.0f} ms")
+    cargados = sorted({m for c in corridas for m in c if m.split(".")[0] in IMPORTACIONES_PEREZOSAS})
+    if cargados:
+        errores.append("Se importan al arrancar: " + ", ".join(cargados))
+    if creados:
+        errores.append("Importar el módulo creó archivos: " + ", ".join(sorted(creados)))
+    for error in errores:
+        print(f">>> ERROR: {error}")
+    if not errores:
+        print("\n>>> Arranque dentro del presupuesto, sin importaciones pesadas ni archivos creados.")
+    return not errores
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Benchmarks del sistema médico.")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_back = sub.add_parser("backends", help="Compara el backend TXT con el backend SQLite")
+    p_back.add_argument("--tamanos", default="10000,100000,1000000", help="Cantidades de pacientes separadas por comas")
+    p_imp = sub.add_parser("importacion", help="Escalamiento de la importación masiva con varios procesos")
+    p_imp.add_argument("--filas", type=int, default=1000000)
+    p_imp.add_argument("--procesos", default=",".join(str(2 ** i) for i in range(4)), help="Cantidades de procesos separadas por comas")
+    p_mem = sub.add_parser("memoria", help="Memoria del índice de pacientes: lista de listas contra la tabla compacta")
+    p_mem.add_argument("--pacientes", type=int, default=1000000)
+    p_con = sub.add_parser("concurrencia", help="Varios procesos registrando y editando pacientes en la misma carpeta")
+    p_con.add_argument("--procesos", type=int, default=8)
+    p_con.add_argument("--pacientes", type=int, default=300, help="Pacientes que registra cada proceso")
+    p_con.add_argument("--compartidos", type=int, default=50, help="Documentos que todos los procesos intentan registrar")
+    sub.add_parser("diario", help="Revisa que el diario de ediciones se repita bien cuando se reutiliza un documento")
+    p_srv = sub.add_parser("servidor", help="Prueba de carga del servidor HTTP/JSON")
+    p_srv.add_argument("--pacientes", type=int, default=100000)
+    p_srv.add_argument("--clientes", type=int, default=4, help="Procesos cliente, cada uno con una conexión persistente")
+    p_srv.add_argument("--consultas", type=int, default=20000, help="Peticiones de la prueba principal (entre todos los clientes)")
+    p_suite = sub.add_parser("suite", help="Rutas críticas con p50/p99 y pico de memoria; resultados en JSON")
+    p_suite.add_argument("--tamanos", default="10000,100000,1000000", help="Cantidades de pacientes separadas por comas")
+    p_suite.add_argument("--historial", type=int, default=2, help="Filas de cada historial por paciente")
+    p_suite.add_argument("--repeticiones", type=int, default=2000, help="Llamadas por cada ruta rápida")
+    p_suite.add_argument("--salida", default="resultados_benchmarks.json")
+    p_suite.add_argument("--comparar", help="JSON de una corrida anterior; sale con código 1 si hay regresiones")
+    p_suite.add_argument("--tolerancia", type=float, default=0.20, help="Cuánto más lenta puede ser una ruta sin contar como regresión")
+    p_arr = sub.add_parser("arranque", help="Tiempo de importación del módulo contra un presupuesto (python -X importtime)")
+    p_arr.add_argument("--presupuesto-ms", type=float, default=40.0)
+    p_arr.add_argument("--repeticiones", type=int, default=15, help="Procesos nuevos a medir; se toma la mediana")
+    args = parser.parse_args(argumentos)
+
+    if args.comando == "backends":
+        bench_backends([int(n) for n in args.tamanos.split(",")])
+    elif args.comando == "importacion":
+        bench_importacion(args.filas, [int(n) for n in args.procesos.split(",")])
+    elif args.comando == "memoria":
+        return 0 if bench_memoria(args.pacientes) else 1
+    elif args.comando == "concurrencia":
+        return 0 if bench_concurrencia(args.procesos, args.pacientes, min(args.compartidos, args.pacientes)) else 1
+    elif args.comando == "diario":
+        return 0 if bench_diario() else 1
+    elif args.comando == "servidor":
+        bench_servidor(args.pacientes, args.clientes, args.consultas)
+    elif args.comando == "suite":
+        ruta_salida = os.path.abspath(args.salida)  # Los benchmarks cambian de carpeta de trabajo
+        ruta_comparar = os.path.abspath(args.comparar) if args.comparar else None
+        tamanos = [int(n) for n in args.tamanos.split(",")]
+        return 0 if bench_suite(tamanos, args.historial, args.repeticiones, ruta_salida, ruta_comparar, args.tolerancia) else 1
+    elif args.comando == "arranque":
+        return 0 if bench_arranque(args.presupuesto_ms, args.repeticiones) else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,31 @@
+import bisect
+import errno
+import functools
+import heapq
+import itertools
+import mmap
 import os
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
 from datetime import date
 
-# Imports opcionales para la interfaz gráfica
+# tkinter, PIL, NumPy, sqlite3 y csv se importan la primera vez que se usan (ver cargar_interfaz, cargar_logo,
+# _numpy, _sqlite y _filas_importacion): la consola y los comandos arrancan sin pagar por la interfaz gráfica
+tk = ttk = messagebox = None
+# Bloqueos entre procesos: fcntl en Linux/macOS, msvcrt en Windows (si no hay ninguno, no se bloquea)
 try:
-    import tkinter as tk
-    import tkinter.ttk as ttk
-    import tkinter.messagebox as messagebox
-except Exception:
-    tk = None
+    import fcntl
+except ImportError:
+    fcntl = None
 try:
-    from PIL import Image, ImageTk
-    PIL_AVAILABLE = True
-except Exception:
-    PIL_AVAILABLE = False
+    import msvcrt
+except ImportError:
+    msvcrt = None
     
 
 # Archivos TXT
@@ -21,11 +34,33 @@ ARCH_ENFERMEDADES = "enfermedades.txt"
 ARCH_TRATAMIENTOS = "tratamientos.txt"
 ARCH_ALERGIAS = "alergias.txt"
 
-# Asegurar existencia de archivos
-for _f in [ARCH_PACIENTES, ARCH_ENFERMEDADES, ARCH_TRATAMIENTOS, ARCH_ALERGIAS]:
-    if not os.path.exists(_f):
-        with open(_f, "w", encoding="utf-8"): # Abre el archivo y lo cierra, para crearlo
-            pass
+TAM_PAGINA_CONSOLA = 30  # Pacientes por página en el listado de consola
+LIMITE_ACTUALIZACION_INCREMENTAL = 1000  # Si se agregan más registros de una vez, los índices se recargan en lugar de actualizarse
+
+# Diario de cambios (solo se le agregan líneas): las ediciones de pacientes se anotan aquí
+# en lugar de reescribir todo pacientes.txt. Cada línea es: documento_original|registro nuevo
+ARCH_DIARIO_PACIENTES = "pacientes.log"
+DIARIOS = {ARCH_PACIENTES: ARCH_DIARIO_PACIENTES}
+LIMITE_DIARIO_BYTES = 1024 * 1024  # Al pasar este tamaño el diario se compacta dentro de pacientes.txt
+ARCH_INDICE_PACIENTES = "pacientes.idx"  # Documento -> posición de su línea en pacientes.txt (se reconstruye solo)
+ARCH_BLOQUEO = "clinica.lock"  # Archivo vacío que solo sirve para coordinar a varios equipos que usan la misma carpeta
+
+# Dónde se guardan los datos: "txt" (por defecto, los archivos de arriba) o "sqlite" (un solo archivo .db).
+# Se elige con las variables de entorno CLINICA_BACKEND y CLINICA_DB
+BACKEND = os.environ.get("CLINICA_BACKEND", "txt").strip().lower()
+ARCH_SQLITE = os.environ.get("CLINICA_DB", "clinica.db")
+
+# Con CLINICA_INDICE_COMPACTO=1 el índice de pacientes en memoria guarda los datos en la tabla por columnas
+# (ver TablaPacientes) en vez de una lista de 8 textos por paciente: ocupa mucho menos con cientos de miles de
+# pacientes, a cambio de una carga más lenta y de armar el texto de cada campo cuando se lee
+INDICE_COMPACTO = os.environ.get("CLINICA_INDICE_COMPACTO", "").strip() not in ("", "0")
+
+# Asegurar existencia de archivos. Se llama al arrancar el programa (no al importar el módulo)
+def asegurar_archivos():
+    for _f in [ARCH_PACIENTES, ARCH_ENFERMEDADES, ARCH_TRATAMIENTOS, ARCH_ALERGIAS]:
+        if not os.path.exists(_f):
+            with open(_f, "w", encoding="utf-8"): # Abre el archivo y lo cierra, para crearlo
+                pass
 
 # Normalizar el texto ingresado por el usuario, para no generar conflictos
 def _norm(s):
@@ -116,7 +151,7 @@ def hoy():
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # 2025-12-01 14:30:45
 
 # Leer todas las líneas de un archivo como listas de campos separados por "|"
-def leer_registros(ruta):
+def _leer_lineas(ruta):
     regs = []
     with open(ruta, "r", encoding="utf-8") as f:
         for linea in f:
@@ -126,16 +161,1559 @@ def leer_registros(ruta):
             regs.append(linea.split("|"))  # El .split() parte un texto en pedacitos y devuelve una lista con esos pedacitos
     return regs
 
+# Igual que _leer_lineas, pero si el archivo tiene diario de cambios se aplican sus ediciones encima
+def leer_registros(ruta):
+    if _usar_sqlite(ruta):
+        return _sqlite_leer(ruta)
+    with bloqueo_datos():  # El archivo y su diario se leen juntos, sin que otro equipo escriba en medio
+        regs = _leer_lineas(ruta)
+        if ruta in DIARIOS:
+            _aplicar_diario(regs, DIARIOS[ruta])
+    return regs
+
 # Reescribir todos los registros a un archivo
 def escribir_registros(ruta, registros):  # Registros debe de ser una lista de listas
-    with open(ruta, "w", encoding="utf-8") as f:
-        for reg in registros:  # Cada reg es por ejemplo ["Ana", "2001-01-01", "F", "10", "300123", "2025-11-04"]
-            f.write("|".join(reg) + "\n")  # El .join lo convierte en Ana|2001-01-01|F|10|300123|2025-11-04
+    if _usar_sqlite(ruta):
+        _sqlite_reemplazar(ruta, registros)
+        _registros_reescritos(ruta, registros)
+        return
+    with bloqueo_datos(exclusivo=True):
+        # Se escribe en un archivo temporal y se reemplaza al final: si el programa se cae a mitad
+        # de la escritura, el archivo original queda intacto
+        temporal = ruta + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            for reg in registros:  # Cada reg es por ejemplo ["Ana", "2001-01-01", "F", "10", "300123", "2025-11-04"]
+                f.write("|".join(reg) + "\n")  # El .join lo convierte en Ana|2001-01-01|F|10|300123|2025-11-04
+            f.flush()
+            os.fsync(f.fileno())
+        if ruta in _indices_historial:
+            _soltar_mapa(_indices_historial[ruta])  # En Windows no se puede reemplazar un archivo que sigue mapeado
+        os.replace(temporal, ruta)
+        if ruta in DIARIOS:
+            # Los registros recibidos ya son la versión completa, así que el diario sobra
+            open(DIARIOS[ruta], "w", encoding="utf-8").close()
+        _registros_reescritos(ruta, registros)
 
 # Añadir un único registro (append)
 def agregar_registro(ruta, campos):
-    with open(ruta, "a", encoding="utf-8") as f:  # Cuando llamo el archivo en modo "a" me escribe justo despues del ultimo byte
-        f.write("|".join(campos) + "\n")
+    with bloqueo_datos(exclusivo=True):
+        firma_antes = _firma_archivo(ruta)  # Dentro del bloqueo: nadie más puede escribir entre esta firma y el append
+        if _usar_sqlite(ruta):
+            _sqlite_agregar(ruta, [campos])
+        else:
+            with open(ruta, "a", encoding="utf-8") as f:  # Cuando llamo el archivo en modo "a" me escribe justo despues del ultimo byte
+                f.write("|".join(campos) + "\n")
+        _registros_agregados(ruta, [campos], firma_antes)
+
+# Añadir muchos registros de una vez, con una sola apertura del archivo y escritura con buffer
+def agregar_registros(ruta, registros):
+    if not registros:
+        return
+    with bloqueo_datos(exclusivo=True):
+        firma_antes = _firma_archivo(ruta)
+        if _usar_sqlite(ruta):
+            _sqlite_agregar(ruta, registros)
+        else:
+            with open(ruta, "a", encoding="utf-8", buffering=1024 * 1024) as f:
+                f.writelines("|".join(campos) + "\n" for campos in registros)
+        _registros_agregados(ruta, registros, firma_antes)
+
+
+# ---------------------------
+#  BLOQUE: Bloqueos entre procesos (varios equipos con la misma carpeta de datos)
+# ---------------------------
+
+# Un solo bloqueo para toda la carpeta: compartido para leer, exclusivo para escribir. Se pide sobre
+# ARCH_BLOQUEO y no sobre los TXT porque esos se reemplazan con os.replace y el bloqueo quedaría en el archivo viejo.
+# Dentro del mismo proceso es reentrante (agregar_registro ya bloqueado puede llamar a existe_documento)
+# y los hilos se turnan con "hilos", porque fcntl bloquea por proceso y no por hilo
+_bloqueo = {
+    "archivo": None,    # ARCH_BLOQUEO abierto (se deja abierto: cerrarlo soltaría el bloqueo de fcntl)
+    "ruta": None,       # Ruta absoluta con la que se abrió, por si se cambia de carpeta de datos
+    "nivel": 0,         # Cuántos bloqueo_datos anidados hay abiertos en este proceso
+    "exclusivo": False,
+    "hilos": threading.RLock(),
+}
+
+def _pedir_bloqueo(archivo, exclusivo):
+    if fcntl is not None:
+        fcntl.lockf(archivo, fcntl.LOCK_EX if exclusivo else fcntl.LOCK_SH)
+    elif msvcrt is not None:
+        # msvcrt solo tiene bloqueos exclusivos: en Windows los lectores también se turnan
+        archivo.seek(0)
+        while True:
+            try:
+                msvcrt.locking(archivo.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError as error:
+                # LK_LOCK se rinde después de 10 intentos de un segundo (EDEADLOCK): se sigue esperando.
+                # Cualquier otro error (archivo cerrado, sin permiso) no se arregla esperando
+                if error.errno != getattr(errno, "EDEADLOCK", errno.EDEADLK):
+                    raise
+
+def _soltar_bloqueo(archivo):
+    if fcntl is not None:
+        fcntl.lockf(archivo, fcntl.LOCK_UN)
+    elif msvcrt is not None:
+        archivo.seek(0)
+        msvcrt.locking(archivo.fileno(), msvcrt.LK_UNLCK, 1)
+
+@contextmanager
+def bloqueo_datos(exclusivo=False):
+    with _bloqueo["hilos"]:
+        if _bloqueo["nivel"] == 0:
+            ruta = os.path.abspath(ARCH_BLOQUEO)
+            if _bloqueo["ruta"] != ruta:
+                if _bloqueo["archivo"] is not None:
+                    _bloqueo["archivo"].close()
+                _bloqueo["archivo"] = open(ruta, "a+b")
+                _bloqueo["ruta"] = ruta
+            _pedir_bloqueo(_bloqueo["archivo"], exclusivo)
+            _bloqueo["exclusivo"] = exclusivo
+        elif exclusivo and not _bloqueo["exclusivo"]:
+            # Escritura dentro de una lectura: fcntl convierte el bloqueo compartido en exclusivo
+            if fcntl is not None:
+                fcntl.lockf(_bloqueo["archivo"], fcntl.LOCK_EX)
+            _bloqueo["exclusivo"] = True
+        _bloqueo["nivel"] += 1
+        try:
+            yield
+        finally:
+            _bloqueo["nivel"] -= 1
+            if _bloqueo["nivel"] == 0:
+                _soltar_bloqueo(_bloqueo["archivo"])
+                _bloqueo["exclusivo"] = False
+
+# Registrar un paciente nuevo revisando el documento dentro del bloqueo exclusivo: si dos equipos guardan
+# el mismo documento a la vez, solo el primero lo agrega. Devuelve False si el documento ya existía
+def registrar_paciente(registro):
+    with bloqueo_datos(exclusivo=True):
+        if existe_documento(registro[3]):
+            return False
+        agregar_registro(ARCH_PACIENTES, registro)
+        return True
+
+# Guardar la edición de un paciente; si cambia el documento, se revisa dentro del bloqueo que el nuevo no exista.
+# Devuelve False si el documento nuevo ya lo tiene otro paciente
+def guardar_edicion_paciente(doc_original, registro):
+    with bloqueo_datos(exclusivo=True):
+        if _norm(registro[3]) != _norm(doc_original) and existe_documento(registro[3]):
+            return False
+        actualizar_paciente(doc_original, registro)
+        return True
+
+
+# ---------------------------
+#  BLOQUE: Índice de pacientes en memoria
+# ---------------------------
+
+# La "firma" de un archivo es su fecha de modificación y su tamaño.
+# Si alguno de los dos cambia, el archivo fue modificado por fuera y hay que recargar.
+def _firma_archivo(ruta):
+    if _usar_sqlite(ruta):
+        return ("sqlite", _sqlite_version(ruta))  # En SQLite cada tabla lleva un contador de versiones
+    try:
+        st = os.stat(ruta)
+    except OSError:
+        return None
+    if ruta in DIARIOS:
+        # Un cambio en el diario también cambia el contenido que ven los lectores
+        return (st.st_mtime_ns, st.st_size, _firma_archivo(DIARIOS[ruta]))
+    return (st.st_mtime_ns, st.st_size)
+
+# Pacientes cargados una sola vez, con el documento normalizado como llave
+_indice_pacientes = {
+    "firma": None,       # Firma de ARCH_PACIENTES cuando se cargó el índice
+    "por_doc": {},       # documento normalizado -> registro (en el orden del archivo si "en_orden"; ver _pacientes_en_orden)
+    "en_orden": True,    # False después de un cambio de documento: ese paciente quedó al final del diccionario
+    "posicion": {},      # documento normalizado -> orden de llegada, para devolver resultados en el orden del archivo
+    "tokens": {},        # palabra del nombre -> set de documentos que la tienen
+    "sufijos": [],       # todos los sufijos de todas las palabras, ordenados (búsqueda por subcadena con bisect)
+    "sufijo_token": [],  # palabra a la que pertenece cada sufijo (misma posición que en "sufijos")
+    "trigramas": {},     # trigrama (sin tildes) -> set de palabras que lo tienen, para la búsqueda aproximada
+    "nombres_raros": {}, # documento -> nombre normalizado, solo si el nombre guardado no estaba normalizado
+    "tabla": None,       # TablaPacientes con los datos si INDICE_COMPACTO; entonces "por_doc" guarda vistas (FilaPaciente)
+}
+
+def _construir_indice_pacientes(registros, firma, tabla=None):
+    por_doc = {}
+    tokens = {}
+    nombres_raros = {}
+    for reg in registros:
+        doc = _norm(reg[3])
+        if doc in por_doc:
+            continue  # Si hubiera documentos repetidos se queda el primero, igual que la búsqueda lineal
+        por_doc[doc] = reg
+        nombre_n = _norm(reg[0])
+        if nombre_n != reg[0]:
+            nombres_raros[doc] = nombre_n
+        for token in set(nombre_n.split()):
+            tokens.setdefault(token, set()).add(doc)
+    pares = sorted((token[i:], token) for token in tokens for i in range(len(token)))
+    trigramas = {}
+    for token in tokens:
+        for tri in _trigramas(token):
+            trigramas.setdefault(tri, set()).add(token)
+    _indice_pacientes["trigramas"] = trigramas
+    _indice_pacientes["nombres_raros"] = nombres_raros
+    _ordenes_listado["ordenes"] = {}  # Se volverán a ordenar cuando se pidan
+    _indice_pacientes["por_doc"] = por_doc
+    _indice_pacientes["en_orden"] = True
+    _indice_pacientes["posicion"] = {doc: i for i, doc in enumerate(por_doc)}
+    _indice_pacientes["tokens"] = tokens
+    _indice_pacientes["sufijos"] = [sufijo for sufijo, _ in pares]
+    _indice_pacientes["sufijo_token"] = [token for _, token in pares]
+    _indice_pacientes["tabla"] = tabla
+    _indice_pacientes["firma"] = firma
+
+# Arma el índice con los registros dados, guardándolos en una tabla compacta si INDICE_COMPACTO
+def _indexar_registros(registros, firma):
+    if INDICE_COMPACTO:
+        tabla = TablaPacientes.desde_registros(registros)
+        _construir_indice_pacientes(tabla, firma, tabla)
+    else:
+        _construir_indice_pacientes([list(reg) for reg in registros], firma)
+
+def _cargar_indice_pacientes():
+    firma = _firma_archivo(ARCH_PACIENTES)  # La firma se toma antes de leer, así un cambio durante la lectura obliga a recargar
+    if INDICE_COMPACTO:
+        tabla = cargar_tabla_pacientes()  # Directo a la tabla, sin pasar por la lista de listas
+        _construir_indice_pacientes(tabla, firma, tabla)
+    else:
+        _construir_indice_pacientes(leer_registros(ARCH_PACIENTES), firma)
+
+# Devuelve el diccionario documento -> registro, recargándolo solo si el archivo cambió por fuera
+def indice_pacientes():
+    if _indice_pacientes["firma"] is None or _firma_archivo(ARCH_PACIENTES) != _indice_pacientes["firma"]:
+        _cargar_indice_pacientes()
+    return _indice_pacientes["por_doc"]
+
+# Igual que indice_pacientes, pero recorrerlo da los pacientes en el orden del archivo. Un cambio de documento
+# mueve al paciente al final del diccionario; el orden se repara aquí, solo cuando alguien lo va a recorrer
+def _pacientes_en_orden():
+    por_doc = indice_pacientes()
+    if not _indice_pacientes["en_orden"]:
+        posicion = _indice_pacientes["posicion"]
+        ordenados = sorted(por_doc.items(), key=lambda par: posicion[par[0]])  # Casi ordenado: sorted() tarda O(n)
+        por_doc.clear()
+        por_doc.update(ordenados)
+        _indice_pacientes["en_orden"] = True
+    return por_doc
+
+def _indice_al_dia():
+    return _indice_pacientes["firma"] is not None and _indice_pacientes["firma"] == _firma_archivo(ARCH_PACIENTES)
+
+# Buscar un paciente por documento exacto en O(1). Devuelve una copia para que quien la edite no altere el índice.
+# Si el índice en memoria no está cargado, se lee solo la línea del paciente usando pacientes.idx
+def obtener_paciente(documento):
+    if not _indice_al_dia():
+        return leer_paciente(documento)
+    reg = _indice_pacientes["por_doc"].get(_norm(documento))
+    if reg is None:
+        return None
+    return list(reg)
+
+
+# ---------------------------
+#  BLOQUE: Índice de nombres (búsqueda parcial por nombre o apellido)
+# ---------------------------
+
+def _tokens_nombre(nombre):
+    return set(_norm(nombre).split())
+
+def _indexar_nombre(doc, nombre):
+    tokens = _indice_pacientes["tokens"]
+    if _norm(nombre) != nombre:
+        _indice_pacientes["nombres_raros"][doc] = _norm(nombre)
+    for token in _tokens_nombre(nombre):
+        if token not in tokens:
+            tokens[token] = set()
+            # Palabra nueva: se insertan sus sufijos en orden (las palabras nuevas son raras, casi todos los nombres se repiten)
+            sufijos = _indice_pacientes["sufijos"]
+            for i in range(len(token)):
+                pos = bisect.bisect_left(sufijos, token[i:])
+                sufijos.insert(pos, token[i:])
+                _indice_pacientes["sufijo_token"].insert(pos, token)
+            for tri in _trigramas(token):
+                _indice_pacientes["trigramas"].setdefault(tri, set()).add(token)
+        tokens[token].add(doc)
+
+def _desindexar_nombre(doc, nombre):
+    tokens = _indice_pacientes["tokens"]
+    _indice_pacientes["nombres_raros"].pop(doc, None)
+    for token in _tokens_nombre(nombre):
+        if token in tokens:
+            tokens[token].discard(doc)  # Los sufijos se quedan; una palabra sin documentos no aporta resultados
+
+# Palabras del índice que contienen "texto" (texto sin espacios)
+def _tokens_que_contienen(texto):
+    sufijos = _indice_pacientes["sufijos"]
+    sufijo_token = _indice_pacientes["sufijo_token"]
+    encontrados = set()
+    i = bisect.bisect_left(sufijos, texto)
+    while i < len(sufijos) and sufijos[i].startswith(texto):
+        encontrados.add(sufijo_token[i])
+        i += 1
+    return encontrados
+
+# Palabras del índice que aparecen dentro de "texto"
+def _tokens_contenidos_en(texto):
+    tokens = _indice_pacientes["tokens"]
+    return {texto[i:j] for i in range(len(texto)) for j in range(i + 1, len(texto) + 1) if texto[i:j] in tokens}
+
+def _documentos_de_tokens(palabras):
+    tokens = _indice_pacientes["tokens"]
+    docs = set()
+    for palabra in palabras:
+        docs |= tokens.get(palabra, set())
+    return docs
+
+# Ordenar documentos según su posición en el archivo y devolver sus registros
+def _registros_en_orden(docs):
+    posicion = _indice_pacientes["posicion"]
+    por_doc = _indice_pacientes["por_doc"]
+    return [por_doc[doc] for doc in sorted(docs, key=posicion.__getitem__)]
+
+# Misma regla que usaba buscar_paciente_por_doc_o_nombre: una palabra del nombre contiene a la clave o está contenida en ella
+def buscar_por_nombre(clave):
+    clave_n = _norm(clave)
+    if clave_n == "":
+        return list(_pacientes_en_orden().values())  # La cadena vacía está contenida en cualquier palabra
+    indice_pacientes()  # Pone al día el índice de palabras
+    palabras = _tokens_contenidos_en(clave_n)
+    if " " not in clave_n:
+        palabras |= _tokens_que_contienen(clave_n)  # Una palabra no puede contener una clave con espacios
+    return _registros_en_orden(_documentos_de_tokens(palabras))
+
+# Misma regla que la búsqueda de la interfaz: el texto aparece dentro del nombre completo normalizado
+def buscar_nombre_contiene(texto):
+    texto_n = _norm(texto)
+    if texto_n == "":
+        return list(_pacientes_en_orden().values())
+    indice_pacientes()  # Pone al día el índice de palabras
+    partes = texto_n.split()
+    if len(partes) == 1:
+        return _registros_en_orden(_documentos_de_tokens(_tokens_que_contienen(texto_n)))
+    # Varias palabras: los candidatos tienen una palabra que contiene la parte más larga; luego se confirma sobre el nombre
+    mas_larga = max(partes, key=len)
+    candidatos = _documentos_de_tokens(_tokens_que_contienen(mas_larga))
+    return [reg for reg in _registros_en_orden(candidatos) if texto_n in _nombre_normalizado(reg)]
+
+# Nombre del paciente normalizado, sin llamar a _norm en el caso común (el nombre ya se guardó normalizado)
+def _nombre_normalizado(reg):
+    return _indice_pacientes["nombres_raros"].get(_norm(reg[3]), reg[0])
+
+
+# ---------------------------
+#  BLOQUE: Búsqueda aproximada (nombres mal escritos o con/sin tildes)
+# ---------------------------
+
+# "Vélez" -> "velez": se quitan tildes y diéresis para comparar
+def _sin_tildes(texto):
+    descompuesto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in descompuesto if not unicodedata.combining(c))
+
+# Trozos de 3 letras de una palabra; los espacios de relleno hacen que el inicio y el final pesen más
+def _trigramas(palabra):
+    palabra = f"  {_sin_tildes(palabra)} "
+    return {palabra[i:i + 3] for i in range(len(palabra) - 2)}
+
+# Palabras del índice parecidas a "palabra": similitud de Dice entre trigramas (1.0 = iguales sin contar tildes)
+def _palabras_parecidas(palabra, umbral):
+    tris = _trigramas(palabra)
+    indice_tris = _indice_pacientes["trigramas"]
+    compartidos = {}
+    for tri in tris:
+        for token in indice_tris.get(tri, ()):
+            compartidos[token] = compartidos.get(token, 0) + 1
+    parecidas = {}
+    for token, n in compartidos.items():
+        similitud = 2 * n / (len(tris) + len(_trigramas(token)))
+        if similitud >= umbral:
+            parecidas[token] = similitud
+    return parecidas
+
+# Búsqueda aproximada por nombre. Devuelve hasta k pares (registro, puntaje) del más parecido al menos parecido.
+# Los candidatos salen del índice de trigramas, nunca de comparar contra todos los pacientes
+def buscar_difuso(texto, k=10, umbral=0.4):
+    palabras = _norm(texto).split()
+    indice = indice_pacientes()
+    if not palabras or not indice:
+        return []
+    tokens = _indice_pacientes["tokens"]
+    totales = {}
+    for palabra in palabras:
+        # Cada palabra buscada suma la similitud de la palabra más parecida del nombre del paciente:
+        # se recorren de la más a la menos parecida y cada documento cuenta solo la primera vez
+        vistos = set()
+        parecidas = _palabras_parecidas(palabra, umbral)
+        for token in sorted(parecidas, key=parecidas.get, reverse=True):
+            for doc in tokens.get(token, ()):
+                if doc not in vistos:
+                    vistos.add(doc)
+                    totales[doc] = totales.get(doc, 0.0) + parecidas[token]
+    posicion = _indice_pacientes["posicion"]
+    mejores = heapq.nlargest(k, totales.items(), key=lambda par: (par[1], -posicion[par[0]]))
+    return [(indice[doc], round(total / len(palabras), 3)) for doc, total in mejores]
+
+
+# ---------------------------
+#  BLOQUE: Búsqueda mientras se escribe
+# ---------------------------
+
+LIMITE_SUGERENCIAS = 50    # Pacientes que se muestran mientras se escribe (los primeros en el orden del archivo)
+ESPERA_ESCRITURA_MS = 150  # La búsqueda se lanza cuando el usuario deja de escribir por este tiempo
+
+LIMITE_UNION_SUGERENCIAS = 50000  # Más documentos que esto en una parte del texto: no se arma su conjunto
+
+# Pacientes cuyo nombre contiene "texto" (misma regla que buscar_nombre_contiene), pero solo los primeros
+# "limite" en el orden del archivo, para que cada tecla responda en pocos milisegundos.
+# Devuelve un diccionario que se pasa como "anterior" en la siguiente búsqueda: si el texto nuevo contiene al
+# anterior se filtran los pacientes de la búsqueda anterior (si estaban todos), y si una palabra del texto
+# nuevo contiene a una del anterior se filtran las palabras del índice que ya se habían encontrado.
+# "completo" dice si "todos" tiene todas las coincidencias (documentos en orden); si no, "total" es una cota
+def sugerencias_nombre(texto, limite=LIMITE_SUGERENCIAS, anterior=None):
+    texto_n = _norm(texto)
+    indice = indice_pacientes()
+    raros = _indice_pacientes["nombres_raros"]
+    resultado = {"texto": texto_n, "firma": _indice_pacientes["firma"], "palabras": {},
+                 "todos": [], "registros": [], "completo": True, "total": 0}
+    if texto_n == "":
+        return resultado
+    if anterior is None or anterior["firma"] != resultado["firma"]:
+        anterior = None  # El índice cambió: no se puede refinar
+    if anterior is not None and anterior["completo"] and anterior["texto"] != "" and anterior["texto"] in texto_n:
+        todos = [doc for doc in anterior["todos"] if texto_n in raros.get(doc, indice[doc][0])]
+        resultado.update(todos=todos, registros=[indice[doc] for doc in todos[:limite]], total=len(todos))
+        return resultado
+
+    # Palabras del índice que contienen cada parte del texto
+    tokens = _indice_pacientes["tokens"]
+    partes = texto_n.split()
+    estimados = []
+    for parte in set(partes):
+        previas = None
+        if anterior is not None:
+            previas = next((ps for p, ps in anterior["palabras"].items() if p in parte), None)
+        palabras = {w for w in previas if parte in w} if previas is not None else _tokens_que_contienen(parte)
+        resultado["palabras"][parte] = palabras
+        estimados.append((sum(len(tokens[w]) for w in palabras), parte))
+    estimados.sort()
+
+    # Candidatos: pacientes con una palabra que contiene cada parte (intersección, empezando por la parte más rara).
+    # Una parte que coincide con una sola palabra ya tiene su conjunto en el índice; juntar muchas palabras cuesta
+    candidatos = None
+    for estimado, parte in estimados:
+        palabras = resultado["palabras"][parte]
+        if len(palabras) == 1:
+            docs = tokens[next(iter(palabras))]
+        elif estimado <= LIMITE_UNION_SUGERENCIAS:
+            docs = _documentos_de_tokens(palabras)
+        else:
+            continue
+        candidatos = docs if candidatos is None else candidatos & docs
+    if candidatos is not None and len(candidatos) ** 2 <= 16 * len(indice) * limite:
+        if len(partes) > 1:  # Con varias palabras hay que confirmar que el texto aparece seguido en el nombre
+            candidatos = [doc for doc in candidatos if texto_n in raros.get(doc, indice[doc][0])]
+        todos = sorted(candidatos, key=_indice_pacientes["posicion"].__getitem__)
+        resultado.update(todos=todos, registros=[indice[doc] for doc in todos[:limite]], total=len(todos))
+        return resultado
+
+    # Muchos candidatos: las coincidencias son tan frecuentes que recorrer en orden hasta juntar "limite" es más rápido
+    registros = []
+    for doc, reg in _pacientes_en_orden().items():
+        if (candidatos is None or doc in candidatos) and texto_n in raros.get(doc, reg[0]):
+            registros.append(reg)
+            if len(registros) == limite:
+                break
+    total = min(estimado for estimado, _ in estimados)
+    resultado.update(todos=None, registros=registros, completo=False, total=total)
+    return resultado
+
+# Sugerencias de la ventana Consultar: documento exacto, nombre y apellido (unión, como el botón Consultar).
+# "anteriores" es la pareja de resultados devueltos la vez pasada para el nombre y el apellido (o None).
+# Devuelve (primeros "limite" registros en el orden del archivo, hay_mas, nuevos anteriores)
+def sugerencias_consulta(clave_doc, clave_nom, clave_ape, anteriores=None, limite=LIMITE_SUGERENCIAS):
+    anteriores = anteriores or (None, None)
+    por_nombre = sugerencias_nombre(clave_nom, limite, anteriores[0])
+    por_apellido = sugerencias_nombre(clave_ape, limite, anteriores[1])
+    encontrados = {}
+    reg = _indice_pacientes["por_doc"].get(_norm(clave_doc)) if clave_doc.strip() else None
+    if reg is not None:
+        encontrados[_norm(reg[3])] = reg
+    for resultado in (por_nombre, por_apellido):
+        for reg in resultado["registros"]:
+            encontrados.setdefault(_norm(reg[3]), reg)
+    registros = _registros_en_orden(encontrados)
+    hay_mas = len(registros) > limite or any(not r["completo"] or r["total"] > limite for r in (por_nombre, por_apellido))
+    return registros[:limite], hay_mas, (por_nombre, por_apellido)
+
+
+# ---------------------------
+#  BLOQUE: Listado paginado de pacientes
+# ---------------------------
+
+# Documento como número, para que "789456123" quede antes que "1026274267"
+def _llave_documento(reg):
+    return int(reg[3]) if reg[3].isdigit() else float("inf")
+
+# Edad que se muestra en el listado (ver edad_paciente); el paciente sin una edad legible queda al final
+def _llave_edad(reg):
+    edad = edad_paciente(reg)
+    return int(edad) if edad.isdigit() else float("inf")
+
+# Criterios de orden del listado: llave de cada registro y si va de mayor a menor
+ORDENES_LISTADO = {
+    "registro": (lambda reg: reg[7], True),                  # Fecha de registro, más reciente primero
+    "documento": (_llave_documento, False),                  # Documento de identidad, ascendente (numérico)
+    "edad": (_llave_edad, False),                            # Edad calculada, de menor a mayor; sin edad legible al final
+    "nombre": (lambda reg: _sin_tildes(_norm(reg[0])), False),  # Nombre, alfabético sin importar tildes
+}
+
+# Índices ordenados, uno por criterio, que se crean la primera vez que se piden y luego se mantienen
+# con bisect en cada alta o edición. Cada uno es una lista ascendente de (llave, desempate, documento);
+# los criterios descendentes se leen de atrás hacia adelante. El desempate es la posición en el archivo
+# (negada en los descendentes) para que los empates salgan en el orden del archivo, como con sort().
+# Las edades cambian con el día: el orden por edad se descarta cuando cambia la fecha y se vuelve a armar al pedirlo
+_ordenes_listado = {"ordenes": {}, "dia": None}
+
+def _ordenes_vigentes():
+    hoy_ = _hoy_aaaammdd()
+    if _ordenes_listado["dia"] != hoy_:
+        _ordenes_listado["ordenes"].pop("edad", None)
+        _ordenes_listado["dia"] = hoy_
+    return _ordenes_listado["ordenes"]
+
+def _entrada_orden(orden, doc, reg):
+    llave, descendente = ORDENES_LISTADO[orden]
+    posicion = _indice_pacientes["posicion"][doc]
+    return (llave(reg), -posicion if descendente else posicion, doc)
+
+def _orden_listado(orden):
+    por_doc = indice_pacientes()
+    ordenes = _ordenes_vigentes()
+    if orden not in ordenes:
+        if orden == "edad":
+            ordenes[orden] = _orden_por_edad(por_doc)
+        else:
+            ordenes[orden] = sorted(_entrada_orden(orden, doc, reg) for doc, reg in por_doc.items())
+    return ordenes[orden]
+
+# El orden por edad se arma calculando todas las edades de una vez (edades_de_ordinales); solo los pacientes
+# sin fecha de nacimiento legible pasan por _llave_edad, para usar la edad guardada igual que al mostrarlos
+def _orden_por_edad(por_doc):
+    posicion = _indice_pacientes["posicion"]
+    tabla = _indice_pacientes["tabla"]
+    if tabla is not None:
+        edades = tabla.edades()  # Directo sobre la columna de fechas de la tabla
+        pares = [(doc, reg, edades[reg._i]) for doc, reg in por_doc.items()]
+    else:
+        pares = list(zip(por_doc, por_doc.values(),
+                         edades_de_ordinales([_ordinal_nacimiento(reg[1]) for reg in por_doc.values()])))
+    return sorted((edad if edad >= 0 else _llave_edad(reg), posicion[doc], doc) for doc, reg, edad in pares)
+
+def _ordenes_agregar(doc, reg):
+    for orden, entradas in _ordenes_vigentes().items():
+        bisect.insort(entradas, _entrada_orden(orden, doc, reg))  # Se inserta en su lugar, sin reordenar todo
+
+def _ordenes_quitar(doc, reg):
+    for orden, entradas in _ordenes_vigentes().items():
+        entrada = _entrada_orden(orden, doc, reg)
+        i = bisect.bisect_left(entradas, entrada)
+        if i < len(entradas) and entradas[i] == entrada:
+            del entradas[i]
+
+def total_pacientes():
+    return len(indice_pacientes())
+
+# Registros desde la posición "inicio" (contando desde 0) en el orden pedido
+def pagina_pacientes(orden, inicio, cantidad):
+    entradas = _orden_listado(orden)
+    por_doc = _indice_pacientes["por_doc"]
+    if ORDENES_LISTADO[orden][1]:
+        fin = len(entradas) - inicio
+        tramo = reversed(entradas[max(0, fin - cantidad):max(0, fin)])
+    else:
+        tramo = entradas[inicio:inicio + cantidad]
+    return [por_doc[doc] for _, _, doc in tramo]
+
+# Recorre todos los pacientes de a "tam_pagina" registros, sin armar una lista completa de registros
+def paginas_pacientes(orden, tam_pagina=50):
+    inicio = 0
+    while True:
+        pagina = pagina_pacientes(orden, inicio, tam_pagina)
+        if not pagina:
+            return
+        yield pagina
+        inicio += tam_pagina
+
+
+# ---------------------------
+#  BLOQUE: Lectura con mmap (solo los bytes que se necesitan)
+# ---------------------------
+
+# El archivo se ve como un solo bloque de bytes y el sistema operativo trae del disco solo las páginas que se tocan.
+# Devuelve None si el archivo está vacío o no existe (mmap no acepta archivos de tamaño 0)
+def _mapear(ruta):
+    try:
+        with open(ruta, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)  # El mapa sigue sirviendo después de cerrar el archivo
+    except OSError:
+        return None
+
+# Recorre las líneas con datos desde el byte "desde" y entrega (inicio, valor): el byte donde empieza la línea
+# y el texto de la columna pedida, sin partir el resto de la línea. valor es None si la línea tiene menos columnas
+def _escanear(mapa, columna, desde=0):
+    fin_archivo = len(mapa)
+    inicio = desde
+    while inicio < fin_archivo:
+        fin = mapa.find(b"\n", inicio)
+        if fin == -1:
+            fin = fin_archivo
+        if fin > inicio:
+            a = inicio
+            for _ in range(columna):
+                a = mapa.find(b"|", a, fin)
+                if a == -1:
+                    break
+                a += 1
+            if a == -1:
+                if mapa[inicio:fin].strip():
+                    yield inicio, None
+            else:
+                b = mapa.find(b"|", a, fin)
+                valor = mapa[a:fin if b == -1 else b]
+                if b != -1 or columna > 0 or valor.strip():  # Las líneas en blanco se saltan, como en _leer_lineas
+                    yield inicio, valor.decode("utf-8")
+        inicio = fin + 1
+
+def escanear_columna(ruta, columna, desde=0):
+    mapa = _mapear(ruta)
+    if mapa is None:
+        return
+    with mapa:
+        yield from _escanear(mapa, columna, desde)
+
+# Registro que guarda solo dónde está su línea; la línea se lee y se parte la primera vez que se pide un campo.
+# Se comporta como un registro de leer_registros (reg[0], len(reg), "|".join(reg))
+class RegistroPerezoso:
+    __slots__ = ("_mapa", "_inicio", "_campos")
+
+    def __init__(self, mapa, inicio):
+        self._mapa = mapa
+        self._inicio = inicio
+        self._campos = None
+
+    def campos(self):
+        if self._campos is None:
+            fin = self._mapa.find(b"\n", self._inicio)
+            linea = self._mapa[self._inicio:fin if fin != -1 else len(self._mapa)]
+            self._campos = linea.decode("utf-8").strip().split("|")
+        return self._campos
+
+    def __len__(self):
+        return len(self.campos())
+
+    def __getitem__(self, k):
+        return self.campos()[k]
+
+    def __iter__(self):
+        return iter(self.campos())
+
+    def como_lista(self):
+        return list(self.campos())
+
+    def __repr__(self):
+        return f"RegistroPerezoso({self.campos()!r})"
+
+# Registros en las posiciones (bytes) indicadas, sin leer nada más del archivo
+def registros_en(mapa, posiciones):
+    for inicio in posiciones:
+        yield RegistroPerezoso(mapa, inicio)
+
+# Documentos normalizados de todos los pacientes. Si el índice ya está cargado se usa ese; si no, salen de
+# pacientes.idx (que se arma leyendo solo la columna del documento) con los cambios de documento del diario
+def documentos_pacientes():
+    if _usar_sqlite(ARCH_PACIENTES) or _indice_al_dia():
+        return set(indice_pacientes())
+    with bloqueo_datos():
+        por_doc = posiciones_pacientes()
+        filas, _ = _ediciones_diario(por_doc)
+    return (set(por_doc) - set(filas)) | {doc for doc, lineas in filas.items() if lineas}
+
+
+# ---------------------------
+#  BLOQUE: Índice de posiciones en disco (pacientes.idx)
+# ---------------------------
+
+# pacientes.idx guarda, por cada documento, dónde empieza su línea en pacientes.txt y cuántos bytes mide.
+# La primera línea es un encabezado de ancho fijo con el tamaño y la fecha de modificación de pacientes.txt
+# cuando se actualizó el índice; si no coinciden con el archivo actual, el índice se reconstruye.
+# Así consultar un paciente es un seek + readline, sin leer ni partir todo pacientes.txt
+_indice_posiciones = {
+    "firma": None,          # (mtime_ns, tamaño) de pacientes.txt que describe "por_doc"
+    "por_doc": {},          # documento normalizado -> (byte de inicio, largo de la línea) de su primera línea
+    "otras": {},            # documento -> [(inicio, largo), ...] de las líneas siguientes con el mismo documento
+    "diario_firma": None,   # firma de pacientes.txt + diario con la que se calcularon las ediciones
+    "diario": ({}, {}),     # lo que devuelve _repetir_diario sobre las posiciones (ver _ediciones_diario)
+}
+
+def _encabezado_posiciones(firma):
+    return f"IDX|{firma[1]:020d}|{firma[0]:020d}\n".encode("ascii")  # Siempre mide lo mismo: se puede reescribir en su sitio
+
+def _firma_pacientes_txt():
+    st = os.stat(ARCH_PACIENTES)
+    return (st.st_mtime_ns, st.st_size)
+
+# Posiciones de las líneas desde el byte "desde": lista de (documento, inicio, largo)
+def _posiciones_desde(mapa, desde=0):
+    posiciones = []
+    for inicio, doc in _escanear(mapa, 3, desde):
+        if doc is None:
+            continue
+        fin = mapa.find(b"\n", inicio)
+        posiciones.append((_norm(doc), inicio, (fin if fin != -1 else len(mapa)) - inicio))
+    return posiciones
+
+def _leer_archivo_posiciones(firma):
+    try:
+        with open(ARCH_INDICE_PACIENTES, "rb") as f:
+            if f.readline() != _encabezado_posiciones(firma):
+                return None
+            por_doc, otras = {}, {}
+            for linea in f:
+                doc, inicio, largo = linea.decode("utf-8").rstrip("\n").split("|")
+                _anotar_fila(por_doc, otras, doc, (int(inicio), int(largo)))
+            return por_doc, otras
+    except (OSError, ValueError, UnicodeDecodeError):
+        return None  # Índice dañado o a medio escribir: se reconstruye
+
+def _reconstruir_posiciones(firma):
+    mapa = _mapear(ARCH_PACIENTES)
+    posiciones = []
+    if mapa is not None:
+        with mapa:
+            posiciones = _posiciones_desde(mapa)
+    temporal = f"{ARCH_INDICE_PACIENTES}.{os.getpid()}.tmp"  # Dos lectores pueden reconstruirlo a la vez
+    with open(temporal, "wb") as f:
+        f.write(_encabezado_posiciones(firma))
+        f.write("".join(f"{doc}|{inicio}|{largo}\n" for doc, inicio, largo in posiciones).encode("utf-8"))
+    os.replace(temporal, ARCH_INDICE_PACIENTES)
+    por_doc, otras = {}, {}
+    for doc, inicio, largo in posiciones:
+        _anotar_fila(por_doc, otras, doc, (inicio, largo))  # Sin diario vale la primera, como en el índice en memoria
+    return por_doc, otras
+
+# documento -> (inicio, largo) de su primera línea, validado contra el tamaño y la fecha de pacientes.txt
+def posiciones_pacientes():
+    firma = _firma_pacientes_txt()
+    if _indice_posiciones["firma"] != firma:
+        posiciones = _leer_archivo_posiciones(firma)
+        if posiciones is None:
+            posiciones = _reconstruir_posiciones(firma)
+        _indice_posiciones["por_doc"], _indice_posiciones["otras"] = posiciones
+        _indice_posiciones["firma"] = firma
+    return _indice_posiciones["por_doc"]
+
+# Después de un append a pacientes.txt: solo se leen las líneas nuevas y se agregan al final de pacientes.idx
+def _posiciones_agregadas(firma_antes):
+    if firma_antes is None or _indice_posiciones["firma"] != firma_antes[:2]:
+        return  # pacientes.idx no estaba al día: se reconstruirá cuando se necesite
+    firma = _firma_pacientes_txt()
+    mapa = _mapear(ARCH_PACIENTES)
+    if mapa is None:
+        return
+    with mapa:
+        nuevas = _posiciones_desde(mapa, firma_antes[1])
+    try:
+        with open(ARCH_INDICE_PACIENTES, "r+b") as f:
+            f.seek(0, os.SEEK_END)
+            f.write("".join(f"{doc}|{inicio}|{largo}\n" for doc, inicio, largo in nuevas).encode("utf-8"))
+            f.seek(0)
+            f.write(_encabezado_posiciones(firma))  # Si el programa se cae antes de esto, el encabezado viejo obliga a reconstruir
+    except OSError:
+        _indice_posiciones["firma"] = None
+        return
+    for doc, inicio, largo in nuevas:
+        _anotar_fila(_indice_posiciones["por_doc"], _indice_posiciones["otras"], doc, (inicio, largo))
+    _indice_posiciones["firma"] = firma
+
+# El diario repetido sobre las posiciones de pacientes.idx, con la misma regla que _aplicar_diario: cada fila es
+# su (inicio, largo). Devuelve (documento -> líneas que lo tienen, solo si el diario lo toca; línea -> registro editado)
+def _ediciones_diario(por_doc):
+    firma = _firma_archivo(ARCH_PACIENTES)  # Incluye la firma del diario
+    if _indice_posiciones["diario_firma"] != firma:
+        _indice_posiciones["diario"] = _repetir_diario(ARCH_DIARIO_PACIENTES, por_doc, _indice_posiciones["otras"])
+        _indice_posiciones["diario_firma"] = firma
+    return _indice_posiciones["diario"]
+
+# Leer un solo paciente de disco: primero el diario, luego seek a su línea en pacientes.txt
+def leer_paciente(documento):
+    if _usar_sqlite(ARCH_PACIENTES):
+        reg = indice_pacientes().get(_norm(documento))
+        return list(reg) if reg is not None else None
+    doc = _norm(documento)
+    with bloqueo_datos():
+        por_doc = posiciones_pacientes()
+        filas, editadas = _ediciones_diario(por_doc)
+        if doc in filas:
+            fila = filas[doc][0] if filas[doc] else None  # Lista vacía: el documento cambió y nadie lo volvió a usar
+        else:
+            fila = por_doc.get(doc)
+        if fila is None:
+            return None
+        if fila in editadas:
+            return list(editadas[fila])
+        inicio, _ = fila
+        with open(ARCH_PACIENTES, "rb") as f:
+            f.seek(inicio)
+            return f.readline().decode("utf-8").strip().split("|")
+
+
+# ---------------------------
+#  BLOQUE: Índice del historial (enfermedades, tratamientos, alergias)
+# ---------------------------
+
+ARCHIVOS_HISTORIAL = (ARCH_ENFERMEDADES, ARCH_TRATAMIENTOS, ARCH_ALERGIAS)
+
+# Por cada archivo de historial: documento normalizado -> lista de posiciones (byte donde empieza cada línea
+# de ese paciente). Para armar el índice se lee solo la columna 0 (el documento); las líneas completas se leen
+# con mmap cuando se pide el historial de un paciente. En SQLite la lista guarda los registros mismos
+_indices_historial = {ruta: {"firma": None, "por_doc": {}, "mapa": None} for ruta in ARCHIVOS_HISTORIAL}
+
+def _agrupar_por_documento(registros):
+    por_doc = {}
+    for reg in registros:
+        por_doc.setdefault(_norm(reg[0]), []).append(reg)  # La columna 0 de los historiales es el documento
+    return por_doc
+
+# Agrega al índice las líneas desde el byte "desde" (todo el archivo, o solo lo recién agregado)
+def _indexar_posiciones(indice, ruta, desde=0):
+    _soltar_mapa(indice)
+    por_doc = indice["por_doc"]
+    for inicio, doc in escanear_columna(ruta, 0, desde):
+        por_doc.setdefault(_norm(doc), []).append(inicio)
+
+def _soltar_mapa(indice):
+    if indice["mapa"] is not None:
+        indice["mapa"].close()
+        indice["mapa"] = None
+
+def _indice_historial(ruta):
+    indice = _indices_historial[ruta]
+    firma = _firma_archivo(ruta)
+    if indice["firma"] is None or firma != indice["firma"]:
+        if _usar_sqlite(ruta):
+            indice["por_doc"] = _agrupar_por_documento(leer_registros(ruta))
+        else:
+            indice["por_doc"] = {}
+            _indexar_posiciones(indice, ruta)
+        indice["firma"] = firma
+    return indice["por_doc"]
+
+# Registros de historial de un paciente, en el orden en que se guardaron
+def historial_de(ruta, documento):
+    if _usar_sqlite(ruta):
+        return list(_indice_historial(ruta).get(_norm(documento), []))
+    with bloqueo_datos():  # Así nunca se indexa una línea que otro equipo está escribiendo a medias
+        entradas = _indice_historial(ruta).get(_norm(documento), [])
+        if not entradas:
+            return []
+        indice = _indices_historial[ruta]
+        if indice["mapa"] is None:
+            indice["mapa"] = _mapear(ruta)  # Se vuelve a mapear después de cada append, para ver las líneas nuevas
+        return [reg.campos() for reg in registros_en(indice["mapa"], entradas)]
+
+# Olvidar todo lo cargado en memoria (por ejemplo, al cambiar de BACKEND o de carpeta de datos)
+def reiniciar_indices():
+    _construir_indice_pacientes([], None)
+    _indice_posiciones["firma"] = None
+    _indice_posiciones["diario_firma"] = None
+    _vaciar_vistas()
+    _reporte["conteos"] = None
+    for indice in _indices_historial.values():
+        _soltar_mapa(indice)
+        indice["firma"] = None
+        indice["por_doc"] = {}
+
+
+# ---------------------------
+#  BLOQUE: Caché de vistas de pacientes (datos + historial)
+# ---------------------------
+
+TAM_CACHE_VISTAS = 256  # Pacientes abiertos hace poco que se guardan ya armados
+
+ARCHIVOS_VISTA = (ARCH_PACIENTES,) + ARCHIVOS_HISTORIAL
+
+# Vistas armadas del menos al más usado; al llenarse se descarta la primera (la usada hace más tiempo).
+# "firmas" son las de los 4 archivos cuando se revisó la caché: si alguno cambió por fuera se vacía toda.
+# Los cambios hechos por el propio programa solo borran las vistas de los documentos afectados
+_cache_vistas = {
+    "vistas": OrderedDict(),  # documento normalizado -> (paciente, enfermedades, tratamientos, alergias)
+    "firmas": None,
+    "aciertos": 0,
+    "fallos": 0,
+    "desalojos": 0,
+    "invalidaciones": 0,
+}
+
+def _firmas_vista():
+    return tuple(_firma_archivo(ruta) for ruta in ARCHIVOS_VISTA)
+
+def _vaciar_vistas():
+    _cache_vistas["vistas"].clear()
+    _cache_vistas["firmas"] = None
+
+# Paciente y su historial completo. Devuelve None si el documento no existe.
+# Cada llamada entrega copias, así quien las modifique no altera la caché
+def vista_paciente(documento):
+    doc = _norm(documento)
+    vistas = _cache_vistas["vistas"]
+    firmas = _firmas_vista()  # Se toman antes de leer: un cambio a mitad de la lectura obliga a vaciar la próxima vez
+    if firmas != _cache_vistas["firmas"]:
+        vistas.clear()
+        _cache_vistas["firmas"] = firmas
+    vista = vistas.get(doc)
+    if vista is not None:
+        vistas.move_to_end(doc)
+        _cache_vistas["aciertos"] += 1
+    else:
+        _cache_vistas["fallos"] += 1
+        paciente = obtener_paciente(doc)
+        if paciente is None:
+            return None
+        vista = (paciente,) + tuple(historial_de(ruta, doc) for ruta in ARCHIVOS_HISTORIAL)
+        vistas[doc] = vista
+        if len(vistas) > TAM_CACHE_VISTAS:
+            vistas.popitem(last=False)
+            _cache_vistas["desalojos"] += 1
+    return {
+        "paciente": list(vista[0]),
+        "enfermedades": [list(reg) for reg in vista[1]],
+        "tratamientos": [list(reg) for reg in vista[2]],
+        "alergias": [list(reg) for reg in vista[3]],
+    }
+
+# Borrar las vistas de "documentos" después de que el programa escribió en "ruta"
+def _vistas_modificadas(ruta, documentos, firma_antes):
+    if ruta not in ARCHIVOS_VISTA or _cache_vistas["firmas"] is None:
+        return
+    k = ARCHIVOS_VISTA.index(ruta)
+    if _cache_vistas["firmas"][k] != firma_antes:
+        _vaciar_vistas()  # El archivo ya había cambiado por fuera antes de esta escritura
+        return
+    for doc in documentos:
+        if _cache_vistas["vistas"].pop(_norm(doc), None) is not None:
+            _cache_vistas["invalidaciones"] += 1
+    firmas = list(_cache_vistas["firmas"])
+    firmas[k] = _firma_archivo(ruta)
+    _cache_vistas["firmas"] = tuple(firmas)
+
+# Contadores de la caché (para revisar si el tamaño le sirve a la recepción)
+def estadisticas_vistas():
+    return {
+        "tamano": len(_cache_vistas["vistas"]),
+        "capacidad": TAM_CACHE_VISTAS,
+        "aciertos": _cache_vistas["aciertos"],
+        "fallos": _cache_vistas["fallos"],
+        "desalojos": _cache_vistas["desalojos"],
+        "invalidaciones": _cache_vistas["invalidaciones"],
+    }
+
+
+# ---------------------------
+#  BLOQUE: Diario de cambios de pacientes
+# ---------------------------
+
+# Anota la fila de un documento: "primera" guarda la primera fila del archivo con ese documento y "otras" las
+# siguientes (pasa cuando un paciente cambia de documento y otro se registra después con el documento viejo)
+def _anotar_fila(primera, otras, doc, fila):
+    if doc in primera:
+        otras.setdefault(doc, []).append(fila)
+    else:
+        primera[doc] = fila
+
+# Repite el diario fila por fila. Cada edición cae en la primera fila que tiene su documento en ese punto del
+# diario: las filas de más abajo con el mismo documento se registraron después, así que aún no existían.
+# Devuelve (documento -> filas que lo tienen al final, solo para los documentos que el diario toca;
+#           fila -> último registro anotado para ella)
+def _repetir_diario(ruta_diario, primera, otras):
+    filas = {}
+    editadas = {}
+    if not os.path.exists(ruta_diario):
+        return filas, editadas
+    for entrada in _leer_lineas(ruta_diario):
+        if len(entrada) != 9:
+            continue  # Línea incompleta (por ejemplo, el programa se cayó mientras la escribía)
+        original = _norm(entrada[0])
+        nuevo = _norm(entrada[4])  # entrada[4] es el documento del registro nuevo
+        for doc in (original, nuevo):
+            if doc not in filas:
+                filas[doc] = [primera[doc]] + otras.get(doc, []) if doc in primera else []
+        if not filas[original]:
+            continue  # El documento ya no existe: la edición ya estaba aplicada en el archivo base
+        fila = filas[original].pop(0)
+        editadas[fila] = entrada[1:]
+        bisect.insort(filas[nuevo], fila)
+    return filas, editadas
+
+# Aplica sobre los registros leídos las ediciones anotadas en el diario, en orden
+def _aplicar_diario(registros, ruta_diario):
+    if not os.path.exists(ruta_diario):
+        return registros
+    primera, otras = {}, {}
+    for i, reg in enumerate(registros):
+        _anotar_fila(primera, otras, _norm(reg[3]), i)
+    for i, registro in _repetir_diario(ruta_diario, primera, otras)[1].items():
+        registros[i] = registro
+    return registros
+
+# Guardar la edición de un paciente agregando una sola línea al diario, sin reescribir pacientes.txt
+def actualizar_paciente(doc_original, registro):
+    with bloqueo_datos(exclusivo=True):
+        firma_antes = _firma_archivo(ARCH_PACIENTES)
+        if _usar_sqlite(ARCH_PACIENTES):
+            _sqlite_actualizar_paciente(doc_original, registro)  # En SQLite la edición ya es una transacción
+            _registro_actualizado(doc_original, registro, firma_antes)
+            return
+        with open(ARCH_DIARIO_PACIENTES, "a", encoding="utf-8") as f:
+            f.write("|".join([_norm(doc_original)] + list(registro)) + "\n")
+            f.flush()
+            os.fsync(f.fileno())  # La edición queda en disco antes de confirmarla al usuario
+        _registro_actualizado(doc_original, registro, firma_antes)
+        if os.path.getsize(ARCH_DIARIO_PACIENTES) > LIMITE_DIARIO_BYTES:
+            compactar_pacientes()
+
+# Pasar las ediciones del diario a pacientes.txt y vaciar el diario.
+# escribir_registros usa archivo temporal + os.replace, así que pacientes.txt nunca queda a medias
+def compactar_pacientes():
+    if _usar_sqlite(ARCH_PACIENTES):
+        return False  # SQLite no usa diario
+    with bloqueo_datos(exclusivo=True):  # Ninguna edición puede llegar al diario entre la lectura y el vaciado
+        if not os.path.exists(ARCH_DIARIO_PACIENTES) or os.path.getsize(ARCH_DIARIO_PACIENTES) == 0:
+            return False
+        escribir_registros(ARCH_PACIENTES, leer_registros(ARCH_PACIENTES))
+        return True
+
+
+# ---------------------------
+#  BLOQUE: Almacenamiento SQLite (opcional)
+# ---------------------------
+
+# Tabla y columnas que reemplazan a cada archivo TXT cuando BACKEND es "sqlite"
+TABLAS_SQLITE = {
+    ARCH_PACIENTES: ("pacientes", ("nombre", "fecha_nac", "genero", "documento", "celular", "correo", "edad", "fecha_registro")),
+    ARCH_ENFERMEDADES: ("enfermedades", ("documento", "sintomas", "enfermedad", "fecha")),
+    ARCH_TRATAMIENTOS: ("tratamientos", ("documento", "medicamentos", "dosis", "fecha")),
+    ARCH_ALERGIAS: ("alergias", ("documento", "alergeno", "sintomas", "fecha")),
+}
+
+_conexiones_sqlite = {}  # ruta del .db -> conexión abierta
+
+def _usar_sqlite(ruta):
+    return BACKEND == "sqlite" and ruta in TABLAS_SQLITE
+
+def _crear_esquema(con):
+    for tabla, columnas in TABLAS_SQLITE.values():
+        con.execute(f"CREATE TABLE IF NOT EXISTS {tabla} ({', '.join(c + ' TEXT' for c in columnas)})")
+        con.execute(f"CREATE INDEX IF NOT EXISTS idx_{tabla}_documento ON {tabla}(documento)")
+    # Las búsquedas por nombre usan el índice en memoria también con SQLite (buscan dentro de las palabras, y un
+    # índice de prefijos no sirve para eso). Las bases viejas traían una tabla de palabras que ya no se mantiene
+    con.execute("DROP TABLE IF EXISTS tokens_nombre")
+    # Contador de versiones por tabla, para saber si otro proceso cambió los datos (equivale a la firma de un TXT)
+    con.execute("CREATE TABLE IF NOT EXISTS versiones (tabla TEXT PRIMARY KEY, version INTEGER)")
+    for tabla, _ in TABLAS_SQLITE.values():
+        con.execute("INSERT OR IGNORE INTO versiones VALUES (?, 0)", (tabla,))
+
+def _sqlite(ruta_db=None):
+    ruta_db = ruta_db or ARCH_SQLITE
+    con = _conexiones_sqlite.get(ruta_db)
+    if con is None:
+        import sqlite3
+        # isolation_level=None: las transacciones se abren a mano con BEGIN, así cada escritura es atómica
+        con = sqlite3.connect(ruta_db, isolation_level=None, check_same_thread=False)
+        con.execute("PRAGMA journal_mode=WAL")  # Varios lectores pueden leer mientras alguien escribe
+        con.execute("PRAGMA busy_timeout=5000")
+        with con:
+            _crear_esquema(con)
+        _conexiones_sqlite[ruta_db] = con
+    return con
+
+def cerrar_sqlite():
+    for con in _conexiones_sqlite.values():
+        con.close()
+    _conexiones_sqlite.clear()
+
+# Los TXT pueden tener más o menos campos de los esperados; se ajustan al número de columnas de la tabla
+def _ajustar_columnas(reg, n):
+    reg = list(reg)
+    if len(reg) > n:
+        return reg[:n - 1] + ["|".join(reg[n - 1:])]
+    return reg + [""] * (n - len(reg))
+
+def _sqlite_version(ruta):
+    tabla = TABLAS_SQLITE[ruta][0]
+    fila = _sqlite().execute("SELECT version FROM versiones WHERE tabla = ?", (tabla,)).fetchone()
+    return fila[0] if fila else 0
+
+def _sqlite_leer(ruta):
+    tabla, columnas = TABLAS_SQLITE[ruta]
+    return [list(fila) for fila in _sqlite().execute(f"SELECT {', '.join(columnas)} FROM {tabla} ORDER BY rowid")]
+
+def _sqlite_insertar(con, ruta, registros):
+    tabla, columnas = TABLAS_SQLITE[ruta]
+    filas = [_ajustar_columnas(reg, len(columnas)) for reg in registros]
+    con.executemany(f"INSERT INTO {tabla} VALUES ({', '.join('?' * len(columnas))})", filas)
+    con.execute("UPDATE versiones SET version = version + 1 WHERE tabla = ?", (tabla,))
+
+def _sqlite_agregar(ruta, registros):
+    con = _sqlite()
+    with con:
+        con.execute("BEGIN IMMEDIATE")
+        _sqlite_insertar(con, ruta, registros)
+
+def _sqlite_reemplazar(ruta, registros):
+    con = _sqlite()
+    tabla = TABLAS_SQLITE[ruta][0]
+    with con:
+        con.execute("BEGIN IMMEDIATE")
+        con.execute(f"DELETE FROM {tabla}")
+        _sqlite_insertar(con, ruta, registros)
+
+def _sqlite_actualizar_paciente(doc_original, registro):
+    tabla, columnas = TABLAS_SQLITE[ARCH_PACIENTES]
+    registro = _ajustar_columnas(registro, len(columnas))
+    doc_original = _norm(doc_original)
+    con = _sqlite()
+    with con:
+        con.execute("BEGIN IMMEDIATE")
+        con.execute(f"UPDATE {tabla} SET {', '.join(c + ' = ?' for c in columnas)} "
+                    f"WHERE rowid = (SELECT rowid FROM {tabla} WHERE documento = ? ORDER BY rowid LIMIT 1)",
+                    registro + [doc_original])
+        con.execute("UPDATE versiones SET version = version + 1 WHERE tabla = ?", (tabla,))
+
+# Importar una sola vez los TXT actuales (con las ediciones del diario ya aplicadas) a la base SQLite
+def migrar_a_sqlite(ruta_db=None):
+    con = _sqlite(ruta_db)
+    totales = {}
+    with con:
+        con.execute("BEGIN IMMEDIATE")
+        for ruta, (tabla, _) in TABLAS_SQLITE.items():
+            registros = _leer_lineas(ruta)
+            if ruta in DIARIOS:
+                _aplicar_diario(registros, DIARIOS[ruta])
+            con.execute(f"DELETE FROM {tabla}")
+            _sqlite_insertar(con, ruta, registros)
+            totales[tabla] = len(registros)
+    return totales
+
+
+# Mantener los índices al día después de un append hecho por nosotros mismos
+def _registros_agregados(ruta, registros, firma_antes):
+    _reporte_agregados(ruta, registros, firma_antes)
+    _vistas_modificadas(ruta, (campos[3 if ruta == ARCH_PACIENTES else 0] for campos in registros), firma_antes)
+    if ruta == ARCH_PACIENTES and not _usar_sqlite(ruta):
+        _posiciones_agregadas(firma_antes)
+    if ruta == ARCH_PACIENTES:
+        indice = _indice_pacientes
+    elif ruta in _indices_historial:
+        indice = _indices_historial[ruta]
+    else:
+        return
+    # Solo se actualiza en memoria si el índice estaba al día antes de escribir; si no, se recargará completo
+    if indice["firma"] is None or indice["firma"] != firma_antes:
+        return
+    if ruta != ARCH_PACIENTES and not _usar_sqlite(ruta):
+        # Solo se leen las líneas nuevas, desde donde terminaba el archivo antes del append
+        _indexar_posiciones(indice, ruta, firma_antes[1])
+        indice["firma"] = _firma_archivo(ruta)
+        return
+    if len(registros) > LIMITE_ACTUALIZACION_INCREMENTAL:
+        indice["firma"] = None  # Para cargas masivas es más barato recargar todo una vez que actualizar fila por fila
+        return
+    for campos in registros:
+        if ruta == ARCH_PACIENTES:
+            doc = _norm(campos[3])
+            if doc not in indice["por_doc"]:
+                if indice["tabla"] is not None:
+                    indice["tabla"].agregar(campos)
+                    indice["por_doc"][doc] = indice["tabla"][-1]
+                else:
+                    indice["por_doc"][doc] = list(campos)
+                indice["posicion"][doc] = len(indice["posicion"])
+                _indexar_nombre(doc, campos[0])
+                _ordenes_agregar(doc, campos)
+        else:
+            indice["por_doc"].setdefault(_norm(campos[0]), []).append(list(campos))
+    indice["firma"] = _firma_archivo(ruta)
+
+# Mantener los índices al día después de anotar una edición en el diario
+def _registro_actualizado(doc_original, registro, firma_antes):
+    _reporte_actualizado(doc_original, registro, firma_antes)
+    _vistas_modificadas(ARCH_PACIENTES, [doc_original, registro[3]], firma_antes)
+    if _indice_pacientes["firma"] is None or _indice_pacientes["firma"] != firma_antes:
+        return  # El índice ya estaba desactualizado: se recargará completo la próxima vez
+    doc_original = _norm(doc_original)
+    doc_nuevo = _norm(registro[3])
+    por_doc = _indice_pacientes["por_doc"]
+    if doc_original not in por_doc:
+        return
+    anterior = por_doc[doc_original]
+    _desindexar_nombre(doc_original, anterior[0])
+    _ordenes_quitar(doc_original, anterior)
+    if doc_nuevo != doc_original:
+        # Cambió el documento: el paciente conserva su posición, pero en el diccionario queda al final
+        del por_doc[doc_original]
+        _indice_pacientes["posicion"][doc_nuevo] = _indice_pacientes["posicion"].pop(doc_original)
+        _indice_pacientes["en_orden"] = False
+    if _indice_pacientes["tabla"] is not None:
+        _indice_pacientes["tabla"].reemplazar(anterior._i, registro)  # La misma fila de la tabla, con los datos nuevos
+        por_doc[doc_nuevo] = anterior
+    else:
+        por_doc[doc_nuevo] = list(registro)
+    _indexar_nombre(doc_nuevo, registro[0])
+    _ordenes_agregar(doc_nuevo, registro)
+    _indice_pacientes["firma"] = _firma_archivo(ARCH_PACIENTES)
+
+# Mantener los índices al día después de reescribir un archivo completo
+def _registros_reescritos(ruta, registros):
+    if ruta in ARCHIVOS_VISTA:
+        _reporte["conteos"] = None
+        _vaciar_vistas()
+    if ruta == ARCH_PACIENTES:
+        _indexar_registros(registros, _firma_archivo(ruta))
+    elif ruta in _indices_historial and _usar_sqlite(ruta):
+        _indices_historial[ruta]["por_doc"] = _agrupar_por_documento([list(reg) for reg in registros])
+        _indices_historial[ruta]["firma"] = _firma_archivo(ruta)
+    elif ruta in _indices_historial:
+        _indices_historial[ruta]["firma"] = None  # Las posiciones cambiaron: se vuelven a leer la próxima vez
+
+
+# ---------------------------
+#  BLOQUE: Tabla compacta de pacientes (columnas)
+# ---------------------------
+
+# Cada registro de leer_registros es una lista con 8 textos sueltos; con un millón de pacientes eso son
+# cientos de MB. La tabla guarda cada columna en un arreglo de números: documento y celular como enteros,
+# fechas como días (ordinal) o segundos, género como código pequeño, y nombres y correos como índices a
+# una lista de textos sin repetir. Lo que no cabe en esa forma (por ejemplo un documento con letras o un
+# campo de más) se guarda tal cual en "irregulares", así la tabla devuelve siempre el texto original.
+# Con CLINICA_INDICE_COMPACTO=1 el índice de pacientes en memoria guarda vistas de esta tabla (ver INDICE_COMPACTO)
+
+GENEROS_TABLA = ("MASCULINO", "FEMENINO", "NO BINARIO", "PREFIERO NO DECIRLO")
+
+def _fecha_hora_a_segundos(texto):
+    if len(texto) != 19 or texto[10] != " " or texto[13] != ":" or texto[16] != ":" \
+            or not (texto[11:13] + texto[14:16] + texto[17:]).isdigit():
+        raise ValueError(texto)
+    horas, minutos, segundos = int(texto[11:13]), int(texto[14:16]), int(texto[17:])
+    if horas > 23 or minutos > 59 or segundos > 59:
+        raise ValueError(texto)  # No se podría devolver igual: 25:00:00 saldría como las 01:00 del día siguiente
+    return _fecha_a_ordinal(texto[:10]) * 86400 + horas * 3600 + minutos * 60 + segundos
+
+def _segundos_a_fecha_hora(segundos):
+    dias, resto = divmod(segundos, 86400)
+    return f"{date.fromordinal(dias).isoformat()} {resto // 3600:02d}:{resto // 60 % 60:02d}:{resto % 60:02d}"
+
+# Texto que se puede guardar como entero y volver a escribir igual: solo dígitos ASCII (int("٣") también
+# funciona, pero al volver a texto daría "3"). Los ceros a la izquierda los recupera el largo guardado
+def _entero_exacto(texto, largo_max):
+    return texto.isascii() and texto.isdigit() and len(texto) <= largo_max
+
+class TablaPacientes:
+    COLUMNAS = ("nombre", "fecha_nac", "genero", "documento", "celular", "correo", "edad", "fecha_registro")
+
+    def __init__(self):
+        self.textos = []         # Nombres y correos sin repetir
+        self._id_texto = {}      # texto -> posición en self.textos
+        self.generos = list(GENEROS_TABLA)
+        self.nombre = array("i")
+        self.fecha_nac = array("i")       # Ordinal de la fecha (date.toordinal)
+        self.genero = array("b")
+        self.documento = array("q")
+        self.largo_documento = array("b")  # Para recuperar los ceros a la izquierda
+        self.celular = array("q")
+        self.largo_celular = array("b")
+        self.correo = array("i")
+        self.edad = array("h")
+        self.fecha_registro = array("q")  # Segundos desde el día ordinal 0
+        self.irregulares = {}    # (columna, fila) -> texto original que no cabe en la forma compacta
+        self.largos = {}         # fila -> cantidad de campos, solo si la línea no tenía exactamente 8
+
+    @classmethod
+    def desde_registros(cls, registros):
+        tabla = cls()
+        for reg in registros:
+            tabla.agregar(reg)
+        return tabla
+
+    def __len__(self):
+        return len(self.documento)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return FilaPaciente(self, i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield FilaPaciente(self, i)
+
+    def _id(self, texto):
+        i = self._id_texto.get(texto)
+        if i is None:
+            i = self._id_texto[texto] = len(self.textos)
+            self.textos.append(texto)
+        return i
+
+    def agregar(self, reg):
+        columnas = (self.nombre, self.fecha_nac, self.genero, self.documento, self.largo_documento,
+                    self.celular, self.largo_celular, self.correo, self.edad, self.fecha_registro)
+        try:
+            # Camino rápido para el caso normal: 8 campos, todos con el formato esperado
+            nombre, fecha_nac, genero, documento, celular, correo, edad, fecha_registro = reg
+            if not (_entero_exacto(documento, 18) and _entero_exacto(celular, 18) and _entero_exacto(edad, 4)) \
+                    or genero not in self.generos or (edad[0] == "0" and edad != "0") \
+                    or not (fecha_nac + fecha_registro).isascii():
+                raise ValueError(reg)
+            valores = (self._id(nombre), _fecha_a_ordinal(fecha_nac), self.generos.index(genero),
+                       int(documento), len(documento), int(celular), len(celular), self._id(correo),
+                       int(edad), _fecha_hora_a_segundos(fecha_registro))
+        except ValueError:
+            # Algún campo raro: se agrega la fila en ceros y se guarda columna por columna
+            for columna in columnas:
+                columna.append(0)
+            self.reemplazar(len(self) - 1, reg)
+            return
+        for columna, valor in zip(columnas, valores):
+            columna.append(valor)
+
+    def reemplazar(self, i, reg):
+        for k in range(len(self.COLUMNAS), self.largo(i)):
+            del self.irregulares[(k, i)]  # Campos de más que traía la versión anterior de la fila
+        if len(reg) == len(self.COLUMNAS):
+            self.largos.pop(i, None)
+        else:
+            self.largos[i] = len(reg)
+        for k in range(len(self.COLUMNAS)):
+            texto = reg[k] if k < len(reg) else ""
+            self.irregulares.pop((k, i), None)
+            try:
+                self._guardar(k, i, texto)
+            except (ValueError, OverflowError):
+                self.irregulares[(k, i)] = texto
+        for k in range(len(self.COLUMNAS), len(reg)):
+            self.irregulares[(k, i)] = reg[k]
+
+    def _guardar(self, k, i, texto):
+        if k == 0:
+            self.nombre[i] = self._id(texto)
+        elif k == 1:
+            if not texto.isascii():
+                raise ValueError(texto)
+            self.fecha_nac[i] = _fecha_a_ordinal(texto)
+        elif k == 2:
+            if texto not in self.generos:
+                if len(self.generos) >= 127:
+                    raise ValueError(texto)
+                self.generos.append(texto)
+            self.genero[i] = self.generos.index(texto)
+        elif k in (3, 4):
+            if not _entero_exacto(texto, 18):
+                raise ValueError(texto)
+            (self.documento if k == 3 else self.celular)[i] = int(texto)
+            (self.largo_documento if k == 3 else self.largo_celular)[i] = len(texto)
+        elif k == 5:
+            self.correo[i] = self._id(texto)
+        elif k == 6:
+            if not _entero_exacto(texto, 4) or (texto[0] == "0" and texto != "0"):
+                raise ValueError(texto)
+            self.edad[i] = int(texto)
+        else:
+            if not texto.isascii():
+                raise ValueError(texto)
+            self.fecha_registro[i] = _fecha_hora_a_segundos(texto)
+
+    # Cantidad de campos de la fila i (8 salvo en las líneas irregulares)
+    def largo(self, i):
+        return self.largos.get(i, len(self.COLUMNAS)) if self.largos else len(self.COLUMNAS)
+
+    # Texto de la columna k en la fila i, igual al que había en el archivo
+    def valor(self, k, i):
+        if self.irregulares and (k, i) in self.irregulares:
+            return self.irregulares[(k, i)]
+        if k == 0:
+            return self.textos[self.nombre[i]]
+        if k == 1:
+            return date.fromordinal(self.fecha_nac[i]).isoformat()
+        if k == 2:
+            return self.generos[self.genero[i]]
+        if k == 3:
+            return str(self.documento[i]).zfill(self.largo_documento[i])
+        if k == 4:
+            return str(self.celular[i]).zfill(self.largo_celular[i])
+        if k == 5:
+            return self.textos[self.correo[i]]
+        if k == 6:
+            return str(self.edad[i])
+        return _segundos_a_fecha_hora(self.fecha_registro[i])
+
+    # Edad actual de todos los pacientes, calculada de una vez sobre la columna de fechas.
+    # -1 si la fecha de nacimiento no se puede leer (esas están en "irregulares", no en la columna)
+    def edades(self, referencia=None):
+        edades = edades_de_ordinales(self.fecha_nac, referencia)
+        for k, i in self.irregulares:
+            if k == 1:
+                edades[i] = -1
+        return edades
+
+def _propiedad_columna(k):
+    return property(lambda fila: fila._tabla.valor(k, fila._i))
+
+# Vista de una fila de la tabla. No copia datos: lee las columnas cuando se le pide un campo.
+# Se comporta como el registro de leer_registros (fila[3] es el documento, "|".join(fila) y list(fila) funcionan),
+# pero no se puede modificar: quien quiera editar un paciente trabaja sobre list(fila)
+class FilaPaciente:
+    __slots__ = ("_tabla", "_i")
+
+    def __init__(self, tabla, i):
+        self._tabla = tabla
+        self._i = i
+
+    nombre = _propiedad_columna(0)
+    fecha_nac = _propiedad_columna(1)
+    genero = _propiedad_columna(2)
+    documento = _propiedad_columna(3)
+    celular = _propiedad_columna(4)
+    correo = _propiedad_columna(5)
+    edad = _propiedad_columna(6)
+    fecha_registro = _propiedad_columna(7)
+
+    def __len__(self):
+        return self._tabla.largo(self._i)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self._tabla.valor(j, self._i) for j in range(len(self))[k]]
+        return self._tabla.valor(range(len(self))[k], self._i)
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self._tabla.valor(k, self._i)
+
+    def __eq__(self, otro):
+        return list(self) == list(otro) if isinstance(otro, (FilaPaciente, list)) else NotImplemented
+
+    __hash__ = None  # Igual que una lista
+
+    def como_lista(self):
+        return list(self)
+
+    def __repr__(self):
+        return f"FilaPaciente({self.como_lista()!r})"
+
+# Cargar pacientes.txt directo a la tabla compacta, línea por línea, sin armar la lista de listas.
+# Las ediciones del diario se repiten igual que en _aplicar_diario y se aplican al final sobre la tabla
+def cargar_tabla_pacientes():
+    if _usar_sqlite(ARCH_PACIENTES):
+        return TablaPacientes.desde_registros(leer_registros(ARCH_PACIENTES))
+    tabla = TablaPacientes()
+    with bloqueo_datos():  # El archivo y su diario se leen juntos, igual que en leer_registros
+        with open(ARCH_PACIENTES, "r", encoding="utf-8") as f:
+            for linea in f:
+                linea = linea.strip()
+                if linea:
+                    tabla.agregar(linea.split("|"))
+        editadas = {}
+        if os.path.exists(ARCH_DIARIO_PACIENTES):
+            primera, otras = {}, {}
+            for i in range(len(tabla)):
+                _anotar_fila(primera, otras, _norm(tabla.valor(3, i)), i)
+            editadas = _repetir_diario(ARCH_DIARIO_PACIENTES, primera, otras)[1]
+    for i, registro in editadas.items():
+        tabla.reemplazar(i, registro)
+    return tabla
+
+
+# ---------------------------
+#  BLOQUE: Edad calculada al leer
+# ---------------------------
+
+# La columna 6 (edad) se guarda el día del registro y queda vieja en cada cumpleaños. Por eso la edad se
+# calcula con la fecha de nacimiento cada vez que se muestra. La columna se sigue escribiendo para no
+# cambiar el formato de los archivos, pero solo se usa si la fecha de nacimiento no se puede leer.
+# Truco AAAAMMDD: con las fechas como números (20251201 y 20010415), (hoy - nacimiento) // 10000 es la edad
+_referencia_edad = {"ordinal": None, "aaaammdd": 0}  # "Hoy" ya convertido, se recalcula solo cuando cambia el día
+
+def _aaaammdd(fecha):
+    return fecha.year * 10000 + fecha.month * 100 + fecha.day
+
+def _hoy_aaaammdd(referencia=None):
+    if referencia is not None:
+        return _aaaammdd(referencia)
+    ordinal = date.today().toordinal()
+    if ordinal != _referencia_edad["ordinal"]:
+        _referencia_edad["aaaammdd"] = _aaaammdd(date.fromordinal(ordinal))
+        _referencia_edad["ordinal"] = ordinal
+    return _referencia_edad["aaaammdd"]
+
+@functools.lru_cache(maxsize=65536)  # Las fechas se repiten mucho (nacimientos, días de registro)
+def _fecha_a_ordinal(texto):
+    if len(texto) != 10 or texto[4] != "-" or texto[7] != "-" or not (texto[:4] + texto[5:7] + texto[8:]).isdigit():
+        raise ValueError(texto)
+    return date(int(texto[:4]), int(texto[5:7]), int(texto[8:])).toordinal()
+
+@functools.lru_cache(maxsize=65536)
+def _ordinal_a_aaaammdd(ordinal):
+    return _aaaammdd(date.fromordinal(ordinal)) if ordinal > 0 else 0
+
+# Ordinal de una fecha de nacimiento, o 0 si no se puede leer (así la guarda también la tabla compacta)
+def _ordinal_nacimiento(fecha_nac):
+    try:
+        return _fecha_a_ordinal(fecha_nac)
+    except ValueError:
+        return 0
+
+_ORDINAL_1970 = date(1970, 1, 1).toordinal()  # Día 0 de las fechas de NumPy (datetime64)
+
+# Edades de muchos pacientes de una vez, a partir de sus fechas de nacimiento como ordinales (la columna
+# fecha_nac de TablaPacientes o una lista). Con NumPy se calculan sobre el arreglo completo con el mismo truco
+# AAAAMMDD; sin NumPy, fecha por fecha. Un ordinal 0 (fecha ilegible) o una fecha futura dan -1
+def edades_de_ordinales(ordinales, referencia=None):
+    hoy_ = _hoy_aaaammdd(referencia)
+    np = _numpy()
+    if np is None or len(ordinales) == 0:
+        return [(hoy_ - n) // 10000 if 0 < n <= hoy_ else -1 for n in map(_ordinal_a_aaaammdd, ordinales)]
+    dias = np.asarray(ordinales, dtype=np.int64)
+    fechas = (np.maximum(dias, 1) - _ORDINAL_1970).astype("datetime64[D]")
+    meses = fechas.astype("datetime64[M]")
+    nacimientos = ((fechas.astype("datetime64[Y]").astype(np.int64) + 1970) * 10000
+                   + (meses.astype(np.int64) % 12 + 1) * 100 + (fechas - meses).astype(np.int64) + 1)
+    edades = (hoy_ - nacimientos) // 10000
+    edades[(dias <= 0) | (nacimientos > hoy_)] = -1
+    return edades.tolist()
+
+# Edad en años a la fecha "referencia" (hoy si no se da), o None si la fecha de nacimiento no es válida
+def edad_de(fecha_nac, referencia=None):
+    try:
+        nacimiento = _ordinal_a_aaaammdd(_fecha_a_ordinal(fecha_nac))
+    except ValueError:
+        return None
+    hoy_ = _hoy_aaaammdd(referencia)
+    if nacimiento > hoy_:
+        return None
+    return (hoy_ - nacimiento) // 10000
+
+# Edad para mostrar de un registro de paciente: la calculada, o la guardada si la fecha no se puede leer
+def edad_paciente(reg, referencia=None):
+    edad = edad_de(reg[1], referencia)
+    if edad is None:
+        return reg[6] if len(reg) > 6 else ""
+    return str(edad)
 
 
 # ---------------------------
@@ -143,49 +1721,37 @@ def agregar_registro(ruta, campos):
 # ---------------------------
 
 def existe_documento(documento):  # Verificamos si ya existe el documento del paciente en el archivo "ARCH_PACIENTES"
-    documento = _norm(documento)
-    for reg in leer_registros(ARCH_PACIENTES):
-        if _norm(reg[3]) == documento:
-            return True
-    return False  # Esta función devuelve un True o False dependiendo si el documento del paciente existe o no
+    return obtener_paciente(documento) is not None  # Esta función devuelve un True o False dependiendo si el documento del paciente existe o no
 
 def buscar_paciente_por_doc_o_nombre(clave): # Buscar paciente por nombre o documento
     clave_n = _norm(clave)
-    lista = leer_registros(ARCH_PACIENTES)
+    indice = indice_pacientes()
 
-    if not lista:
+    if not indice:
         return None
 
     # 1) Buscar por DOCUMENTO (es único y exacto)
-    for reg in lista:
-        doc = _norm(reg[3])  # documento
-        if doc == clave_n:
-            return reg
-
-    # 2) Buscar por NOMBRE (búsqueda parcial - coincide si la clave está en el nombre)
-    coincidencias = []
-    for reg in lista:
-        nombre = _norm(reg[0])  # Nombre completo normalizado
-        # Dividimos el nombre en palabras para búsqueda flexible
-        palabras_nombre = nombre.split()
-        
-        # Buscamos si la clave coincide exactamente con todo el nombre
-        if nombre == clave_n:
-            coincidencias.append(reg)
-        # O si la clave coincide con alguna palabra individual (nombre o apellido)
-        elif any(clave_n in palabra or palabra in clave_n for palabra in palabras_nombre):
-            coincidencias.append(reg)
-
-    # Si no hay nadie con ese nombre
+    reg = indice.get(clave_n)
+    if reg is not None:
+        return list(reg)  # Copia, porque editar_paciente modifica el registro que recibe
+
+    # 2) Buscar por NOMBRE (búsqueda parcial - coincide si la clave está en alguna palabra del nombre o al revés)
+    coincidencias = buscar_por_nombre(clave_n)  # Usa el índice de palabras, sin recorrer todos los pacientes
+
+    # 3) Si no hay nadie con ese nombre, buscar nombres parecidos (errores de digitación, tildes)
     if not coincidencias:
-        return None
+        coincidencias = [reg for reg, _ in buscar_difuso(clave_n)]
+        if not coincidencias:
+            return None
+        print("\nNo hay coincidencias exactas. Pacientes con nombre parecido (del más al menos parecido):")
 
     # Si solo hay uno con ese nombre, listo
-    if len(coincidencias) == 1:
-        return coincidencias[0]
+    elif len(coincidencias) == 1:
+        return list(coincidencias[0])
 
     # Si hay varios con el mismo nombre: pedir que elija por documento
-    print("\nHay varios pacientes que coinciden con tu búsqueda. Elige por documento:")
+    else:
+        print("\nHay varios pacientes que coinciden con tu búsqueda. Elige por documento:")
     for reg in coincidencias:
         print(f"- Nombre: {reg[0]} | Documento: {reg[3]} | Celular: {reg[4]}")
 
@@ -193,7 +1759,7 @@ def buscar_paciente_por_doc_o_nombre(clave): # Buscar paciente por nombre o docu
 
     for reg in coincidencias:  # Buscamos al paciente por numero de documento
         if _norm(reg[3]) == doc_elegido:
-            return reg
+            return list(reg)
 
     print(">>> Documento no coincide con la lista mostrada.")
     return None
@@ -264,7 +1830,9 @@ def agregar_paciente():
     fecha_reg = hoy()
 
     # Guardar paciente con nuevo formato: nombre|fecha_nacimiento|genero|documento|celular|correo|edad|fecha_registro
-    agregar_registro(ARCH_PACIENTES, [nombre, fecha_nac, genero, documento, celular, correo, str(edad), fecha_reg])
+    if not registrar_paciente([nombre, fecha_nac, genero, documento, celular, correo, str(edad), fecha_reg]):
+        print(">>> Ya existe un paciente con ese documento (otro equipo lo acaba de registrar).")
+        return
     print(">>> Paciente agregado correctamente.")
 
 def editar_paciente():
@@ -284,7 +1852,7 @@ def editar_paciente():
     print(f"Documento: {reg[3]}")
     print(f"Celular: {reg[4]}")
     print(f"Correo: {reg[5]}")
-    print(f"Edad: {reg[6]}")
+    print(f"Edad: {edad_paciente(reg)}")
     print(f"Fecha registro: {reg[7]}")
 
     nuevo_nombre = input("Nuevo nombre (Enter para mantener): ").strip()
@@ -347,23 +1915,16 @@ def editar_paciente():
             print(f">>> Error: {error_msg}")
             return
 
-    todos = leer_registros(ARCH_PACIENTES)
-    for i in range(len(todos)):
-        if _norm(todos[i][3]) == _norm(doc_original):
-            todos[i] = reg
-            break
-
-    escribir_registros(ARCH_PACIENTES, todos)
+    if not guardar_edicion_paciente(doc_original, reg):
+        print(">>> No se puede cambiar: el documento nuevo ya existe.")
+        return
     print(">>> Paciente actualizado.")
 
 def mostrar_historial(documento):
     print("\n--- Historial Médico ---")
 
     # Enfermedades
-    enf = []
-    for r in leer_registros(ARCH_ENFERMEDADES):  # Leemos todas las enfermedades y agregamos a la lista las que coinciden con el paciente
-        if _norm(r[0]) == _norm(documento):
-            enf.append(r)  # Agregamos a enf para poder mostrarlas en pantalla mas adelante
+    enf = historial_de(ARCH_ENFERMEDADES, documento)  # Solo las enfermedades de este paciente, sin recorrer todo el archivo
 
     print("\nEnfermedades:")
     if enf:  # Comprobamos que enf no este vacia
@@ -373,10 +1934,7 @@ def mostrar_historial(documento):
         print("- Sin registros")
 
     # Tratamientos
-    tra = []
-    for r in leer_registros(ARCH_TRATAMIENTOS):
-        if _norm(r[0]) == _norm(documento):
-            tra.append(r)
+    tra = historial_de(ARCH_TRATAMIENTOS, documento)
 
     print("\nTratamientos:")
     if tra:
@@ -386,10 +1944,7 @@ def mostrar_historial(documento):
         print("- Sin registros")
 
     # Alergias
-    ale = []
-    for r in leer_registros(ARCH_ALERGIAS):
-        if _norm(r[0]) == _norm(documento):
-            ale.append(r)
+    ale = historial_de(ARCH_ALERGIAS, documento)
 
     print("\nAlergias:")
     if ale:
@@ -400,22 +1955,25 @@ def mostrar_historial(documento):
 
 def listar_pacientes():
     print("\n--- Listar Pacientes ---")
-    pacientes = leer_registros(ARCH_PACIENTES)
-    if not pacientes:
+    if total_pacientes() == 0:
         print(">>> No hay pacientes registrados.")
         return
     
     print("\nOpciones de ordenamiento:")
     print("1. Ordenar por fecha de registro (más reciente primero)")
     print("2. Ordenar por documento de identidad (ascendente)")
+    print("3. Ordenar por edad (menor a mayor)")
+    print("4. Ordenar por nombre (alfabético)")
     opcion = input("Selecciona una opción: ").strip()
     
     if opcion == "1":
-        # Ordenar por fecha de registro (índice 7)
-        pacientes.sort(key=lambda x: x[7], reverse=True)
+        orden = "registro"  # Fecha de registro (índice 7)
     elif opcion == "2":
-        # Ordenar por documento (índice 3)
-        pacientes.sort(key=lambda x: x[3])
+        orden = "documento"  # Documento (índice 3)
+    elif opcion == "3":
+        orden = "edad"  # Edad calculada con la fecha de nacimiento (índice 1)
+    elif opcion == "4":
+        orden = "nombre"  # Nombre (índice 0)
     else:
         print(">>> Opción inválida.")
         return
@@ -423,14 +1981,23 @@ def listar_pacientes():
     print("\n" + "="*100)
     print(f"{'Documento':<15} {'Nombre':<30} {'Género':<15} {'Edad':<8} {'Celular':<12} {'Fecha Registro':<15}")
     print("="*100)
-    for p in pacientes:
-        documento = p[3]
-        nombre = p[0]
-        genero = p[2]
-        edad = p[6]
-        celular = p[4]
-        fecha_reg = p[7]
-        print(f"{documento:<15} {nombre:<30} {genero:<15} {edad:<8} {celular:<12} {fecha_reg:<15}")
+    mostrados = 0
+    total = total_pacientes()
+    referencia = date.today()  # La misma fecha para todo el listado
+    for pagina in paginas_pacientes(orden, TAM_PAGINA_CONSOLA):  # Se imprime una página a la vez
+        for p in pagina:
+            documento = p[3]
+            nombre = p[0]
+            genero = p[2]
+            edad = edad_paciente(p, referencia)
+            celular = p[4]
+            fecha_reg = p[7]
+            print(f"{documento:<15} {nombre:<30} {genero:<15} {edad:<8} {celular:<12} {fecha_reg:<15}")
+        mostrados += len(pagina)
+        if mostrados < total:
+            seguir = input(f"-- {mostrados} de {total}. Enter para ver más, 0 para terminar: ").strip()
+            if seguir == "0":
+                break
     print("="*100)
 
 def consultar_paciente():
@@ -448,7 +2015,7 @@ def consultar_paciente():
     print(f"Documento: {reg[3]}")
     print(f"Celular: {reg[4]}")
     print(f"Correo: {reg[5]}")
-    print(f"Edad: {reg[6]} años")
+    print(f"Edad: {edad_paciente(reg)} años")
     print(f"Fecha registro: {reg[7]}")
 
     mostrar_historial(reg[3])
@@ -501,29 +2068,183 @@ recetas = {
     ("vision borrosa", "dolor ocular", "enrojecimiento"): "Infección ocular o Glaucoma",
 }
 
-# Función de consulta (se mantiene igual que en la Entrega 1, cambiando los print por return)
+# Las recetas se compilan una vez: el conjunto de síntomas (sin importar el orden) es la llave,
+# y cada síntoma apunta a las recetas que lo incluyen para poder buscar coincidencias parciales
+def compilar_recetas(recetas):
+    exactas = {}       # frozenset de síntomas -> enfermedad
+    por_sintoma = {}   # síntoma -> set de conjuntos de síntomas que lo contienen
+    orden = {}         # conjunto de síntomas -> posición en el diccionario (para desempatar)
+    for sintomas, enfermedad in recetas.items():
+        clave = frozenset(_norm(x) for x in sintomas)
+        if clave in exactas:
+            continue  # Si dos recetas tienen los mismos síntomas, se queda la primera
+        exactas[clave] = enfermedad
+        orden[clave] = len(orden)
+        for sintoma in clave:
+            por_sintoma.setdefault(sintoma, set()).add(clave)
+    # Para los lotes: cada síntoma conocido es un bit y cada receta es una máscara de bits
+    vocabulario = {sintoma: i for i, sintoma in enumerate(sorted(por_sintoma))}
+    claves = list(exactas)  # En el orden de las recetas
+    mascaras = [sum(1 << vocabulario[sintoma] for sintoma in clave) for clave in claves]
+    return {"exactas": exactas, "por_sintoma": por_sintoma, "orden": orden,
+            "vocabulario": vocabulario, "enfermedades": [exactas[c] for c in claves],
+            "mascaras": mascaras, "tamanos": [len(c) for c in claves],
+            "por_mascara": {m: exactas[c] for m, c in zip(mascaras, claves)}}
+
+_reglas = compilar_recetas(recetas)
+
+# Función de consulta: una sola búsqueda en el diccionario, sin probar las 6 permutaciones
 def diagnosticar(sintoma1, sintoma2, sintoma3):
-    clave1 = (sintoma1, sintoma2, sintoma3)
-    clave2 = (sintoma1, sintoma3, sintoma2)
-    clave3 = (sintoma2, sintoma1, sintoma3)
-    clave4 = (sintoma2, sintoma3, sintoma1)
-    clave5 = (sintoma3, sintoma1, sintoma2)
-    clave6 = (sintoma3, sintoma2, sintoma1)
-
-    if clave1 in recetas:
-        return recetas[clave1]
-    elif clave2 in recetas:
-        return recetas[clave2]
-    elif clave3 in recetas:
-        return recetas[clave3]
-    elif clave4 in recetas:
-        return recetas[clave4]
-    elif clave5 in recetas:
-        return recetas[clave5]
-    elif clave6 in recetas:
-        return recetas[clave6]
-    else:
-        return "No determinada"
+    return _reglas["exactas"].get(frozenset((sintoma1, sintoma2, sintoma3)), "No determinada")
+
+# Diagnósticos posibles cuando los síntomas coinciden solo en parte con una receta (por ejemplo 2 de 3).
+# Devuelve hasta k tuplas (enfermedad, síntomas que coinciden, síntomas de la receta), de la más a la menos probable
+def diagnosticar_parcial(sintomas, minimo=2, k=5):
+    coincidencias = {}
+    for sintoma in set(_norm(x) for x in sintomas):
+        for clave in _reglas["por_sintoma"].get(sintoma, ()):  # Solo se revisan las recetas que tienen ese síntoma
+            coincidencias[clave] = coincidencias.get(clave, 0) + 1
+    candidatas = [(clave, n) for clave, n in coincidencias.items() if n >= minimo]
+    orden = _reglas["orden"]
+    mejores = heapq.nsmallest(k, candidatas, key=lambda par: (-par[1], -par[1] / len(par[0]), orden[par[0]]))
+    return [(_reglas["exactas"][clave], n, len(clave)) for clave, n in mejores]
+
+# ---------------------------
+#  BLOQUE: Diagnóstico por lotes
+# ---------------------------
+
+# NumPy es opcional: si está, los puntajes del lote se calculan con arreglos.
+# Se importa la primera vez que hace falta, porque cargarlo tarda más que arrancar todo el programa
+@functools.lru_cache(maxsize=None)
+def _numpy():
+    try:
+        import numpy
+        return numpy
+    except Exception:
+        return None
+
+# Convierte una lista de síntomas en (máscara de bits de los síntomas conocidos, cantidad de síntomas distintos)
+def _codificar_sintomas(sintomas):
+    vocabulario = _reglas["vocabulario"]
+    distintos = set(_norm(x) for x in sintomas if x.strip())
+    mascara = 0
+    for sintoma in distintos:
+        if sintoma in vocabulario:
+            mascara |= 1 << vocabulario[sintoma]
+    return mascara, len(distintos)
+
+# Máscaras de bits -> matriz 0/1 de (máscaras x síntomas del vocabulario). Los bytes de cada máscara se
+# desempaquetan con NumPy, sin recorrer los bits en Python
+def _matriz_sintomas(np, mascaras):
+    n_sintomas = len(_reglas["vocabulario"])
+    n_bytes = max(1, (n_sintomas + 7) // 8)
+    crudo = np.frombuffer(b"".join(m.to_bytes(n_bytes, "little") for m in mascaras), dtype=np.uint8)
+    bits = np.unpackbits(crudo.reshape(len(mascaras), n_bytes), axis=1, bitorder="little")[:, :n_sintomas]
+    return bits.astype(np.float32)  # En float32 el producto usa BLAS; los conteos son enteros pequeños y quedan exactos
+
+# Cuántos síntomas de cada receta aparecen en cada entrada: matriz de (entradas x recetas).
+# Con NumPy es un solo producto de matrices 0/1; sin NumPy se cuenta con operaciones de bits
+def puntuar_lote(codificados):
+    np = _numpy()
+    if np is not None:
+        entradas = _matriz_sintomas(np, [mascara for mascara, _ in codificados])
+        reglas = _matriz_sintomas(np, _reglas["mascaras"])
+        return (entradas @ reglas.T).astype(np.int32)
+    return [[bin(mascara & regla).count("1") for regla in _reglas["mascaras"]] for mascara, _ in codificados]
+
+# La misma regla del ciclo de diagnosticar_lote, sobre toda la matriz de puntajes a la vez: la receta exacta si la hay;
+# si no, la de más síntomas en común, luego la de mayor proporción y luego la primera (argmax da el primer máximo).
+# Devuelve la posición de la receta elegida en cada fila, o -1 si ninguna alcanza parcial_minimo
+def _elegir_recetas(np, codificados, puntajes, parcial_minimo):
+    tamanos = np.array(_reglas["tamanos"])
+    distintos = np.array([n for _, n in codificados], dtype=np.int32)
+    exactas = (puntajes == tamanos) & (tamanos == distintos[:, None])
+    prioridad = puntajes + puntajes / tamanos / 2  # La proporción suma menos de 1: nunca le gana a un síntoma más
+    mejor = prioridad.argmax(axis=1)
+    parciales = np.where(puntajes[np.arange(len(mejor)), mejor] >= parcial_minimo, mejor, -1)
+    return np.where(exactas.any(axis=1), exactas.argmax(axis=1), parciales)
+
+# Diagnosticar muchas entradas de una vez. Cada entrada es una lista (o tupla) de síntomas de cualquier largo.
+# Devuelve una enfermedad por entrada: la receta exacta, o "No determinada". Con parcial_minimo, las entradas
+# sin receta exacta reciben la receta con más síntomas en común si coinciden al menos parcial_minimo síntomas
+def diagnosticar_lote(lista_sintomas, parcial_minimo=None):
+    codificados = [_codificar_sintomas(sintomas) for sintomas in lista_sintomas]
+    if parcial_minimo is None:
+        # Solo recetas exactas: basta buscar la máscara, sin calcular puntajes. Un síntoma desconocido
+        # hace que la entrada tenga más síntomas que la receta y por eso no coincide
+        por_mascara = _reglas["por_mascara"]
+        tamanos = {m: t for m, t in zip(_reglas["mascaras"], _reglas["tamanos"])}
+        return [por_mascara[m] if m in por_mascara and tamanos[m] == n else "No determinada" for m, n in codificados]
+    puntajes = puntuar_lote(codificados)
+    np = _numpy()
+    if np is not None and _reglas["mascaras"]:
+        enfermedades = _reglas["enfermedades"] + ["No determinada"]  # La posición -1 es "ninguna receta"
+        return [enfermedades[j] for j in _elegir_recetas(np, codificados, puntajes, parcial_minimo).tolist()]
+    tamanos = _reglas["tamanos"]
+    enfermedades = _reglas["enfermedades"]
+    resultados = []
+    for (mascara, n), fila in zip(codificados, puntajes):
+        fila = list(fila)
+        exacta = next((j for j, c in enumerate(fila) if c == tamanos[j] == n), None)
+        if exacta is not None:
+            resultados.append(enfermedades[exacta])
+            continue
+        mejor = max(range(len(fila)), key=lambda j: (fila[j], fila[j] / tamanos[j], -j), default=None)
+        if mejor is not None and fila[mejor] >= parcial_minimo:
+            resultados.append(enfermedades[mejor])
+        else:
+            resultados.append("No determinada")
+    return resultados
+
+# Volver a diagnosticar las filas "No determinada" de enfermedades.txt (por ejemplo, después de agregar recetas).
+# Se lee y se escribe por bloques en una sola pasada, a un archivo temporal que reemplaza al original al final
+def rediagnosticar_enfermedades(tam_bloque=10000):
+    if _usar_sqlite(ARCH_ENFERMEDADES):
+        registros = leer_registros(ARCH_ENFERMEDADES)
+        pendientes = [reg for reg in registros if len(reg) >= 3 and reg[2] == "No determinada"]
+        nuevos = diagnosticar_lote([reg[1].split(",") for reg in pendientes])
+        cambiados = 0
+        for reg, enfermedad in zip(pendientes, nuevos):
+            if enfermedad != reg[2]:
+                reg[2] = enfermedad
+                cambiados += 1
+        if cambiados:
+            escribir_registros(ARCH_ENFERMEDADES, registros)
+        return cambiados
+
+    with bloqueo_datos(exclusivo=True):  # Un append de otro equipo durante la pasada se perdería al reemplazar
+        cambiados = 0
+        temporal = ARCH_ENFERMEDADES + ".tmp"
+
+        def procesar(bloque, salida):
+            nonlocal cambiados
+            pendientes = [reg for reg in bloque if len(reg) >= 3 and reg[2] == "No determinada"]
+            for reg, enfermedad in zip(pendientes, diagnosticar_lote([reg[1].split(",") for reg in pendientes])):
+                if enfermedad != reg[2]:
+                    reg[2] = enfermedad
+                    cambiados += 1
+            salida.write("".join("|".join(reg) + "\n" for reg in bloque))
+
+        with open(ARCH_ENFERMEDADES, "r", encoding="utf-8") as entrada, open(temporal, "w", encoding="utf-8") as salida:
+            bloque = []
+            for linea in entrada:
+                linea = linea.strip()
+                if linea == "":
+                    continue
+                bloque.append(linea.split("|"))
+                if len(bloque) >= tam_bloque:
+                    procesar(bloque, salida)
+                    bloque = []
+            procesar(bloque, salida)
+            salida.flush()
+            os.fsync(salida.fileno())
+        if cambiados:
+            _soltar_mapa(_indices_historial[ARCH_ENFERMEDADES])
+            os.replace(temporal, ARCH_ENFERMEDADES)
+            _indices_historial[ARCH_ENFERMEDADES]["firma"] = None  # El índice del historial se recarga la próxima vez
+        else:
+            os.remove(temporal)
+        return cambiados
 
 def agregar_enfermedad(documento):
     print("\n--- Agregar Enfermedad (síntomas sin tildes) ---")
@@ -537,6 +2258,12 @@ def agregar_enfermedad(documento):
 
     agregar_registro(ARCH_ENFERMEDADES, [documento, sintomas_str, nombre_enf, fecha_reg])
     print(f">>> Enfermedad registrada: {nombre_enf}")
+    if nombre_enf == "No determinada":
+        posibles = diagnosticar_parcial([s1, s2, s3])
+        if posibles:
+            print(">>> Posibles diagnósticos (coincidencia parcial):")
+            for enfermedad, n, total in posibles:
+                print(f"    - {enfermedad} ({n} de {total} síntomas)")
 
 def agregar_tratamiento(documento):
     print("\n--- Agregar Tratamiento ---")
@@ -555,6 +2282,329 @@ def agregar_alergia(documento):
     print(">>> Alergia registrada.")
 
 
+# ---------------------------
+#  BLOQUE: Reportes y estadísticas
+# ---------------------------
+
+# Franjas de edad (edad del paciente el día del diagnóstico): edad mínima de cada franja y su nombre
+FRANJAS_EDAD = ((0, "0-11"), (12, "12-17"), (18, "18-29"), (30, "30-44"), (45, "45-59"), (60, "60+"))
+_MINIMOS_FRANJA = [minimo for minimo, _ in FRANJAS_EDAD]
+SIN_DATO = "Sin dato"
+
+# Conteos del reporte. Con "mantener" los conteos se quedan en memoria y se actualizan con cada append
+# (como los índices), así pedir el reporte no vuelve a leer los archivos
+_reporte = {
+    "mantener": False,
+    "firmas": None,       # firmas de los 4 archivos con las que se calcularon los conteos
+    "pacientes": {},      # documento normalizado -> código de género * 10**8 + nacimiento AAAAMMDD (0 si no hay fecha)
+    "generos": [],        # género de cada código
+    "conteos": None,
+}
+
+def _clave_paciente(genero, fecha_nac):
+    try:
+        nacimiento = _ordinal_a_aaaammdd(_fecha_a_ordinal(fecha_nac))
+    except ValueError:
+        nacimiento = 0
+    generos = _reporte["generos"]
+    if genero not in generos:
+        generos.append(genero)
+    return generos.index(genero) * 10 ** 8 + nacimiento
+
+def _franja_edad(nacimiento, fecha_registro):
+    if not nacimiento:
+        return SIN_DATO
+    try:
+        registro = _ordinal_a_aaaammdd(_fecha_a_ordinal(fecha_registro[:10]))
+    except ValueError:
+        return SIN_DATO
+    edad = (registro - nacimiento) // 10000
+    if edad < 0:
+        return SIN_DATO
+    return FRANJAS_EDAD[bisect.bisect_right(_MINIMOS_FRANJA, edad) - 1][1]
+
+def _nuevos_conteos():
+    return {
+        "diagnosticos": Counter(),           # enfermedad -> veces
+        "por_franja": Counter(),             # (enfermedad, franja de edad) -> veces
+        "por_genero": Counter(),             # (enfermedad, género) -> veces
+        "alergenos": Counter(),              # alérgeno normalizado -> veces
+        "tratamientos_por_mes": Counter(),   # "AAAA-MM" -> tratamientos registrados
+    }
+
+# Sumar un registro de historial a los conteos; el género y la edad salen del diccionario de pacientes
+def _contar_registro(conteos, ruta, reg, pacientes):
+    if ruta == ARCH_ENFERMEDADES and len(reg) >= 4:
+        clave = pacientes.get(_norm(reg[0]))
+        if clave is None:
+            genero, franja = SIN_DATO, SIN_DATO  # Historial de un documento que ya no está en pacientes.txt
+        else:
+            codigo, nacimiento = divmod(clave, 10 ** 8)
+            genero, franja = _reporte["generos"][codigo], _franja_edad(nacimiento, reg[3])
+        conteos["diagnosticos"][reg[2]] += 1
+        conteos["por_franja"][(reg[2], franja)] += 1
+        conteos["por_genero"][(reg[2], genero)] += 1
+    elif ruta == ARCH_ALERGIAS and len(reg) >= 2:
+        conteos["alergenos"][_norm(reg[1])] += 1
+    elif ruta == ARCH_TRATAMIENTOS and len(reg) >= 4:
+        conteos["tratamientos_por_mes"][reg[3][:7]] += 1
+
+# Recorrer un archivo registro por registro, sin cargarlo completo en memoria
+def _recorrer_registros(ruta):
+    if _usar_sqlite(ruta):
+        yield from leer_registros(ruta)
+        return
+    with open(ruta, "r", encoding="utf-8") as f:
+        for linea in f:
+            linea = linea.strip()
+            if linea:
+                yield linea.split("|")
+
+# Una sola pasada por los 4 archivos: primero pacientes.txt arma el diccionario documento -> (género, nacimiento)
+# y después cada línea de historial se cruza con él por documento
+def _calcular_conteos():
+    pacientes = {}
+    conteos = _nuevos_conteos()
+    with bloqueo_datos():  # Los 4 archivos se leen como estaban en un mismo momento
+        for reg in _recorrer_registros(ARCH_PACIENTES):
+            if len(reg) >= 4:
+                pacientes.setdefault(_norm(reg[3]), _clave_paciente(reg[2], reg[1]))
+        if not _usar_sqlite(ARCH_PACIENTES) and os.path.exists(ARCH_DIARIO_PACIENTES):
+            for entrada in _leer_lineas(ARCH_DIARIO_PACIENTES):  # Las ediciones pueden cambiar género, fecha o documento
+                if len(entrada) == 9 and pacientes.pop(_norm(entrada[0]), None) is not None:
+                    pacientes[_norm(entrada[4])] = _clave_paciente(entrada[3], entrada[2])
+        for ruta in ARCHIVOS_HISTORIAL:
+            for reg in _recorrer_registros(ruta):
+                _contar_registro(conteos, ruta, reg, pacientes)
+    return pacientes, conteos
+
+def _armar_reporte(conteos, top):
+    por_franja = {}
+    for (enfermedad, franja), n in conteos["por_franja"].items():
+        por_franja.setdefault(enfermedad, {})[franja] = n
+    por_genero = {}
+    for (enfermedad, genero), n in conteos["por_genero"].items():
+        por_genero.setdefault(enfermedad, {})[genero] = n
+    return {
+        "diagnosticos": conteos["diagnosticos"].most_common(),
+        "por_franja": por_franja,
+        "por_genero": por_genero,
+        "alergenos": conteos["alergenos"].most_common(top),
+        "tratamientos_por_mes": sorted(conteos["tratamientos_por_mes"].items()),
+    }
+
+# Reporte de la clínica: diagnósticos por enfermedad, por franja de edad y por género, los alérgenos más
+# frecuentes (hasta "top") y los tratamientos por mes. Con mantener=True los conteos quedan en memoria y se
+# actualizan con cada registro agregado, así los siguientes reportes no leen los archivos
+def reporte_clinica(top=10, mantener=False):
+    if mantener:
+        _reporte["mantener"] = True
+    firmas = _firmas_vista()
+    if _reporte["conteos"] is None or _reporte["firmas"] != firmas:
+        pacientes, conteos = _calcular_conteos()
+        if not _reporte["mantener"]:
+            return _armar_reporte(conteos, top)
+        _reporte["pacientes"] = pacientes
+        _reporte["conteos"] = conteos
+        _reporte["firmas"] = firmas
+    return _armar_reporte(_reporte["conteos"], top)
+
+def _reporte_al_dia(ruta, firma_antes):
+    if _reporte["conteos"] is None or ruta not in ARCHIVOS_VISTA:
+        return None
+    k = ARCHIVOS_VISTA.index(ruta)
+    if _reporte["firmas"][k] != firma_antes:
+        _reporte["conteos"] = None  # Algo cambió por fuera: se recalcula en el próximo reporte
+        return None
+    return k
+
+def _anotar_firma_reporte(k, ruta):
+    firmas = list(_reporte["firmas"])
+    firmas[k] = _firma_archivo(ruta)
+    _reporte["firmas"] = tuple(firmas)
+
+# Sumar a los conteos mantenidos los registros recién agregados
+def _reporte_agregados(ruta, registros, firma_antes):
+    k = _reporte_al_dia(ruta, firma_antes)
+    if k is None:
+        return
+    pacientes = _reporte["pacientes"]
+    for campos in registros:
+        if ruta == ARCH_PACIENTES:
+            pacientes.setdefault(_norm(campos[3]), _clave_paciente(campos[2], campos[1]))
+        else:
+            _contar_registro(_reporte["conteos"], ruta, campos, pacientes)
+    _anotar_firma_reporte(k, ruta)
+
+# Una edición que cambia documento, género o fecha de nacimiento cambia cómo se repartieron los diagnósticos
+# ya contados, así que en ese caso se recalcula todo; las demás ediciones no tocan los conteos
+def _reporte_actualizado(doc_original, registro, firma_antes):
+    k = _reporte_al_dia(ARCH_PACIENTES, firma_antes)
+    if k is None:
+        return
+    if _norm(doc_original) != _norm(registro[3]) or \
+            _reporte["pacientes"].get(_norm(doc_original)) != _clave_paciente(registro[2], registro[1]):
+        _reporte["conteos"] = None
+        return
+    _anotar_firma_reporte(k, ARCH_PACIENTES)
+
+def imprimir_reporte(reporte):
+    print("\n=== Diagnósticos por enfermedad ===")
+    for enfermedad, n in reporte["diagnosticos"]:
+        print(f"{enfermedad:<40} {n:>8}")
+    print("\n=== Diagnósticos por franja de edad ===")
+    franjas = [nombre for _, nombre in FRANJAS_EDAD] + [SIN_DATO]
+    print(f"{'Enfermedad':<30}" + "".join(f"{f:>10}" for f in franjas))
+    for enfermedad, _ in reporte["diagnosticos"]:
+        fila = reporte["por_franja"].get(enfermedad, {})
+        print(f"{enfermedad[:29]:<30}" + "".join(f"{fila.get(f, 0):>10}" for f in franjas))
+    print("\n=== Diagnósticos por género ===")
+    for enfermedad, _ in reporte["diagnosticos"]:
+        fila = reporte["por_genero"].get(enfermedad, {})
+        print(f"{enfermedad[:29]:<30} " + ", ".join(f"{g}: {n}" for g, n in sorted(fila.items())))
+    print("\n=== Alérgenos más frecuentes ===")
+    for alergeno, n in reporte["alergenos"]:
+        print(f"{alergeno:<40} {n:>8}")
+    print("\n=== Tratamientos por mes ===")
+    for mes, n in reporte["tratamientos_por_mes"]:
+        print(f"{mes:<10} {n:>8}")
+
+
+# ---------------------------
+#  BLOQUE: Importación masiva de pacientes
+# ---------------------------
+
+COLUMNAS_IMPORTACION = "nombre, fecha_nac, genero, documento, celular, correo"
+TAM_LOTE_IMPORTACION = 50000  # Filas válidas que se acumulan antes de escribirlas en pacientes.txt
+TAM_BLOQUE_VALIDACION = 20000  # Filas que valida cada proceso por tarea en la importación en paralelo
+
+# Valida una fila con los mismos validadores del formulario. Devuelve (True, registro) o (False, mensaje de error).
+# Se aceptan 6 columnas, o las 8 de pacientes.txt (en ese caso la edad se recalcula y se conserva la fecha de registro)
+def _validar_fila_importacion(campos, fecha_reg):
+    if len(campos) not in (6, 8):
+        return False, f"Se esperaban 6 columnas ({COLUMNAS_IMPORTACION}) y llegaron {len(campos)}."
+    if any("|" in c or "\n" in c or "\r" in c for c in campos):  # Un CSV con comillas los permite; partirían la línea
+        return False, "Los campos no pueden tener \"|\" ni saltos de línea."
+    valido, nombre, msg = validar_nombre(campos[0])
+    if not valido:
+        return False, msg
+    valido, fecha_nac, edad = validar_fecha_nac(campos[1].strip())
+    if not valido:
+        return False, edad
+    valido, genero, msg = validar_genero(campos[2])
+    if not valido:
+        return False, msg
+    valido, documento, msg = validar_documento(campos[3])
+    if not valido:
+        return False, msg
+    valido, celular, msg = validar_celular(campos[4], documento)
+    if not valido:
+        return False, msg
+    valido, correo, msg = validar_correo(campos[5])
+    if not valido:
+        return False, msg
+    if len(campos) == 8 and campos[7].strip():
+        fecha_reg = campos[7].strip()
+        try:
+            from datetime import datetime
+            if len(fecha_reg) != 19:
+                raise ValueError(fecha_reg)
+            datetime.strptime(fecha_reg, "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            return False, "La fecha de registro debe estar en formato AAAA-MM-DD HH:MM:SS."
+    return True, [_norm(nombre), fecha_nac, genero, documento, celular, correo, str(edad), fecha_reg]
+
+# Lee el archivo de entrada fila por fila. Separador "|" (formato de pacientes.txt), ";" o "," (CSV)
+def _filas_importacion(entrada):
+    import csv
+    primera = entrada.readline()
+    if "|" in primera:
+        separador = "|"
+    elif primera.count(";") > primera.count(","):
+        separador = ";"
+    else:
+        separador = ","
+    filas = csv.reader(itertools.chain([primera], entrada), delimiter=separador)
+    for numero, campos in enumerate(filas, start=1):
+        if not campos or all(c.strip() == "" for c in campos):
+            continue
+        if numero == 1 and _norm(campos[0]) in ("nombre", "nombres", "nombre completo"):
+            continue  # Fila de encabezado
+        yield numero, campos
+
+# Valida un bloque de filas; es lo que corre cada proceso en la validación en paralelo
+def _validar_bloque(bloque, fecha_reg):
+    return [_validar_fila_importacion(campos, fecha_reg) for _, campos in bloque]
+
+def _bloques(filas, tam_bloque):
+    bloque = []
+    for fila in filas:
+        bloque.append(fila)
+        if len(bloque) >= tam_bloque:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+# Valida las filas y entrega (numero, campos, valido, resultado) en el mismo orden de la entrada.
+# Con procesos > 1 los bloques se reparten entre varios procesos; como máximo hay 2 bloques por proceso
+# en espera, así la memoria no crece con el tamaño del archivo
+def _validar_filas(filas, fecha_reg, procesos=1, tam_bloque=TAM_BLOQUE_VALIDACION):
+    if procesos <= 1:
+        for numero, campos in filas:
+            yield (numero, campos) + _validar_fila_importacion(campos, fecha_reg)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    from collections import deque
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        pendientes = deque()
+        for bloque in _bloques(filas, tam_bloque):
+            pendientes.append((bloque, pool.submit(_validar_bloque, bloque, fecha_reg)))
+            while len(pendientes) >= procesos * 2:
+                yield from _resultados_bloque(*pendientes.popleft())
+        while pendientes:
+            yield from _resultados_bloque(*pendientes.popleft())
+
+def _resultados_bloque(bloque, futuro):
+    for (numero, campos), (valido, resultado) in zip(bloque, futuro.result()):
+        yield numero, campos, valido, resultado
+
+# Importar un listado de pacientes (por ejemplo, el de otra clínica).
+# Las filas válidas y sin documento repetido se agregan a pacientes.txt; las demás se escriben en el
+# archivo de rechazos como "número de línea|error|fila original". Devuelve (importados, rechazados).
+# Con procesos > 1 la validación se reparte entre varios procesos; la revisión de documentos
+# repetidos siempre se hace al final, en orden y en un solo proceso
+def importar_pacientes(ruta_entrada, ruta_rechazos=None, procesos=1):
+    ruta_rechazos = ruta_rechazos or ruta_entrada + ".rechazos.txt"
+    # El bloqueo exclusivo dura toda la importación: así ningún otro equipo registra un documento
+    # entre la revisión de repetidos y el append del lote
+    with bloqueo_datos(exclusivo=True):
+        vistos = documentos_pacientes()  # Documentos ya registrados más los que se van importando
+        fecha_reg = hoy()
+        importados = 0
+        rechazados = 0
+        lote = []
+        with open(ruta_entrada, "r", encoding="utf-8", newline="") as entrada, \
+                open(ruta_rechazos, "w", encoding="utf-8") as rechazos:
+            for numero, campos, valido, resultado in _validar_filas(_filas_importacion(entrada), fecha_reg, procesos):
+                if valido and resultado[3] in vistos:
+                    valido, resultado = False, "Ya existe un paciente con ese documento."
+                if not valido:
+                    original = "|".join(campos).replace("\r", "\\r").replace("\n", "\\n")  # Una línea por rechazo
+                    rechazos.write(f"{numero}|{resultado}|{original}\n")
+                    rechazados += 1
+                    continue
+                vistos.add(resultado[3])
+                lote.append(resultado)
+                if len(lote) >= TAM_LOTE_IMPORTACION:
+                    agregar_registros(ARCH_PACIENTES, lote)
+                    importados += len(lote)
+                    lote = []
+        agregar_registros(ARCH_PACIENTES, lote)
+        importados += len(lote)
+        return importados, rechazados
+
+
 # ---------------------------
 #  BLOQUE: Menú principal
 # ---------------------------
@@ -584,10 +2634,558 @@ def menu_principal():
         else:
             print(">>> Opción inválida. Intente de nuevo.")
 
+
+# ---------------------------
+#  BLOQUE: Comandos de consola (python entrega_final.py <comando>)
+# ---------------------------
+def ejecutar_comando(argumentos):
+    import argparse
+    parser = argparse.ArgumentParser(prog="entrega_final.py", description="Tareas de mantenimiento del sistema médico.")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    sub.add_parser("compactar", help="Pasa las ediciones de pacientes.log a pacientes.txt")
+    p_migrar = sub.add_parser("migrar-sqlite", help="Importa los archivos TXT a una base SQLite")
+    p_migrar.add_argument("--db", default=ARCH_SQLITE, help="Archivo .db de destino (por defecto %(default)s)")
+    sub.add_parser("rediagnosticar", help="Vuelve a diagnosticar las enfermedades 'No determinada' con las recetas actuales")
+    p_importar = sub.add_parser("importar", help="Importa pacientes desde un archivo CSV o separado por '|'")
+    p_importar.add_argument("archivo", help=f"Columnas: {COLUMNAS_IMPORTACION}")
+    p_importar.add_argument("--rechazos", help="Archivo donde se escriben las filas rechazadas (por defecto <archivo>.rechazos.txt)")
+    p_importar.add_argument("--procesos", type=int, default=1, help="Procesos para validar en paralelo (0 = todos los núcleos)")
+    p_reporte = sub.add_parser("reporte", help="Diagnósticos por enfermedad, edad y género; alérgenos; tratamientos por mes")
+    p_reporte.add_argument("--top", type=int, default=10, help="Cantidad de alérgenos a mostrar (por defecto %(default)s)")
+    p_servidor = sub.add_parser("servidor", help="Atiende consultas HTTP/JSON de otros sistemas (agenda, laboratorio)")
+    p_servidor.add_argument("--host", default="127.0.0.1", help="Dirección donde escuchar (por defecto %(default)s, solo este equipo)")
+    p_servidor.add_argument("--puerto", type=int, default=PUERTO_SERVIDOR, help="Puerto (por defecto %(default)s; 0 = uno libre)")
+    p_servidor.add_argument("--registro", action="store_true", help="Mostrar cada petición en la consola")
+    args = parser.parse_args(argumentos)
+
+    if args.comando == "compactar":
+        if compactar_pacientes():
+            print(">>> Diario compactado en pacientes.txt.")
+        else:
+            print(">>> No hay ediciones pendientes en el diario.")
+    elif args.comando == "migrar-sqlite":
+        totales = migrar_a_sqlite(args.db)
+        for tabla, n in totales.items():
+            print(f">>> {tabla}: {n} registros importados.")
+        print(f">>> Listo. Use CLINICA_BACKEND=sqlite CLINICA_DB={args.db} para trabajar sobre la base.")
+    elif args.comando == "rediagnosticar":
+        print(f">>> {rediagnosticar_enfermedades()} enfermedades con nuevo diagnóstico.")
+    elif args.comando == "importar":
+        import time
+        inicio = time.perf_counter()
+        importados, rechazados = importar_pacientes(args.archivo, args.rechazos, args.procesos or os.cpu_count() or 1)
+        print(f">>> {importados} pacientes importados, {rechazados} filas rechazadas en {time.perf_counter() - inicio:.1f} s.")
+        if rechazados:
+            print(f">>> Detalle de los rechazos en {args.rechazos or args.archivo + '.rechazos.txt'}")
+    elif args.comando == "reporte":
+        imprimir_reporte(reporte_clinica(args.top))
+    elif args.comando == "servidor":
+        servir(args.host, args.puerto, args.registro)
+    return 0
+
+
+# ---------------------------
+#  BLOQUE: Servidor HTTP/JSON (para la agenda, el laboratorio y otros sistemas)
+# ---------------------------
+#   GET  /pacientes/<documento>                 datos del paciente
+#   GET  /pacientes/<documento>/historial       datos + enfermedades, tratamientos y alergias
+#   GET  /pacientes/<documento>/<tipo>          solo un tipo de historial (enfermedades, tratamientos, alergias)
+#   GET  /pacientes?documento=&nombre=&apellido=&limite=   búsqueda, igual que la ventana Consultar
+#   POST /pacientes                             {"nombre", "fecha_nac", "genero", "documento", "celular", "correo"}
+#   POST /pacientes/<documento>/enfermedades    {"sintomas": [s1, s2, s3]}  (se diagnostica con las recetas)
+#   POST /pacientes/<documento>/tratamientos    {"medicamentos": "...", "dosis": "..."}
+#   POST /pacientes/<documento>/alergias        {"alergeno": "...", "sintomas": "..."}
+#   GET  /reporte?top=                          reporte de la clínica (ver reporte_clinica); los conteos se
+#                                               mantienen en memoria mientras el servidor está arriba
+
+PUERTO_SERVIDOR = 8765
+LIMITE_CUERPO_BYTES = 64 * 1024  # Tamaño máximo del JSON de un POST
+LIMITE_BUSQUEDA_API = 500        # Máximo de pacientes que devuelve una búsqueda
+RUTAS_HISTORIAL = {"enfermedades": ARCH_ENFERMEDADES, "tratamientos": ARCH_TRATAMIENTOS, "alergias": ARCH_ALERGIAS}
+
+# Registro -> diccionario con los nombres de columna de las tablas SQLite. La edad se calcula al responder
+def _como_json(ruta, reg):
+    datos = dict(zip(TABLAS_SQLITE[ruta][1], reg))
+    if ruta == ARCH_PACIENTES:
+        edad = edad_paciente(reg)
+        datos["edad"] = int(edad) if edad.isdigit() else None
+    return datos
+
+# Texto de un campo enviado por POST; None si no es texto o si rompería el formato de los TXT
+def _campo_texto(cuerpo, nombre):
+    valor = cuerpo.get(nombre)
+    if not isinstance(valor, str) or "|" in valor or "\n" in valor or "\r" in valor:
+        return None
+    return valor.strip()
+
+def _api_buscar(consulta):
+    clave_doc, clave_nom, clave_ape = (consulta.get(k, [""])[0] for k in ("documento", "nombre", "apellido"))
+    try:
+        limite = min(max(int(consulta.get("limite", [LIMITE_SUGERENCIAS])[0]), 1), LIMITE_BUSQUEDA_API)
+    except ValueError:
+        return 400, {"error": "El límite debe ser un número."}
+    indice_pacientes()  # sugerencias_consulta lee el índice directamente: primero se pone al día
+    registros, hay_mas, _ = sugerencias_consulta(clave_doc, clave_nom, clave_ape, limite=limite)
+    aproximados = False
+    if not registros and (clave_nom.strip() or clave_ape.strip()):
+        registros = [reg for reg, _ in buscar_difuso(f"{clave_nom} {clave_ape}", k=limite)]
+        aproximados = True
+    return 200, {"pacientes": [_como_json(ARCH_PACIENTES, reg) for reg in registros],
+                 "hay_mas": hay_mas, "aproximados": aproximados}
+
+def _api_registrar(cuerpo):
+    campos = [cuerpo.get(k) for k in TABLAS_SQLITE[ARCH_PACIENTES][1][:6]]
+    if not all(isinstance(c, str) for c in campos):
+        return 400, {"error": f"Faltan campos; se esperaban: {COLUMNAS_IMPORTACION}."}
+    valido, resultado = _validar_fila_importacion(campos, hoy())  # Mismas validaciones que la importación masiva
+    if not valido:
+        return 400, {"error": resultado}
+    if not registrar_paciente(resultado):
+        return 409, {"error": "Ya existe un paciente con ese documento."}
+    return 201, {"paciente": _como_json(ARCH_PACIENTES, resultado)}
+
+# El servidor vive mucho tiempo: los conteos del reporte se calculan una vez y se actualizan con cada append,
+# así pedir el reporte no vuelve a leer los archivos (salvo que otro equipo haya escrito en la carpeta)
+def _api_reporte(consulta):
+    try:
+        top = min(max(int(consulta.get("top", ["10"])[0]), 1), LIMITE_BUSQUEDA_API)
+    except ValueError:
+        return 400, {"error": "\"top\" debe ser un número."}
+    with bloqueo_datos():
+        return 200, {"reporte": reporte_clinica(top, mantener=True)}
+
+# Mismo registro que arman agregar_enfermedad, agregar_tratamiento y agregar_alergia en la consola
+def _api_agregar_historial(documento, tipo, cuerpo):
+    respuesta = {}
+    if tipo == "enfermedades":
+        sintomas = cuerpo.get("sintomas")
+        if not isinstance(sintomas, list) or len(sintomas) != 3 or not all(isinstance(x, str) for x in sintomas):
+            return 400, {"error": "Se esperaba \"sintomas\" con una lista de 3 síntomas."}
+        s1, s2, s3 = (_norm(x) for x in sintomas)
+        if any(sep in x for x in (s1, s2, s3) for sep in ("|", ",")):
+            return 400, {"error": "Los síntomas no pueden tener '|' ni ','."}
+        nombre_enf = diagnosticar(s1, s2, s3)
+        registro = [documento, f"{s1},{s2},{s3}", nombre_enf, hoy()]
+        if nombre_enf == "No determinada":
+            respuesta["posibles"] = [{"enfermedad": enfermedad, "coinciden": n, "sintomas_receta": total}
+                                     for enfermedad, n, total in diagnosticar_parcial([s1, s2, s3])]
+    else:
+        claves = ("medicamentos", "dosis") if tipo == "tratamientos" else ("alergeno", "sintomas")
+        valores = [_campo_texto(cuerpo, k) for k in claves]
+        if None in valores:
+            return 400, {"error": f"Se esperaban los textos {', '.join(claves)} (sin '|' ni saltos de línea)."}
+        if tipo == "alergias":
+            valores[1] = valores[1].lower()
+        registro = [documento] + valores + [hoy()]
+    agregar_registro(RUTAS_HISTORIAL[tipo], registro)
+    respuesta["registro"] = _como_json(RUTAS_HISTORIAL[tipo], registro)
+    return 201, respuesta
+
+# Atiende una petición ya leída. Devuelve (código HTTP, diccionario de respuesta)
+def atender_api(metodo, ruta, consulta, cuerpo):
+    from urllib.parse import unquote
+    partes = [unquote(p) for p in ruta.strip("/").split("/") if p]
+    if partes == ["reporte"] and metodo == "GET":
+        return _api_reporte(consulta)
+    if not partes or partes[0] != "pacientes" or len(partes) > 3:
+        return 404, {"error": "Ruta no encontrada."}
+    if metodo == "POST" and len(partes) == 1:
+        return _api_registrar(cuerpo)
+    if metodo == "POST" and (len(partes) != 3 or partes[2] not in RUTAS_HISTORIAL):
+        return 404, {"error": "Ruta no encontrada."}
+    # Las lecturas van con bloqueo compartido; las escrituras con exclusivo, para que el paciente no
+    # cambie de documento entre la revisión y el append
+    with bloqueo_datos(exclusivo=metodo == "POST"):
+        if len(partes) == 1:
+            return _api_buscar(consulta)
+        reg = indice_pacientes().get(_norm(partes[1]))  # Índice en memoria; se recarga solo si otro equipo escribió
+        if reg is None:
+            return 404, {"error": "No existe un paciente con ese documento."}
+        if metodo == "POST":
+            return _api_agregar_historial(reg[3], partes[2], cuerpo)
+        if len(partes) == 2:
+            return 200, {"paciente": _como_json(ARCH_PACIENTES, reg)}
+        if partes[2] == "historial":
+            vista = vista_paciente(reg[3])
+            return 200, {"paciente": _como_json(ARCH_PACIENTES, vista["paciente"]),
+                         **{tipo: [_como_json(ruta_h, r) for r in vista[tipo]] for tipo, ruta_h in RUTAS_HISTORIAL.items()}}
+        if partes[2] in RUTAS_HISTORIAL:
+            return 200, {partes[2]: [_como_json(RUTAS_HISTORIAL[partes[2]], r)
+                                     for r in historial_de(RUTAS_HISTORIAL[partes[2]], reg[3])]}
+    return 404, {"error": "Ruta no encontrada."}
+
+# La clase del manejador se arma aquí para importar http.server solo cuando se usa el servidor
+def _clase_manejador(registrar):
+    import json
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import parse_qs, urlsplit
+
+    class ManejadorAPI(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Conexiones persistentes: un cliente hace muchas consultas por la misma conexión
+        disable_nagle_algorithm = True  # Encabezados y cuerpo salen en dos envíos; sin esto el segundo espera ~40 ms
+
+        def do_GET(self):
+            self._atender("GET", None)
+
+        def do_POST(self):
+            try:
+                largo = int(self.headers.get("Content-Length") or 0)
+            except ValueError:
+                largo = -1
+            if largo < 0:
+                self.close_connection = True  # Sin un largo válido no se sabe dónde termina el cuerpo
+                self._responder(400, {"error": "Content-Length debe ser un número entero no negativo."})
+                return
+            if largo > LIMITE_CUERPO_BYTES:
+                self.close_connection = True  # No se lee el cuerpo, así que la conexión no se puede reutilizar
+                self._responder(413, {"error": "Cuerpo demasiado grande."})
+                return
+            try:
+                cuerpo = json.loads(self.rfile.read(largo) or b"{}")
+            except ValueError:
+                self._responder(400, {"error": "El cuerpo no es JSON válido."})
+                return
+            if not isinstance(cuerpo, dict):
+                self._responder(400, {"error": "Se esperaba un objeto JSON."})
+                return
+            self._atender("POST", cuerpo)
+
+        def _atender(self, metodo, cuerpo):
+            url = urlsplit(self.path)
+            try:
+                estado, datos = atender_api(metodo, url.path, parse_qs(url.query), cuerpo)
+            except Exception as error:
+                estado, datos = 500, {"error": f"Error interno: {error}"}
+            self._responder(estado, datos)
+
+        def _responder(self, estado, datos):
+            salida = json.dumps(datos, ensure_ascii=False).encode("utf-8")
+            self.send_response(estado)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(salida)))
+            self.end_headers()
+            self.wfile.write(salida)
+
+        def log_message(self, formato, *args):
+            if registrar:  # Por defecto no se escribe nada por petición: con miles por segundo la consola frena al servidor
+                super().log_message(formato, *args)
+
+    return ManejadorAPI
+
+# Un hilo por conexión; el trabajo sobre los datos se turna con bloqueo_datos. Los índices se cargan antes de
+# abrir el puerto, así la primera consulta ya encuentra todo en memoria
+def servir(host="127.0.0.1", puerto=PUERTO_SERVIDOR, registrar=False):
+    from http.server import ThreadingHTTPServer
+    with bloqueo_datos():
+        indice_pacientes()
+        for ruta in ARCHIVOS_HISTORIAL:
+            _indice_historial(ruta)
+        reporte_clinica(mantener=True)
+    servidor = ThreadingHTTPServer((host, puerto), _clase_manejador(registrar))
+    servidor.daemon_threads = True
+    print(f">>> Servidor escuchando en http://{host}:{servidor.server_address[1]} (Ctrl+C para terminar)", flush=True)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+# ---------------------------
+#  BLOQUE: Arranque de la interfaz gráfica (tkinter y PIL solo cuando se abre la ventana)
+# ---------------------------
+
+ARCH_LOGO = "logo.png"
+ARCH_LOGO_REDUCIDO = "logo_160.png"  # logo.png ya reducido; se vuelve a generar si logo.png es más nuevo
+TAM_LOGO = 160
+
+# Importa tkinter y deja tk, ttk y messagebox como globales del módulo. Devuelve False si no hay interfaz
+def cargar_interfaz():
+    global tk, ttk, messagebox
+    try:
+        import tkinter as tk
+        import tkinter.ttk as ttk
+        import tkinter.messagebox as messagebox
+    except Exception:
+        tk = None
+    return tk is not None
+
+# Logo de la ventana principal. La reducción con PIL (LANCZOS) se hace una sola vez y se guarda en disco;
+# en los arranques siguientes Tk abre el PNG reducido directamente y PIL ni se importa
+def cargar_logo():
+    try:
+        if os.path.getmtime(ARCH_LOGO_REDUCIDO) >= os.path.getmtime(ARCH_LOGO):
+            return tk.PhotoImage(file=ARCH_LOGO_REDUCIDO)
+    except (OSError, tk.TclError):
+        pass  # Todavía no está reducido, está desactualizado o este Tk no lee PNG
+    try:
+        from PIL import Image, ImageTk
+    except Exception:
+        return tk.PhotoImage(file=ARCH_LOGO)  # Sin PIL se muestra tal cual, como antes
+    img = Image.open(ARCH_LOGO).resize((TAM_LOGO, TAM_LOGO), Image.LANCZOS)
+    try:
+        img.save(ARCH_LOGO_REDUCIDO)
+    except OSError:
+        pass  # Carpeta de solo lectura: se reducirá de nuevo la próxima vez
+    return ImageTk.PhotoImage(img)
+
+
+# ---------------------------
+#  BLOQUE: Trabajo en segundo plano (interfaz gráfica)
+# ---------------------------
+
+INTERVALO_REVISION_MS = 15  # Cada cuánto revisa la ventana si el hilo de almacenamiento ya terminó
+
+# Las lecturas y escrituras de archivos de la interfaz se hacen en un hilo aparte, así la ventana no se
+# congela con archivos grandes. Es un solo hilo: las operaciones se hacen en orden y nunca dos a la vez
+# sobre los índices en memoria. El resultado vuelve al hilo de Tk con root.after (Tk no es seguro entre hilos)
+_trabajador = {
+    "ejecutor": None,
+    "root": None,
+    "pendientes": 0,
+    "al_cambiar": None,  # función(pendientes) para mostrar u ocultar el indicador de "trabajando"
+}
+
+def iniciar_trabajador(root, al_cambiar=None):
+    from concurrent.futures import ThreadPoolExecutor
+    if _trabajador["ejecutor"] is None:
+        _trabajador["ejecutor"] = ThreadPoolExecutor(max_workers=1, thread_name_prefix="almacenamiento")
+    _trabajador["root"] = root
+    _trabajador["al_cambiar"] = al_cambiar
+
+def _cambiar_pendientes(delta):
+    _trabajador["pendientes"] += delta
+    if _trabajador["al_cambiar"] is not None:
+        _trabajador["al_cambiar"](_trabajador["pendientes"])
+
+# Ejecuta funcion(*args) en el hilo de almacenamiento y después llama a al_terminar(resultado) en el hilo de Tk.
+# Si "ventana" ya se cerró cuando llega el resultado, no se llama a nadie. Si la función falla se muestra el
+# error (o se llama a al_fallar(error)). Devuelve el futuro, que se puede cancelar si aún no empezó
+def en_segundo_plano(funcion, *args, al_terminar=None, al_fallar=None, ventana=None):
+    nombre = getattr(funcion, "__name__", "funcion")
+    funcion = instrumentado(f"segundo_plano.{nombre}")(funcion)
+    enviado = time.perf_counter()
+    futuro = _trabajador["ejecutor"].submit(funcion, *args)
+    _cambiar_pendientes(1)
+
+    def revisar():
+        if not futuro.done():
+            _trabajador["root"].after(INTERVALO_REVISION_MS, revisar)
+            return
+        _cambiar_pendientes(-1)
+        if _instrumentacion["activa"]:
+            # Lo que espera el usuario: cola del hilo + trabajo + la revisión periódica de la ventana
+            _anotar_llamada(f"espera_ventana.{nombre}", time.perf_counter() - enviado)
+        if futuro.cancelled() or (ventana is not None and not ventana.winfo_exists()):
+            return
+        error = futuro.exception()
+        if error is not None:
+            if al_fallar is not None:
+                al_fallar(error)
+            else:
+                messagebox.showerror("Error", f"No se pudo completar la operación: {error}")
+        elif al_terminar is not None:
+            al_terminar(futuro.result())
+
+    _trabajador["root"].after(INTERVALO_REVISION_MS, revisar)
+    return futuro
+
+# Búsqueda de la ventana Consultar: unión de documento exacto, nombre y apellido, en el orden del archivo;
+# si no hay coincidencias por nombre se usan los nombres más parecidos
+def buscar_para_consulta(clave_doc, clave_nom, clave_ape):
+    docs = set()
+    clave_doc_n = _norm(clave_doc)
+    if clave_doc and clave_doc_n in indice_pacientes():
+        docs.add(clave_doc_n)
+    for clave in (clave_nom, clave_ape):
+        if clave and clave.strip() != "":
+            docs.update(_norm(p[3]) for p in buscar_nombre_contiene(clave))
+    resultados = _registros_en_orden(docs)
+    if not resultados and (clave_nom or clave_ape):
+        resultados = [p for p, _ in buscar_difuso(f"{clave_nom} {clave_ape}")]
+    return resultados
+
+
+# ---------------------------
+#  BLOQUE: Instrumentación (opcional, para cuando "el programa está lento")
+# ---------------------------
+# Se activa con variables de entorno; si no están, no se envuelve ninguna función y no cuesta nada:
+#   CLINICA_INSTRUMENTAR=1            al salir muestra llamadas, tiempo, filas y bytes leídos/escritos por función
+#   CLINICA_INSTRUMENTAR=medidas.json al salir guarda lo mismo en ese archivo (para comparar entre equipos)
+#   CLINICA_PERFIL=cprofile           perfil completo de cProfile (hilo principal) en clinica.prof
+#   CLINICA_PERFIL=tracemalloc        al salir muestra las líneas que más memoria reservaron
+# Con el programa andando, el resumen se pide con F12 en la ventana o con "kill -USR1 <pid>" en Linux/macOS.
+# Los tiempos son inclusivos: leer_registros cuenta también dentro de _cargar_indice_pacientes
+
+_instrumentacion = {
+    "activa": os.environ.get("CLINICA_INSTRUMENTAR", "").strip() not in ("", "0"),
+    "destino": os.environ.get("CLINICA_INSTRUMENTAR", "").strip(),
+    "perfil": os.environ.get("CLINICA_PERFIL", "").strip().lower(),
+    "perfilador": None,
+    "inicio": time.perf_counter(),
+    "funciones": {},  # nombre -> {"llamadas", "segundos", "maximo", "filas", "leidos", "escritos", "errores"}
+    "candado": threading.Lock(),  # El hilo de almacenamiento y los hilos del servidor anotan a la vez
+}
+
+def _tamano(ruta):
+    try:
+        return os.path.getsize(ruta)
+    except OSError:
+        return 0
+
+def _bytes_lineas(registros):
+    return sum(len("|".join(campos).encode("utf-8")) + 1 for campos in registros)
+
+# Función -> medida(argumentos, resultado) que devuelve (filas, bytes leídos, bytes escritos).
+# buscar_paciente_por_doc_o_nombre no está porque su tiempo incluiría lo que el usuario tarda en escribir
+MEDIDAS_INSTRUMENTACION = {
+    "leer_registros": lambda a, r: (len(r), 0 if _usar_sqlite(a[0]) else _tamano(a[0]) + _tamano(DIARIOS.get(a[0], "")), 0),
+    "escribir_registros": lambda a, r: (len(a[1]), 0, 0 if _usar_sqlite(a[0]) else _tamano(a[0])),
+    "agregar_registro": lambda a, r: (1, 0, _bytes_lineas([a[1]])),
+    "agregar_registros": lambda a, r: (len(a[1]), 0, _bytes_lineas(a[1])),
+    "actualizar_paciente": lambda a, r: (1, 0, _bytes_lineas([[a[0]] + list(a[1])])),
+    "compactar_pacientes": None,
+    "_cargar_indice_pacientes": lambda a, r: (len(_indice_pacientes["por_doc"]), 0, 0),
+    "cargar_tabla_pacientes": lambda a, r: (len(r), _tamano(ARCH_PACIENTES) + _tamano(ARCH_DIARIO_PACIENTES), 0),
+    "_indexar_posiciones": lambda a, r: (0, _tamano(a[1]) - (a[2] if len(a) > 2 else 0), 0),
+    "_reconstruir_posiciones": lambda a, r: (len(r), _tamano(ARCH_PACIENTES), _tamano(ARCH_INDICE_PACIENTES)),
+    "leer_paciente": lambda a, r: (int(r is not None), 0, 0),
+    "existe_documento": lambda a, r: (int(r), 0, 0),
+    "historial_de": lambda a, r: (len(r), 0, 0),
+    "vista_paciente": None,
+    "buscar_por_nombre": lambda a, r: (len(r), 0, 0),
+    "buscar_nombre_contiene": lambda a, r: (len(r), 0, 0),
+    "buscar_difuso": lambda a, r: (len(r), 0, 0),
+    "sugerencias_nombre": lambda a, r: (len(r["registros"]), 0, 0),
+    "sugerencias_consulta": lambda a, r: (len(r[0]), 0, 0),
+    "buscar_para_consulta": lambda a, r: (len(r), 0, 0),
+    "pagina_pacientes": lambda a, r: (len(r), 0, 0),
+    "diagnosticar_lote": lambda a, r: (len(r), 0, 0),
+    "rediagnosticar_enfermedades": lambda a, r: (r, _tamano(ARCH_ENFERMEDADES), _tamano(ARCH_ENFERMEDADES)),
+    "importar_pacientes": lambda a, r: (r[0] + r[1], _tamano(a[0]), 0),
+    "reporte_clinica": None,
+    "atender_api": None,
+}
+
+def _anotar_llamada(nombre, segundos, medida=None, args=(), resultado=None, error=False):
+    filas = leidos = escritos = 0
+    if medida is not None and not error:
+        try:
+            filas, leidos, escritos = medida(args, resultado)
+        except Exception:
+            pass  # La medida nunca debe tumbar la operación que se está midiendo
+    with _instrumentacion["candado"]:
+        f = _instrumentacion["funciones"].get(nombre)
+        if f is None:
+            f = _instrumentacion["funciones"][nombre] = {"llamadas": 0, "segundos": 0.0, "maximo": 0.0,
+                                                         "filas": 0, "leidos": 0, "escritos": 0, "errores": 0}
+        f["llamadas"] += 1
+        f["segundos"] += segundos
+        f["maximo"] = max(f["maximo"], segundos)
+        f["filas"] += filas or 0
+        f["leidos"] += leidos
+        f["escritos"] += escritos
+        f["errores"] += error
+
+# Decorador: si la instrumentación está apagada devuelve la misma función, sin envoltorio
+def instrumentado(nombre=None, medida=None):
+    def decorar(funcion):
+        if not _instrumentacion["activa"]:
+            return funcion
+        clave = nombre or funcion.__name__
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                resultado = funcion(*args, **kwargs)
+            except BaseException:
+                _anotar_llamada(clave, time.perf_counter() - inicio, error=True)
+                raise
+            _anotar_llamada(clave, time.perf_counter() - inicio, medida, args, resultado)
+            return resultado
+        return envoltura
+    return decorar
+
+# Reemplaza en el módulo las funciones de MEDIDAS_INSTRUMENTACION por su versión medida. Las llamadas
+# internas buscan el nombre en el módulo cada vez, así que todas pasan por la envoltura
+def _instrumentar_modulo():
+    modulo = globals()
+    for nombre, medida in MEDIDAS_INSTRUMENTACION.items():
+        modulo[nombre] = instrumentado(nombre, medida)(modulo[nombre])
+
+def resumen_instrumentacion():
+    with _instrumentacion["candado"]:
+        funciones = {nombre: dict(f) for nombre, f in _instrumentacion["funciones"].items()}
+    return {"segundos": time.perf_counter() - _instrumentacion["inicio"], "funciones": funciones}
+
+def imprimir_instrumentacion(salida=None):
+    salida = salida or sys.stderr
+    resumen = resumen_instrumentacion()
+    print(f"\n=== Instrumentación ({resumen['segundos']:.1f} s desde el arranque) ===", file=salida)
+    if _instrumentacion["activa"]:
+        print(f"{'Función':<36} {'Llamadas':>9} {'Total (s)':>10} {'Prom. (ms)':>11} {'Máx. (ms)':>10} "
+              f"{'Filas':>10} {'Leídos (MB)':>12} {'Escritos (MB)':>14} {'Errores':>8}", file=salida)
+        for nombre, f in sorted(resumen["funciones"].items(), key=lambda par: -par[1]["segundos"]):
+            print(f"{nombre:<36} {f['llamadas']:>9} {f['segundos']:>10.3f} {f['segundos'] / f['llamadas'] * 1000:>11.3f} "
+                  f"{f['maximo'] * 1000:>10.3f} {f['filas']:>10} {f['leidos'] / 2**20:>12.2f} {f['escritos'] / 2**20:>14.2f} "
+                  f"{f['errores']:>8}", file=salida)
+    if _instrumentacion["perfil"] == "tracemalloc":
+        import tracemalloc
+        if tracemalloc.is_tracing():
+            actual, pico = tracemalloc.get_traced_memory()
+            print(f"\nMemoria en uso {actual / 2**20:.1f} MB, pico {pico / 2**20:.1f} MB. Líneas que más reservaron:", file=salida)
+            for estadistica in tracemalloc.take_snapshot().statistics("lineno")[:15]:
+                print(f"  {estadistica}", file=salida)
+    salida.flush()
+
+def _al_salir():
+    perfilador = _instrumentacion["perfilador"]
+    if perfilador is not None:
+        import pstats
+        perfilador.disable()
+        perfilador.dump_stats("clinica.prof")
+        print("\n>>> Perfil guardado en clinica.prof. Funciones con más tiempo acumulado:", file=sys.stderr)
+        pstats.Stats(perfilador, stream=sys.stderr).sort_stats("cumulative").print_stats(25)
+    if _instrumentacion["activa"] and _instrumentacion["destino"].lower().endswith(".json"):
+        import json
+        with open(_instrumentacion["destino"], "w", encoding="utf-8") as f:
+            json.dump(resumen_instrumentacion(), f, indent=2, ensure_ascii=False)
+    elif _instrumentacion["activa"] or _instrumentacion["perfil"] == "tracemalloc":
+        imprimir_instrumentacion()
+
+def _iniciar_instrumentacion():
+    if not _instrumentacion["activa"] and not _instrumentacion["perfil"]:
+        return
+    multiproceso = sys.modules.get("multiprocessing")
+    if multiproceso is not None and multiproceso.parent_process() is not None:
+        return  # Procesos auxiliares (importación en paralelo, pruebas): solo se mide el proceso principal
+    import atexit
+    if _instrumentacion["activa"]:
+        _instrumentar_modulo()
+    if _instrumentacion["perfil"] == "cprofile":
+        import cProfile
+        _instrumentacion["perfilador"] = cProfile.Profile()
+        _instrumentacion["perfilador"].enable()
+    elif _instrumentacion["perfil"] == "tracemalloc":
+        import tracemalloc
+        tracemalloc.start(10)
+    atexit.register(_al_salir)
+    import signal
+    if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, lambda *_: imprimir_instrumentacion())
+
+_iniciar_instrumentacion()
+
+
 # Punto de entrada: preferir interfaz gráfica si está disponible
 if __name__ == "__main__":
+    asegurar_archivos()
+    # Con argumentos se ejecuta un comando de consola en lugar del menú o la interfaz
+    if len(sys.argv) > 1:
+        sys.exit(ejecutar_comando(sys.argv[1:]))
     # Si tkinter no está disponible, usar menú de consola
-    if tk is None:
+    if not cargar_interfaz():
         menu_principal()
     else:
         try:
@@ -596,9 +3194,25 @@ if __name__ == "__main__":
             root.iconbitmap(default='icono.ico')
             root.geometry("500x400")
             root.resizable(False, False)
-            
+
+            # Indicador de "trabajando" mientras el hilo de almacenamiento tiene operaciones pendientes
+            lbl_ocupado = tk.Label(root, text="", fg="#2A6F9E")
+            lbl_ocupado.pack(side="bottom", anchor="e", padx=10)
+
+            def mostrar_ocupado(pendientes):
+                ventanas = [root]
+                for ventana in ventanas:
+                    ventanas.extend(w for w in ventana.winfo_children() if isinstance(w, tk.Toplevel))
+                for ventana in ventanas:
+                    ventana.config(cursor="watch" if pendientes else "")
+                lbl_ocupado.config(text="Trabajando..." if pendientes else "")
+
+            iniciar_trabajador(root, mostrar_ocupado)
+            if _instrumentacion["activa"]:
+                root.bind_all("<F12>", lambda event: imprimir_instrumentacion())  # Resumen de tiempos sin cerrar el programa
 
             # Funciones de los botones
+            @instrumentado("gui.on_agregar")
             def on_agregar():
                 # Evitar abrir más de una ventana de agregar paciente
                 if getattr(root, "_agregar_open", False):
@@ -657,6 +3271,7 @@ if __name__ == "__main__":
                 ent_correo = tk.Entry(frm, width=40)
                 ent_correo.grid(row=6, column=1, pady=6)
 
+                @instrumentado("gui.guardar_paciente")
                 def guardar_paciente():
                     # Reunir valores
                     nombres = ent_nombres.get().strip()
@@ -698,9 +3313,6 @@ if __name__ == "__main__":
                     if not valido:
                         messagebox.showerror("Error", msg)
                         return
-                    if existe_documento(documento_final):
-                        messagebox.showerror("Error", "Ya existe un paciente con ese documento.")
-                        return
 
                     valido, celular_final, msg = validar_celular(celular_raw, documento_final)
                     if not valido:
@@ -713,15 +3325,30 @@ if __name__ == "__main__":
                         return
 
                     fecha_reg = hoy()
-                    agregar_registro(ARCH_PACIENTES, [nombre_final, fecha_nac, genero_final, documento_final, celular_final, correo_final, str(edad), fecha_reg])
-                    messagebox.showinfo("Éxito", "Paciente agregado correctamente.")
-                    # marcar que ya no está abierta antes de cerrar
-                    root._agregar_open = False
-                    win.destroy()
+                    registro = [nombre_final, fecha_nac, genero_final, documento_final, celular_final, correo_final, str(edad), fecha_reg]
+
+                    def registrado(agregado):
+                        btn_guardar.config(state="normal")
+                        if not agregado:
+                            messagebox.showerror("Error", "Ya existe un paciente con ese documento.")
+                            return
+                        messagebox.showinfo("Éxito", "Paciente agregado correctamente.")
+                        # marcar que ya no está abierta antes de cerrar
+                        root._agregar_open = False
+                        win.destroy()
+
+                    def fallo(error):
+                        btn_guardar.config(state="normal")
+                        messagebox.showerror("Error", f"No se pudo guardar el paciente: {error}")
+
+                    btn_guardar.config(state="disabled")  # Evita guardar dos veces mientras se escribe
+                    # La revisión del documento y la escritura se hacen en el hilo de almacenamiento
+                    en_segundo_plano(registrar_paciente, registro, al_terminar=registrado, al_fallar=fallo, ventana=win)
 
                 btn_guardar = tk.Button(frm, text="Botón Guardar Paciente", bg="#2A6F9E", fg="white", width=25, height=2, command=guardar_paciente)
                 btn_guardar.grid(row=7, column=1, pady=20, sticky="e")
 
+            @instrumentado("gui.on_consultar")
             def on_consultar():
                 win = tk.Toplevel(root)
                 win.title("Consultar Paciente")
@@ -766,21 +3393,22 @@ if __name__ == "__main__":
                 tree.configure(yscroll=scrollbar.set)
                 scrollbar.pack(side="right", fill="y")
 
+                @instrumentado("gui.mostrar_detalle_seleccion")
                 def mostrar_detalle_seleccion(event=None):
                     sel = tree.selection()
                     if not sel:
                         return
                     item = tree.item(sel[0])
                     doc = item["values"][0]
-                    # Buscar registro completo
-                    detalle = None
-                    for p in leer_registros(ARCH_PACIENTES):
-                        if _norm(p[3]) == _norm(str(doc)):
-                            detalle = p
-                            break
-                    if detalle is None:
+                    # Buscar registro completo con su historial (los pacientes abiertos hace poco salen de la caché)
+                    en_segundo_plano(vista_paciente, str(doc), al_terminar=abrir_detalle, ventana=win)
+
+                @instrumentado("gui.abrir_detalle")
+                def abrir_detalle(vista):
+                    if vista is None:
                         messagebox.showerror("Error", "Paciente no encontrado")
                         return
+                    detalle = vista["paciente"]
 
                     det_win = tk.Toplevel(win)
                     det_win.title("Detalle del paciente")
@@ -802,7 +3430,7 @@ if __name__ == "__main__":
                         ("Nombres:", nombres),
                         ("Apellidos:", apellidos),
                         ("Fecha de nacimiento:", detalle[1]),
-                        ("Edad:", f"{detalle[6]}"),
+                        ("Edad:", edad_paciente(detalle)),
                         ("Género:", detalle[2]),
                         ("Celular:", detalle[4]),
                         ("Correo electrónico:", detalle[5]),
@@ -817,7 +3445,7 @@ if __name__ == "__main__":
                     tk.Label(hist_frame, text="Enfermedades:", font=(None, 10, 'bold')).pack(anchor='w')
                     enf_list = tk.Frame(hist_frame)
                     enf_list.pack(fill='x', pady=(2,8))
-                    enf = [r for r in leer_registros(ARCH_ENFERMEDADES) if _norm(r[0]) == _norm(detalle[3])]
+                    enf = vista["enfermedades"]
                     if enf:
                         for e in enf:
                             tk.Label(enf_list, text=f"{e[3]}    {e[2]}").pack(anchor='w')
@@ -827,7 +3455,7 @@ if __name__ == "__main__":
                     tk.Label(hist_frame, text="Tratamientos:", font=(None, 10, 'bold')).pack(anchor='w')
                     tra_list = tk.Frame(hist_frame)
                     tra_list.pack(fill='x', pady=(2,8))
-                    tra = [r for r in leer_registros(ARCH_TRATAMIENTOS) if _norm(r[0]) == _norm(detalle[3])]
+                    tra = vista["tratamientos"]
                     if tra:
                         for t in tra:
                             tk.Label(tra_list, text=f"{t[3]}    {t[1]}").pack(anchor='w')
@@ -837,7 +3465,7 @@ if __name__ == "__main__":
                     tk.Label(hist_frame, text="Alergias:", font=(None, 10, 'bold')).pack(anchor='w')
                     ale_list = tk.Frame(hist_frame)
                     ale_list.pack(fill='x', pady=(2,8))
-                    ale = [r for r in leer_registros(ARCH_ALERGIAS) if _norm(r[0]) == _norm(detalle[3])]
+                    ale = vista["alergias"]
                     if ale:
                         for a in ale:
                             tk.Label(ale_list, text=f"{a[3]}    {a[1]}").pack(anchor='w')
@@ -846,6 +3474,7 @@ if __name__ == "__main__":
                     # Botones inferiores
                     btns = tk.Frame(df)
                     btns.pack(fill='x', pady=(12,0))
+                    @instrumentado("gui.open_edit")
                     def open_edit():
                         edit_win = tk.Toplevel(det_win)
                         edit_win.title("Editar Paciente")
@@ -883,6 +3512,7 @@ if __name__ == "__main__":
                         e_cor = tk.Entry(ef, width=40)
                         e_cor.grid(row=6, column=1, pady=6)
                         e_cor.insert(0, detalle[5])
+                        @instrumentado("gui.guardar_edicion")
                         def guardar_edicion():
                             nuevo_nombres = e_nombres.get().strip()
                             nuevo_apellidos = e_apellidos.get().strip()
@@ -916,10 +3546,6 @@ if __name__ == "__main__":
                             if not valido:
                                 messagebox.showerror("Error", msg)
                                 return
-                            # comprobar conflicto si cambia documento
-                            if documento_final != detalle[3] and existe_documento(documento_final):
-                                messagebox.showerror("Error", "Ya existe un paciente con ese documento.")
-                                return
                             valido, celular_final, msg = validar_celular(nuevo_cel, documento_final)
                             if not valido:
                                 messagebox.showerror("Error", msg)
@@ -928,17 +3554,29 @@ if __name__ == "__main__":
                             if not valido:
                                 messagebox.showerror("Error", msg)
                                 return
-                            # Actualizar registro
-                            todos = leer_registros(ARCH_PACIENTES)
-                            for i in range(len(todos)):
-                                if _norm(todos[i][3]) == _norm(detalle[3]):
-                                    todos[i] = [nombre_final, fecha_iso, genero_final, documento_final, celular_final, correo_final, str(edad_calc), todos[i][7]]
-                                    break
-                            escribir_registros(ARCH_PACIENTES, todos)
-                            messagebox.showinfo("Éxito", "Paciente actualizado.")
-                            edit_win.destroy()
-                            det_win.destroy()
-                        tk.Button(ef, text="Guardar cambios", bg="#2A6F9E", fg="white", command=guardar_edicion).grid(row=7, column=1, sticky='e', pady=12)
+                            nuevo_registro = [nombre_final, fecha_iso, genero_final, documento_final, celular_final, correo_final, str(edad_calc), detalle[7]]
+
+                            def actualizar():
+                                # Si cambia el documento, el conflicto se revisa dentro del bloqueo; la edición
+                                # se anota en el diario, sin reescribir todo el archivo
+                                return guardar_edicion_paciente(detalle[3], nuevo_registro)
+
+                            def actualizado(ok):
+                                btn_guardar_edicion.config(state="normal")
+                                if not ok:
+                                    messagebox.showerror("Error", "Ya existe un paciente con ese documento.")
+                                    return
+                                messagebox.showinfo("Éxito", "Paciente actualizado.")
+                                edit_win.destroy()
+                                det_win.destroy()
+
+                            btn_guardar_edicion.config(state="disabled")
+                            en_segundo_plano(actualizar, al_terminar=actualizado,
+                                             al_fallar=lambda error: (btn_guardar_edicion.config(state="normal"),
+                                                                      messagebox.showerror("Error", f"No se pudo actualizar: {error}")),
+                                             ventana=edit_win)
+                        btn_guardar_edicion = tk.Button(ef, text="Guardar cambios", bg="#2A6F9E", fg="white", command=guardar_edicion)
+                        btn_guardar_edicion.grid(row=7, column=1, sticky='e', pady=12)
                     def add_enfermedad_gui():
                         ae = tk.Toplevel(det_win)
                         ae.title("Nueva enfermedad")
@@ -962,21 +3600,30 @@ if __name__ == "__main__":
                         diag_lbl = tk.Label(f, text="El diagnóstico es: No determinada")
                         diag_lbl.grid(row=3, column=0, columnspan=4, sticky='w', pady=(8,0))
 
+                        @instrumentado("gui.diagnosticar_y_mostrar")
                         def diagnosticar_y_mostrar():
                             q1 = _norm(s1.get().strip())
                             q2 = _norm(s2.get().strip())
                             q3 = _norm(s3.get().strip())
                             nombre_enf = diagnosticar(q1, q2, q3)
-                            diag_lbl.config(text=f"El diagnóstico es: {nombre_enf}")
+                            texto = f"El diagnóstico es: {nombre_enf}"
+                            if nombre_enf == "No determinada":
+                                posibles = diagnosticar_parcial([q1, q2, q3], k=3)
+                                if posibles:
+                                    texto += "\nPosibles: " + ", ".join(f"{e} ({n}/{t})" for e, n, t in posibles)
+                            diag_lbl.config(text=texto, justify="left")
                             return nombre_enf
 
+                        @instrumentado("gui.guardar_enf")
                         def guardar_enf():
                             nombre_enf = diagnosticar_y_mostrar()
                             fecha_reg = ent_fecha.get().strip() or hoy()
                             sintomas_str = f"{_norm(s1.get().strip())},{_norm(s2.get().strip())},{_norm(s3.get().strip())}"
-                            agregar_registro(ARCH_ENFERMEDADES, [detalle[3], sintomas_str, nombre_enf, fecha_reg])
-                            messagebox.showinfo("Éxito", "Enfermedad registrada.")
-                            ae.destroy()
+                            def registrada(_):
+                                messagebox.showinfo("Éxito", "Enfermedad registrada.")
+                                ae.destroy()
+                            en_segundo_plano(agregar_registro, ARCH_ENFERMEDADES, [detalle[3], sintomas_str, nombre_enf, fecha_reg],
+                                             al_terminar=registrada, ventana=ae)
 
                         tk.Button(f, text="Diagnosticar", bg="#2A6F9E", fg='white', command=diagnosticar_y_mostrar).grid(row=2, column=0, sticky='w', pady=6)
                         tk.Button(f, text="Agregar Enfermedad", bg="#2A6F9E", fg='white', command=guardar_enf).grid(row=4, column=3, sticky='e', pady=8)
@@ -999,13 +3646,16 @@ if __name__ == "__main__":
                         tk.Label(f, text="Medicamentos (opcional)").grid(row=2, column=0, sticky='w')
                         meds = tk.Entry(f, width=40); meds.grid(row=2, column=1, pady=6, sticky='w')
 
+                        @instrumentado("gui.guardar_tra")
                         def guardar_tra():
                             fecha_reg = ent_fecha.get().strip() or hoy()
                             med_str = nombre.get().strip() or meds.get().strip()
                             dosis_str = ""
-                            agregar_registro(ARCH_TRATAMIENTOS, [detalle[3], med_str, dosis_str, fecha_reg])
-                            messagebox.showinfo("Éxito", "Tratamiento registrado.")
-                            at.destroy()
+                            def registrado(_):
+                                messagebox.showinfo("Éxito", "Tratamiento registrado.")
+                                at.destroy()
+                            en_segundo_plano(agregar_registro, ARCH_TRATAMIENTOS, [detalle[3], med_str, dosis_str, fecha_reg],
+                                             al_terminar=registrado, ventana=at)
 
                         tk.Button(f, text="Agregar Tratamiento", bg="#2A6F9E", fg='white', command=guardar_tra).grid(row=3, column=2, sticky='e', pady=8)
 
@@ -1027,11 +3677,14 @@ if __name__ == "__main__":
                         tk.Label(f, text="Síntomas (separados por comas)").grid(row=2, column=0, sticky='w')
                         sint = tk.Entry(f, width=40); sint.grid(row=2, column=1, pady=6)
 
+                        @instrumentado("gui.guardar_al")
                         def guardar_al():
                             fecha_reg = ent_fecha.get().strip() or hoy()
-                            agregar_registro(ARCH_ALERGIAS, [detalle[3], alerg.get().strip(), sint.get().strip().lower(), fecha_reg])
-                            messagebox.showinfo("Éxito", "Alergia registrada.")
-                            aa.destroy()
+                            def registrada(_):
+                                messagebox.showinfo("Éxito", "Alergia registrada.")
+                                aa.destroy()
+                            en_segundo_plano(agregar_registro, ARCH_ALERGIAS, [detalle[3], alerg.get().strip(), sint.get().strip().lower(), fecha_reg],
+                                             al_terminar=registrada, ventana=aa)
 
                         tk.Button(f, text="Agregar alergia", bg="#2A6F9E", fg='white', command=guardar_al).grid(row=3, column=1, sticky='e', pady=8)
                     tk.Button(btns, text="Editar Paciente", bg="#2A6F9E", fg='white', command=open_edit).pack(side='right', padx=6)
@@ -1040,40 +3693,92 @@ if __name__ == "__main__":
                     tk.Button(btns, text="Agregar Alergia", bg="#2A6F9E", fg='white', command=add_alergia_gui).pack(side='left', padx=6)
                     
 
+                # Cada búsqueda lleva un número; si llega el resultado de una búsqueda vieja (el usuario ya pidió
+                # otra) se descarta, y si aún no había empezado se cancela
+                busqueda = {"generacion": 0, "futuro": None}
+
+                @instrumentado("gui.buscar")
                 def buscar():
-                    # Limpiar tree
-                    for i in tree.get_children():
-                        tree.delete(i)
+                    if vivo["espera"] is not None:
+                        win.after_cancel(vivo["espera"])
+                        vivo["espera"] = None
+                    lbl_sugerencias.config(text="")
+                    clave_doc = ent_doc.get().strip()
+                    clave_nom = ent_nom.get().strip()
+                    clave_ape = ent_ape.get().strip()
 
+                    busqueda["generacion"] += 1
+                    generacion = busqueda["generacion"]
+                    if busqueda["futuro"] is not None:
+                        busqueda["futuro"].cancel()
+
+                    def mostrar(resultados):
+                        if generacion != busqueda["generacion"]:
+                            return
+                        # Limpiar tree
+                        tree.delete(*tree.get_children())
+                        if not resultados:
+                            messagebox.showinfo("Resultado", "No se encontraron pacientes.")
+                            return
+                        for r in resultados:
+                            tree.insert('', 'end', values=(r[3], r[0], r[2], edad_paciente(r)))
+
+                    # Unión de las tres búsquedas (por índice), en el orden del archivo y sin repetir pacientes
+                    busqueda["futuro"] = en_segundo_plano(buscar_para_consulta, clave_doc, clave_nom, clave_ape,
+                                                          al_terminar=mostrar, ventana=win)
+
+                # Búsqueda mientras se escribe: se espera a que el usuario deje de teclear (ESPERA_ESCRITURA_MS) y se
+                # muestran los primeros pacientes; si el texto solo creció, se refina el resultado anterior
+                vivo = {"espera": None, "anteriores": None}
+
+                def programar_busqueda(event=None):
+                    if vivo["espera"] is not None:
+                        win.after_cancel(vivo["espera"])
+                    vivo["espera"] = win.after(ESPERA_ESCRITURA_MS, buscar_en_vivo)
+
+                @instrumentado("gui.buscar_en_vivo")
+                def buscar_en_vivo():
+                    vivo["espera"] = None
                     clave_doc = ent_doc.get().strip()
                     clave_nom = ent_nom.get().strip()
                     clave_ape = ent_ape.get().strip()
 
-                    resultados = []
-                    for p in leer_registros(ARCH_PACIENTES):
-                        if clave_doc and _norm(p[3]) == _norm(clave_doc):
-                            resultados.append(p)
-                            continue
-                        nombre_norm = _norm(p[0])
-                        if clave_nom and clave_nom.strip() != "" and _norm(clave_nom) in nombre_norm:
-                            resultados.append(p)
-                            continue
-                        if clave_ape and clave_ape.strip() != "" and _norm(clave_ape) in nombre_norm:
-                            resultados.append(p)
-                            continue
-
-                    if not resultados:
-                        messagebox.showinfo("Resultado", "No se encontraron pacientes.")
+                    busqueda["generacion"] += 1
+                    generacion = busqueda["generacion"]
+                    if busqueda["futuro"] is not None:
+                        busqueda["futuro"].cancel()
+                    if not (clave_doc or clave_nom or clave_ape):
+                        tree.delete(*tree.get_children())
+                        lbl_sugerencias.config(text="")
                         return
 
-                    for r in resultados:
-                        tree.insert('', 'end', values=(r[3], r[0], r[2], r[6]))
+                    def mostrar(resultado):
+                        if generacion != busqueda["generacion"]:
+                            return
+                        registros, hay_mas, vivo["anteriores"] = resultado
+                        tree.delete(*tree.get_children())
+                        for r in registros:
+                            tree.insert('', 'end', values=(r[3], r[0], r[2], edad_paciente(r)))
+                        if hay_mas:
+                            lbl_sugerencias.config(text=f"Primeros {len(registros)} pacientes; siga escribiendo para afinar")
+                        else:
+                            lbl_sugerencias.config(text=f"{len(registros)} pacientes" if registros else "Sin coincidencias (pruebe el botón Consultar)")
+
+                    busqueda["futuro"] = en_segundo_plano(sugerencias_consulta, clave_doc, clave_nom, clave_ape, vivo["anteriores"],
+                                                          al_terminar=mostrar, ventana=win)
+
+                for entrada in (ent_doc, ent_nom, ent_ape):
+                    entrada.bind("<KeyRelease>", programar_busqueda)
+
+                lbl_sugerencias = tk.Label(frm, text="", fg="gray")
+                lbl_sugerencias.grid(row=3, column=0, sticky="w")
 
                 btn_buscar = tk.Button(frm, text="Botón Consultar Paciente", bg="#2A6F9E", fg="white", width=25, height=2, command=buscar)
                 btn_buscar.grid(row=3, column=1, pady=8, sticky="e")
 
                 tree.bind('<Double-1>', mostrar_detalle_seleccion)
 
+            @instrumentado("gui.on_listar")
             def on_listar():
                 win = tk.Toplevel(root)
                 win.title("Lista de pacientes")
@@ -1085,7 +3790,22 @@ if __name__ == "__main__":
                 lbl = tk.Label(frm, text="Lista de pacientes", font=("Segoe UI", 14))
                 lbl.pack(anchor="nw")
 
-                tree = ttk.Treeview(frm, columns=("doc","nombre","genero","edad","celular","fecha"), show="headings", height=12)
+                barra = tk.Frame(frm)
+                barra.pack(fill="x")
+                tk.Label(barra, text="Ordenar por").pack(side="left")
+                opciones_orden = {"Fecha de registro": "registro", "Documento": "documento", "Edad": "edad", "Nombre": "nombre"}
+                cb_orden = ttk.Combobox(barra, values=list(opciones_orden), state="readonly", width=20)
+                cb_orden.pack(side="left", padx=6)
+                cb_orden.current(0)
+                lbl_rango = tk.Label(barra, text="")
+                lbl_rango.pack(side="right")
+
+                # Lista virtual: el Treeview solo tiene las filas visibles y la barra de desplazamiento
+                # decide qué página pedir, así abrir la ventana no depende de cuántos pacientes haya
+                FILAS_VISIBLES = 12
+                cuerpo = tk.Frame(frm)
+                cuerpo.pack(fill="both", expand=True, pady=(10,8))
+                tree = ttk.Treeview(cuerpo, columns=("doc","nombre","genero","edad","celular","fecha"), show="headings", height=FILAS_VISIBLES)
                 tree.heading("doc", text="Documento")
                 tree.heading("nombre", text="Nombres")
                 tree.heading("genero", text="Género")
@@ -1098,11 +3818,71 @@ if __name__ == "__main__":
                 tree.column("edad", width=60, anchor="center")
                 tree.column("celular", width=110, anchor="center")
                 tree.column("fecha", width=140)
-                tree.pack(fill="both", expand=True, pady=(10,8))
-
-                pacientes = leer_registros(ARCH_PACIENTES)
-                for p in pacientes:
-                    tree.insert('', 'end', values=(p[3], p[0], p[2], p[6], p[4], p[7]))
+                tree.pack(side="left", fill="both", expand=True)
+                scroll_lista = ttk.Scrollbar(cuerpo, orient="vertical")
+                scroll_lista.pack(side="right", fill="y")
+
+                vista = {"inicio": 0, "total": 0, "generacion": 0, "futuro": None}
+
+                def leer_pagina(orden, inicio):
+                    total = total_pacientes()
+                    inicio = max(0, min(inicio, total - FILAS_VISIBLES))
+                    return total, inicio, pagina_pacientes(orden, inicio, FILAS_VISIBLES)
+
+                # La página se lee en el hilo de almacenamiento; si mientras tanto se pidió otra, esta se descarta
+                def pintar_pagina():
+                    vista["generacion"] += 1
+                    generacion = vista["generacion"]
+                    if vista["futuro"] is not None:
+                        vista["futuro"].cancel()
+                    vista["futuro"] = en_segundo_plano(leer_pagina, opciones_orden[cb_orden.get()], vista["inicio"],
+                                                       al_terminar=lambda r: mostrar_pagina(generacion, *r), ventana=win)
+
+                @instrumentado("gui.mostrar_pagina")
+                def mostrar_pagina(generacion, total, inicio, pagina):
+                    if generacion != vista["generacion"]:
+                        return
+                    vista["total"] = total
+                    vista["inicio"] = inicio
+                    tree.delete(*tree.get_children())
+                    for p in pagina:
+                        tree.insert('', 'end', values=(p[3], p[0], p[2], edad_paciente(p), p[4], p[7]))
+                    if total:
+                        scroll_lista.set(inicio / total, (inicio + len(pagina)) / total)
+                        lbl_rango.config(text=f"{inicio + 1}-{inicio + len(pagina)} de {total}")
+                    else:
+                        scroll_lista.set(0, 1)
+                        lbl_rango.config(text="No hay pacientes registrados")
+
+                def desplazar(accion, cantidad, unidad=None):
+                    # Recibe los mismos argumentos que el comando "yview" de Tk: moveto <fracción> o scroll <n> units|pages
+                    if accion == "moveto":
+                        vista["inicio"] = int(float(cantidad) * vista["total"])
+                    elif accion == "scroll":
+                        paso = FILAS_VISIBLES if unidad == "pages" else 1
+                        vista["inicio"] += int(cantidad) * paso
+                    pintar_pagina()
+
+                def rueda(event):
+                    if event.num == 4 or event.delta > 0:
+                        desplazar("scroll", -3, "units")
+                    else:
+                        desplazar("scroll", 3, "units")
+                    return "break"  # Evita que el Treeview intente desplazarse por su cuenta
+
+                @instrumentado("gui.cambiar_orden")
+                def cambiar_orden(event=None):
+                    vista["inicio"] = 0
+                    pintar_pagina()
+
+                scroll_lista.configure(command=desplazar)
+                tree.bind("<MouseWheel>", rueda)  # Windows y macOS
+                tree.bind("<Button-4>", rueda)    # Linux
+                tree.bind("<Button-5>", rueda)
+                tree.bind("<Prior>", lambda e: desplazar("scroll", -1, "pages"))
+                tree.bind("<Next>", lambda e: desplazar("scroll", 1, "pages"))
+                cb_orden.bind("<<ComboboxSelected>>", cambiar_orden)
+                pintar_pagina()
 
                 btn_volver = tk.Button(frm, text="Volver al menú", bg="#2A6F9E", fg="white", width=18, height=2, command=win.destroy)
                 btn_volver.pack(anchor="e", pady=6)
@@ -1121,11 +3901,7 @@ if __name__ == "__main__":
             canvas = tk.Canvas(left, width=200, height=200)
             canvas.pack(pady=5)
             try:
-                if PIL_AVAILABLE:
-                    img = Image.open("logo.png").resize((160, 160), Image.LANCZOS)
-                    photo = ImageTk.PhotoImage(img)
-                else:
-                    photo = tk.PhotoImage(file="logo.png")
+                photo = cargar_logo()
                 canvas.create_image(100, 100, image=photo)
                 # Guardar referencia para evitar que sea recolectada
                 canvas.image = photo
@@ -1142,6 +3918,10 @@ if __name__ == "__main__":
             btn_list = tk.Button(right, text="Botón Listar Pacientes", width=25, height=2, bg="#2A6F9E", fg="white", command=on_listar)
             btn_list.pack(pady=10)
 
+            # El índice de pacientes se arma en el hilo de almacenamiento apenas se muestra la ventana, así la
+            # primera búsqueda no lo espera. Hasta entonces las consultas por documento usan pacientes.idx
+            root.after_idle(lambda: en_segundo_plano(indice_pacientes))
+
             root.mainloop()
         except Exception:
             # Si ocurre cualquier error con la GUI, volver al menú de consola